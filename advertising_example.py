@@ -1,5 +1,6 @@
-import paiv_utils as paiv
+import ivi_utils as paiv
 import argparse as ap
+import json
 
 class SmartFormatterMixin(ap.HelpFormatter):
     # ref:
@@ -50,6 +51,131 @@ def _parser():
                         'Default: %(default)s)')
     parser.set_defaults(force_refresh=False)
 
+    parser.add_argument('--single_pass', dest='single_pass', action='store_true',
+                        help='S|--single_pass : decode the video once, writing annotated frames as their scores arrive '
+                        'Default: %(default)s)')
+    parser.set_defaults(single_pass=False)
+
+    parser.add_argument('--full_frame_rate', dest='full_frame_rate', action='store_true',
+                        help='S|--full_frame_rate : write every frame, interpolating boxes between sampled frames '
+                        'Default: %(default)s)')
+    parser.set_defaults(full_frame_rate=False)
+
+    parser.add_argument(
+        '--draw_threads', type=int, default=None, required=False,
+        help='S|Number of threads drawing annotations.  Default: one per core')
+
+    parser.add_argument(
+        '--pipeline', type=str, default="threads", required=False, choices=["threads", "processes"],
+        help='S|Draw and encode frames on threads, or in --draw_threads processes sharing the frames through shared memory.  Default: %(default)s')
+
+    parser.add_argument(
+        '--num_procs', type=int, default=1, required=False,
+        help='S|Split the video into this many segments annotated in parallel processes.  Default: %(default)s')
+
+    parser.add_argument(
+        '--counter_mode', type=str, default="screen_time", required=False,
+        choices=["counts", "screen_time", "unique", "dwell", "visible"],
+        help='S|Counter box : raw box counts / screen time, or tracked unique objects / dwell time / objects in view'
+             'Default: %(default)s')
+
+    parser.add_argument(
+        '--reader', type=str, default="cv2", required=False, choices=["cv2", "pyav"],
+        help='S|Input video decoder : cv2, or PyAV (multi-threaded decode, for high resolution H.264/H.265 sources).  Default: %(default)s')
+
+    parser.add_argument(
+        '--decode_threads', type=int, default=0, required=False,
+        help='S|PyAV reader decoding threads, 0 is one per core.  Default: %(default)s')
+
+    parser.add_argument(
+        '--decode_size', type=str, default=None, required=False,
+        help='S|--decode_size=WxH : score and annotate frames scaled to this size (e.g. 1280x720).  Default: source size')
+
+    parser.add_argument(
+        '--writer', type=str, default="cv2", required=False, choices=["cv2", "ffmpeg"],
+        help='S|Output video encoder : cv2 (mp4v) or a local ffmpeg (H.264/H.265).  Default: %(default)s')
+
+    parser.add_argument(
+        '--codec', type=str, default="h264", required=False, choices=["h264", "h265"],
+        help='S|ffmpeg writer codec.  Default: %(default)s')
+
+    parser.add_argument(
+        '--preset', type=str, default="veryfast", required=False,
+        help='S|ffmpeg writer encoder preset (ultrafast ... veryslow).  Default: %(default)s')
+
+    parser.add_argument(
+        '--crf', type=int, default=None, required=False,
+        help='S|ffmpeg writer constant rate factor, lower is better quality.  Default: encoder default')
+
+    parser.add_argument(
+        '--encode_threads', type=int, default=0, required=False,
+        help='S|ffmpeg writer encoder threads, 0 lets ffmpeg pick.  Default: %(default)s')
+
+    parser.add_argument('--copy_audio', dest='copy_audio', action='store_true',
+                        help='S|--copy_audio : copy the source audio track (needs --writer ffmpeg and --full_frame_rate) '
+                        'Default: %(default)s)')
+    parser.set_defaults(copy_audio=False)
+
+    parser.add_argument('--stream', dest='stream', action='store_true',
+                        help='S|--stream : real time mode for live feeds (camera index or stream url in --input_video, files are '
+                        'replayed at their frame rate).  Frames are drawn with the latest detections and never wait for the model '
+                        'Default: %(default)s)')
+    parser.set_defaults(stream=False)
+
+    parser.add_argument(
+        '--latency_budget', type=float, default=0.5, required=False,
+        help='S|stream mode : max age in seconds of the detections drawn, later results are dropped.  Default: %(default)s')
+
+    parser.add_argument(
+        '--max_inflight', type=int, default=2, required=False,
+        help='S|stream mode : max outstanding requests, frames are skipped for inference beyond that.  Default: %(default)s')
+
+    parser.add_argument(
+        '--mosaic_grid', type=str, default=None, required=False,
+        help='S|Score CxR frames per request, tiled into one mosaic image (e.g. 2x2).  Default: one frame per request')
+
+    parser.add_argument(
+        '--mosaic_settings', type=str, default=None, required=False,
+        help='S|json file of mosaic settings per model url (see ivi_mosaic.mosaic_settings), instead of --mosaic_grid')
+
+    parser.add_argument(
+        '--adaptive_max_stride', type=int, default=None, required=False,
+        help='S|Adaptive sampling : score every --sample_rate frames while the detections change, backing off to\n'
+             'one frame in adaptive_max_stride while they are stable.  Default: fixed --sample_rate')
+
+    parser.add_argument(
+        '--min_confidence', type=float, default=None, required=False,
+        help='S|Drop boxes below this confidence.  Default: keep all')
+
+    parser.add_argument(
+        '--class_thresholds', type=str, default=None, required=False,
+        help='S|Per label confidence thresholds as json, e.g. \'{"cat" : 0.6, "dog" : 0.4}\'')
+
+    parser.add_argument(
+        '--nms_iou', type=float, default=None, required=False,
+        help='S|Merge overlapping boxes of a label above this IoU (class wise NMS).  Default: no NMS')
+
+    parser.add_argument(
+        '--top_k', type=int, default=None, required=False,
+        help='S|Keep at most top_k boxes per label.  Default: all')
+
+    parser.add_argument(
+        '--tile_size', type=str, default=None, required=False,
+        help='S|Score each frame as overlapping WxH tiles (e.g. 1024x1024) merged with NMS, for small objects in high resolution video')
+
+    parser.add_argument(
+        '--tile_overlap', type=float, default=0.2, required=False,
+        help='S|Fraction of a tile shared with its neighbours.  Default: %(default)s')
+
+    parser.add_argument(
+        '--tile_threads', type=int, default=8, required=False,
+        help='S|Concurrent tile requests.  Default: %(default)s')
+
+    parser.add_argument(
+        '--output_mode', type=str, default="video", required=False, choices=["video", "sidecar"],
+        help='S|video : annotated video.  sidecar : only the detections as JSON / WebVTT box tracks and per label '
+             'screen time intervals, no video is encoded.  Default: %(default)s')
+
     parser.add_argument(
         '--sample_rate', type=int, default=100, required=False,
         help='S|Frame sample rate.  sample_rate = 2 means sample at 2X rate'
@@ -72,8 +198,45 @@ def main():
     for argk in vars(args) :
         paiv.nprint("{} {}".format(argk,vars(args)[argk]))
 
+    writer_args = {}
+    if(args.writer == "ffmpeg") :
+        writer_args = {'codec' : args.codec, 'preset' : args.preset, 'crf' : args.crf, 'threads' : args.encode_threads}
+    reader_args = {}
+    if(args.reader == "pyav") :
+        reader_args['threads'] = args.decode_threads
+    if(args.decode_size != None) :
+        reader_args['size'] = [int(n) for n in args.decode_size.split("x")]
+
+    mosaic = None
+    if(args.mosaic_settings != None) :
+        mosaic = paiv.mosaic_settings(args.model_url, args.mosaic_settings)
+    elif(args.mosaic_grid != None) :
+        mosaic = {'grid' : [int(n) for n in args.mosaic_grid.split("x")]}
+
+    postprocess = None
+    if(args.min_confidence != None or args.class_thresholds != None or args.nms_iou != None or args.top_k != None) :
+        postprocess = paiv.PostProcessor(min_confidence=args.min_confidence, iou_threshold=args.nms_iou, top_k=args.top_k,
+                                         class_thresholds=None if args.class_thresholds == None else json.loads(args.class_thresholds))
+    adaptive = None
+    if(args.adaptive_max_stride != None) :
+        adaptive = {'max_stride' : args.adaptive_max_stride}
+    tiling = None
+    if(args.tile_size != None) :
+        tiling = {'tile_size' : [int(n) for n in args.tile_size.split("x")], 'overlap' : args.tile_overlap, 'num_threads' : args.tile_threads}
+
+    if(args.stream) :
+        # --sample_rate is the min number of frames between two requests
+        paiv.stream_video_objdet(args.input_video, args.model_url, output_directory=args.output_directory, output_fn=args.output_filename,
+                                 latency_budget=args.latency_budget, max_inflight=args.max_inflight, sample_rate=args.sample_rate,
+                                 counter_mode=args.counter_mode, writer=args.writer, writer_args=writer_args, postprocess=postprocess)
+        return
+
     paiv.edit_video_objdet(input_video=args.input_video, model_url=args.model_url, output_directory=args.output_directory\
-                           ,output_fn=args.output_filename, force_refresh=args.force_refresh, max_frames=5000, sample_rate=args.sample_rate, counter_mode="screen_time")
+                           ,output_fn=args.output_filename, force_refresh=args.force_refresh, max_frames=5000, sample_rate=args.sample_rate, counter_mode=args.counter_mode\
+                           ,single_pass=args.single_pass, draw_threads=args.draw_threads, full_frame_rate=args.full_frame_rate, num_procs=args.num_procs\
+                           ,writer=args.writer, writer_args=writer_args, copy_audio=args.copy_audio\
+                           ,output_mode=args.output_mode, mosaic=mosaic, tiling=tiling,
+                           postprocess=postprocess, adaptive=adaptive, pipeline=args.pipeline, reader=args.reader, reader_args=reader_args)
 
     paiv.nprint("Program Finished")
     for argk in vars(args) :
@@ -82,6 +245,5 @@ def main():
 if __name__== "__main__":
   main()
 
-# Todo : add threading for quicker video building
 # Todo : add custom logic for tracking ball touches with denoising / smoothing
 # Todo : add custom logic for displaying number of players at any given time with denoising / smoothing
@@ -1,4 +1,4 @@
-import paiv_utils as paiv
+import ivi_utils as paiv
 import argparse as ap
 
 class SmartFormatterMixin(ap.HelpFormatter):
@@ -67,12 +67,11 @@ def main():
     #args.force_refresh = True
     for argk in vars(args) :
         print(argk,vars(args)[argk])
-    paiv.edit_video(input_video=args.input_video, model_url=args.model_url, output_directory=args.output_directory\
-                    ,output_fn="custom.mov", force_refresh=args.force_refresh, max_frames=5000, sample_rate=args.sample_rate)
+    paiv.edit_video_objdet(input_video=args.input_video, model_url=args.model_url, output_directory=args.output_directory\
+                           ,output_fn="custom.mov", force_refresh=args.force_refresh, max_frames=5000, sample_rate=args.sample_rate)
 
 if __name__== "__main__":
   main()
 
-# Todo : add threading for quicker video building
 # Todo : add custom logic for tracking ball touches with denoising / smoothing
 # Todo : add custom logic for displaying number of players at any given time with denoising / smoothing
@@ -0,0 +1,87 @@
+import ivi_utils as paiv
+import argparse as ap
+
+class SmartFormatterMixin(ap.HelpFormatter):
+    # ref:
+    # http://stackoverflow.com/questions/3853722/python-argparse-how-to-insert-newline-in-the-help-text
+    # @IgnorePep8
+
+    def _split_lines(self, text, width):
+        # this is the RawTextHelpFormatter._split_lines
+        if text.startswith('S|'):
+            return text[2:].splitlines()
+        return ap.HelpFormatter._split_lines(self, text, width)
+
+
+class CustomFormatter(ap.RawDescriptionHelpFormatter, SmartFormatterMixin):
+    '''Convenience formatter_class for argparse help print out.'''
+
+
+def _parser():
+    parser = ap.ArgumentParser(description='Tool to measure a deployed model endpoint and save the client settings it runs best at '
+                                           '(concurrent requests, jpeg quality) to a profile that later runs load automatically '
+                                           '  python autotune.py --model_url=https://xxx.xxx.xxx.xxx/powerai-vision/api/dlapis/model-a --input_video=/tmp/myvideo.mp4',
+                               formatter_class=CustomFormatter)
+
+    parser.add_argument(
+        '--model_url', action='store', nargs='?', required=True,
+        help='S|--model_url=<deployed model endpoint, or a local stand-in>')
+
+    parser.add_argument(
+        '--input_video', action='store', nargs='?', required=False, default=None,
+        help='S|--input_video=<video to take probe frames from>.  Also used to recommend a real time sample_rate')
+
+    parser.add_argument(
+        '--data_directory', action='store', nargs='?', required=False, default=None,
+        help='S|--data_directory=<directory of images to probe with> (instead of --input_video)')
+
+    parser.add_argument(
+        '--num_images', type=int, default=8, required=False,
+        help='S|Number of probe images.  Default: %(default)s')
+
+    parser.add_argument(
+        '--levels', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32], required=False,
+        help='S|Concurrency levels to try, in order.  Default: %(default)s')
+
+    parser.add_argument(
+        '--qualities', type=int, nargs='+', default=[95, 85, 75], required=False,
+        help='S|jpeg qualities to try, the first is the reference.  Default: %(default)s')
+
+    parser.add_argument(
+        '--requests_per_level', type=int, default=None, required=False,
+        help='S|Requests sent per measurement.  Default: max(3 x level, 2 x num_images, 16)')
+
+    parser.add_argument(
+        '--min_gain', type=float, default=0.1, required=False,
+        help='S|Stop adding threads once throughput improves by less than this fraction.  Default: %(default)s')
+
+    parser.add_argument(
+        '--max_error_rate', type=float, default=0.02, required=False,
+        help='S|Highest acceptable fraction of failed requests.  Default: %(default)s')
+
+    parser.add_argument(
+        '--profile_fn', action='store', nargs='?', required=False, default=None,
+        help='S|--profile_fn=<profile file>.  Default: $PAIV_PROFILE or ~/.paiv_profile.json')
+
+    parser.add_argument(
+        '--dry_run', dest='dry_run', action='store_true',
+        help='S|--dry_run : only report the recommended settings, do not save them')
+    parser.set_defaults(dry_run=False)
+
+    args = parser.parse_args()
+
+    return args
+
+
+def main():
+    # Parse command line argument
+    args = _parser()
+    for argk in vars(args) :
+        paiv.nprint("{} {}".format(argk,vars(args)[argk]))
+
+    (images, fps) = paiv.probe_images(video_fn=args.input_video, image_dir=args.data_directory, count=args.num_images)
+    paiv.autotune(args.model_url, images, levels=args.levels, qualities=args.qualities, requests_per_level=args.requests_per_level,
+                  min_gain=args.min_gain, max_error_rate=args.max_error_rate, fps=fps, profile_fn=args.profile_fn, save=not args.dry_run)
+
+if __name__== "__main__":
+  main()
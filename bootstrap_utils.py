@@ -0,0 +1,231 @@
+import numpy as np
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict
+
+# Bootstrap confidence intervals for validate_model.
+# Everything is driven off a MatchTable : per image tp/fp/fn counts per class plus a
+# flat table of detections (image, class, confidence, tp flag) used for AP.
+# A resample is just a row of per image weights (how many times each image was drawn),
+# so every metric for a whole chunk of resamples is a handful of matrix ops.
+
+
+class MatchTable():
+    '''
+    data structure to hold the per image match results of a validation run
+    tp, fp, fn   : (num_images, num_classes) counts
+    correct,total: (num_images,) matched / total label pairs (for overall accuracy)
+    det_*        : one entry per predicted label, sorted by class then descending confidence
+    '''
+    def __init__(self, classes, tp, fp, fn, correct, total, det_img, det_cls, det_conf, det_tp):
+        self.classes = classes
+        self.tp = tp
+        self.fp = fp
+        self.fn = fn
+        self.correct = correct
+        self.total = total
+        self.det_img = det_img
+        self.det_cls = det_cls
+        self.det_conf = det_conf
+        self.det_tp = det_tp
+
+    def num_images(self):
+        return self.tp.shape[0]
+
+
+def match_classes(image_matches, null_label="null"):
+    # sorted list of every label seen in the ground truth or the predictions
+    classes = set()
+    for m in image_matches :
+        classes.update(m['ytrue'])
+        classes.update(m['ypred'])
+    classes.discard(null_label)
+    return sorted(classes)
+
+
+def build_match_table(image_matches, null_label="null", classes=None):
+    '''
+    Build a MatchTable from a list of per image match results.
+    image_matches : list of dicts {'ytrue' : [labels], 'ypred' : [labels], 'detections' : [(label, confidence), ...]}
+                    ytrue/ypred are the zipped lists from return_ytrue_ypre_*, detections are the raw model predictions
+    classes       : class list to use (so tables of several models line up).  Default : every label seen
+    returns : MatchTable
+    '''
+    if(classes == None) :
+        classes = match_classes(image_matches, null_label)
+    cidx = {c : i for (i, c) in enumerate(classes)}
+
+    n = len(image_matches)
+    nc = len(classes)
+    tp = np.zeros((n, nc), dtype=np.float32)
+    fp = np.zeros((n, nc), dtype=np.float32)
+    fn = np.zeros((n, nc), dtype=np.float32)
+    correct = np.zeros(n, dtype=np.float32)
+    total = np.zeros(n, dtype=np.float32)
+    det_img = []
+    det_cls = []
+    det_conf = []
+    det_tp = []
+
+    for (i, m) in enumerate(image_matches) :
+        ntrue = defaultdict(int)
+        for (yt, yp) in zip(m['ytrue'], m['ypred']) :
+            if(yt != null_label) :
+                ntrue[yt] += 1
+            if(yt == yp) :
+                tp[i, cidx[yt]] += 1
+                correct[i] += 1
+            else :
+                if(yp != null_label) :
+                    fp[i, cidx[yp]] += 1
+                if(yt != null_label) :
+                    fn[i, cidx[yt]] += 1
+            total[i] += 1
+
+        # Highest confidence predictions of a class are the ones credited with the matches
+        by_label = defaultdict(list)
+        for (label, conf) in m['detections'] :
+            if(label in cidx) :
+                by_label[label].append(float(conf))
+        for (label, confs) in by_label.items() :
+            confs = sorted(confs, reverse=True)
+            for (j, conf) in enumerate(confs) :
+                det_img.append(i)
+                det_cls.append(cidx[label])
+                det_conf.append(conf)
+                det_tp.append(1.0 if j < ntrue[label] else 0.0)
+
+    det_img = np.asarray(det_img, dtype=np.int64)
+    det_cls = np.asarray(det_cls, dtype=np.int64)
+    det_conf = np.asarray(det_conf, dtype=np.float64)
+    det_tp = np.asarray(det_tp, dtype=np.float32)
+    order = np.lexsort((-det_conf, det_cls))
+
+    return MatchTable(classes, tp, fp, fn, correct, total,
+                      det_img[order], det_cls[order], det_conf[order], det_tp[order])
+
+
+def _safe_div(num, den) :
+    return np.divide(num, den, out=np.zeros(np.broadcast(num, den).shape), where=den != 0)
+
+
+def _resample_weights(rng, num_images, num_resamples) :
+    # weights[b,i] = number of times image i was drawn in resample b
+    idx = rng.integers(0, num_images, size=(num_resamples, num_images))
+    idx += (np.arange(num_resamples) * num_images)[:, None]
+    counts = np.bincount(idx.ravel(), minlength=num_resamples * num_images)
+    return counts.reshape(num_resamples, num_images).astype(np.float32)
+
+
+def _weighted_metrics(table, w) :
+    '''
+    Compute all metrics for a batch of resample weights w (num_resamples, num_images), whole numbers (draw counts).
+    returns : dict of precision/recall/ap (num_resamples, num_classes) and accuracy/map (num_resamples,)
+    '''
+    tp = w @ table.tp
+    fp = w @ table.fp
+    fn = w @ table.fn
+    npos = tp + fn
+
+    rv = {}
+    rv['precision'] = _safe_div(tp, tp + fp)
+    rv['recall'] = _safe_div(tp, npos)
+    rv['accuracy'] = _safe_div(w @ table.correct, w @ table.total)
+
+    # Non interpolated AP : sum of precision at each true positive, over the number of positives.
+    # Detections are sorted by class then confidence, so each class is one contiguous segment.
+    # Only true positive columns contribute to the sum, so precision is only evaluated at those :
+    # the detections ranked up to a true positive are the true positives plus the false positives before it,
+    # so only the weights of the true positives and of the false positives are gathered and summed.
+    nc = len(table.classes)
+    ap = np.zeros((w.shape[0], nc))
+    tp_cols = np.flatnonzero(table.det_tp)
+    if(len(tp_cols) > 0) :
+        nr = w.shape[0]
+        fp_cols = np.flatnonzero(table.det_tp == 0)
+        # np.take keeps the rows contiguous (w[:, idx] does not), the cumulative sums run along them
+        wtp = np.take(w, table.det_img[tp_cols], axis=1)
+        wfp = np.take(w, table.det_img[fp_cols], axis=1)
+
+        # cumulative sums with a leading zero column so segment bases are a plain gather
+        ctp = np.zeros((nr, len(tp_cols) + 1), dtype=np.float32)
+        np.cumsum(wtp, axis=1, out=ctp[:, 1:])
+        cfp = np.zeros((nr, len(fp_cols) + 1), dtype=np.float32)
+        np.cumsum(wfp, axis=1, out=cfp[:, 1:])
+
+        tp_cls = table.det_cls[tp_cols]
+        (seg_cls, tp_starts) = np.unique(tp_cls, return_index=True)
+        det_starts = np.searchsorted(table.det_cls, tp_cls)
+        tp_base = tp_starts[np.searchsorted(seg_cls, tp_cls)]
+        # false positives ranked before each true positive, and before its class segment
+        fp_upto = np.searchsorted(fp_cols, tp_cols)
+        fp_base = np.searchsorted(fp_cols, det_starts)
+
+        ctp = ctp[:, 1:] - np.take(ctp, tp_base, axis=1)
+        call = ctp + np.take(cfp, fp_upto, axis=1)
+        call -= np.take(cfp, fp_base, axis=1)
+        # weights are draw counts : a ranked weight is 0 (and so is ctp) or at least 1, no masked divide needed
+        np.maximum(call, 1, out=call)
+        np.divide(ctp, call, out=ctp)
+        ctp *= wtp
+        ap[:, seg_cls] = np.add.reduceat(ctp, tp_starts, axis=1)
+    ap = _safe_div(ap, npos)
+    ap[npos == 0] = np.nan
+    rv['ap'] = ap
+
+    has_pos = npos > 0
+    rv['map'] = _safe_div(np.nansum(ap, axis=1), has_pos.sum(axis=1))
+
+    return rv
+
+
+def point_metrics(table) :
+    '''
+    Metrics of the table itself (no resampling)
+    returns : dict of precision/recall/ap arrays aligned with table.classes, accuracy and map floats
+    '''
+    rv = _weighted_metrics(table, np.ones((1, table.num_images()), dtype=np.float32))
+    return {k : v[0] for (k, v) in rv.items()}
+
+
+def _bootstrap_chunk(table, num_resamples, seed) :
+    rng = np.random.default_rng(seed)
+    w = _resample_weights(rng, table.num_images(), num_resamples)
+    return _weighted_metrics(table, w)
+
+
+def bootstrap_metrics(table, num_resamples=1000, ci=0.95, num_procs=1, seed=None, chunk_size=100) :
+    '''
+    Bootstrap confidence intervals over images for per class precision/recall/AP, overall accuracy and mAP
+    table         : MatchTable from build_match_table
+    num_resamples : number of bootstrap resamples
+    ci            : width of the confidence interval (percentile method)
+    num_procs     : > 1 spreads chunks of resamples across a process pool
+    seed          : seed for reproducible intervals
+    chunk_size    : resamples computed per vectorized batch (bounds memory)
+    returns : dict metric -> {'estimate' : point estimate, 'low' : lower bound, 'high' : upper bound}
+              per class metrics are arrays aligned with table.classes
+    '''
+    point = point_metrics(table)
+
+    sizes = [chunk_size] * (num_resamples // chunk_size)
+    if(num_resamples % chunk_size) :
+        sizes.append(num_resamples % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if(num_procs > 1 and len(sizes) > 1) :
+        with ProcessPoolExecutor(max_workers=num_procs) as pool :
+            chunks = list(pool.map(_bootstrap_chunk, [table] * len(sizes), sizes, seeds))
+    else :
+        chunks = [_bootstrap_chunk(table, s, sd) for (s, sd) in zip(sizes, seeds)]
+
+    alpha = (1.0 - ci) / 2.0
+    rv = {}
+    for k in point.keys() :
+        samples = np.concatenate([c[k] for c in chunks], axis=0)
+        with warnings.catch_warnings() :
+            # classes with no ground truth have an all nan AP column
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            (low, high) = np.nanpercentile(samples, [100.0 * alpha, 100.0 * (1.0 - alpha)], axis=0)
+        rv[k] = {'estimate' : point[k], 'low' : low, 'high' : high}
+    return rv
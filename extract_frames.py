@@ -0,0 +1,107 @@
+import ivi_utils as paiv
+import argparse as ap
+
+class SmartFormatterMixin(ap.HelpFormatter):
+    # ref:
+    # http://stackoverflow.com/questions/3853722/python-argparse-how-to-insert-newline-in-the-help-text
+    # @IgnorePep8
+
+    def _split_lines(self, text, width):
+        # this is the RawTextHelpFormatter._split_lines
+        if text.startswith('S|'):
+            return text[2:].splitlines()
+        return ap.HelpFormatter._split_lines(self, text, width)
+
+
+class CustomFormatter(ap.RawDescriptionHelpFormatter, SmartFormatterMixin):
+    '''Convenience formatter_class for argparse help print out.'''
+
+
+def _parser():
+    parser = ap.ArgumentParser(description='Tool to save sampled frames of a video as images, e.g. to build a labeling dataset '
+                                           '  python extract_frames.py --input_video=/tmp/myvideo.mp4 --output_directory=/tmp/frames --every_secs=1 --image_format=jpg',
+                               formatter_class=CustomFormatter)
+
+    parser.add_argument(
+        '--input_video', action='store', nargs='?', required=True,
+        help='S|--input_video=<video file name>')
+
+    parser.add_argument(
+        '--output_directory', action='store', nargs='?', required=True,
+        help='S|--output_directory=<directory the images and manifest.csv are written to>')
+
+    parser.add_argument(
+        '--sample_rate', type=int, default=1, required=False,
+        help='S|Save every sample_rate\'th frame.  Default: %(default)s')
+
+    parser.add_argument(
+        '--every_secs', type=float, default=None, required=False,
+        help='S|Save one frame every every_secs seconds (instead of --sample_rate)')
+
+    parser.add_argument(
+        '--start_frame', type=int, default=0, required=False,
+        help='S|First frame.  Default: %(default)s')
+
+    parser.add_argument(
+        '--end_frame', type=int, default=None, required=False,
+        help='S|Stop before this frame.  Default: end of the video')
+
+    parser.add_argument(
+        '--start_time', type=float, default=None, required=False,
+        help='S|Start at this many seconds (instead of --start_frame)')
+
+    parser.add_argument(
+        '--end_time', type=float, default=None, required=False,
+        help='S|Stop at this many seconds (instead of --end_frame)')
+
+    parser.add_argument(
+        '--max_frames', type=int, default=None, required=False,
+        help='S|Save at most this many frames')
+
+    parser.add_argument(
+        '--image_format', type=str, default="jpg", required=False, choices=["jpg", "png", "webp"],
+        help='S|Image format.  Default: %(default)s')
+
+    parser.add_argument(
+        '--quality', type=int, default=None, required=False,
+        help='S|jpg / webp quality 0-100, png compression 0-9.  Default: the opencv default')
+
+    parser.add_argument(
+        '--num_threads', type=int, default=4, required=False,
+        help='S|Threads encoding and writing images.  Default: %(default)s')
+
+    parser.add_argument(
+        '--reader', type=str, default="cv2", required=False, choices=["cv2", "pyav"],
+        help='S|Video decoder : cv2, or PyAV (multi-threaded decode, timestamps from the frames).  Default: %(default)s')
+
+    parser.add_argument(
+        '--decode_threads', type=int, default=0, required=False,
+        help='S|PyAV reader decoding threads, 0 is one per core.  Default: %(default)s')
+
+    parser.add_argument('--keyframes_only', dest='keyframes_only', action='store_true',
+                        help='S|--keyframes_only : save every keyframe in the range instead of sampling (uses the PyAV reader)')
+    parser.set_defaults(keyframes_only=False)
+
+    args = parser.parse_args()
+
+    return args
+
+
+def main():
+    # Parse command line argument
+    args = _parser()
+    for argk in vars(args) :
+        paiv.nprint("{} {}".format(argk,vars(args)[argk]))
+
+    reader_args = {}
+    if(args.keyframes_only) :
+        (args.reader, reader_args['keyframes_only']) = ("pyav", True)
+    if(args.reader == "pyav") :
+        reader_args['threads'] = args.decode_threads
+    paiv.extract_frames(args.input_video, args.output_directory, sample_rate=args.sample_rate, start_frame=args.start_frame,
+                        end_frame=args.end_frame, start_time=args.start_time, end_time=args.end_time, every_secs=args.every_secs,
+                        max_frames=args.max_frames, image_format=args.image_format, quality=args.quality, num_threads=args.num_threads,
+                        reader=args.reader, reader_args=reader_args)
+
+if __name__== "__main__":
+  main()
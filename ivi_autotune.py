@@ -0,0 +1,210 @@
+# ivi_autotune.py
+
+# Client settings tuned against a deployment instead of guessed.  autotune sends short bursts of requests to an
+# endpoint (or a local stand-in) at increasing concurrency and measures throughput, latency and errors : the
+# recommended num_threads is where throughput stops improving.  Lower jpeg qualities are then tried at that
+# concurrency and kept only if they are faster and the detections agree with the full quality ones.
+# The settings are saved in a profile (json, keyed by endpoint url) that fetch_scores, edit_video_objdet and
+# get_json_from_paiv read when they are not given num_threads / quality, so later runs use them automatically.
+import glob
+import json
+import math
+import os
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from ivi_common import nprint
+
+DEFAULT_PROFILE = os.path.join(os.path.expanduser("~"), ".paiv_profile.json")
+_profiles = {}
+
+
+def profile_path() :
+    # the profile file : $PAIV_PROFILE, or ~/.paiv_profile.json
+    return os.environ.get("PAIV_PROFILE", DEFAULT_PROFILE)
+
+
+def load_profile(paiv_url, profile_fn=None) :
+    '''
+    Tuned settings of an endpoint
+    returns : dict (num_threads, quality, ...), empty if the endpoint was never tuned
+    '''
+    if(profile_fn == None) :
+        profile_fn = profile_path()
+    if(profile_fn not in _profiles) :
+        profiles = {}
+        if(os.path.isfile(profile_fn)) :
+            try :
+                profiles = json.loads(open(profile_fn).read())
+            except ValueError as e :
+                nprint("Warning : ignoring unreadable profile {} : {}".format(profile_fn, e))
+        _profiles[profile_fn] = profiles
+    return _profiles[profile_fn].get(paiv_url, {})
+
+
+def tuned_setting(paiv_url, name, default) :
+    # one setting from the profile of paiv_url, default if it was not tuned
+    if(paiv_url == None) :
+        return default
+    return load_profile(paiv_url).get(name, default)
+
+
+def save_profile(paiv_url, settings, profile_fn=None) :
+    # add or replace the settings of paiv_url in the profile, other endpoints are kept
+    if(profile_fn == None) :
+        profile_fn = profile_path()
+    _profiles.pop(profile_fn, None)
+    load_profile(paiv_url, profile_fn)
+    profiles = _profiles[profile_fn]
+    profiles[paiv_url] = settings
+    tmp_fn = profile_fn + ".tmp"
+    f = open(tmp_fn, 'w')
+    f.write(json.dumps(profiles, indent=2))
+    f.close()
+    os.replace(tmp_fn, profile_fn)
+    nprint("Saved settings for {} to {}".format(paiv_url, profile_fn))
+
+
+def probe_images(video_fn=None, image_dir=None, count=8) :
+    '''
+    Sample images to probe with : count frames spread over a video, or the first count images of a directory
+    returns : (list of images, fps of the video or None)
+    '''
+    import cv2
+    images = []
+    fps = None
+    if(video_fn != None) :
+        cap = cv2.VideoCapture(video_fn)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        for idx in np.linspace(0, max(total - 1, 0), count).astype(int).tolist() :
+            cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+            ret, frame = cap.read()
+            if(frame is not None) :
+                images.append(frame)
+        cap.release()
+    elif(image_dir != None) :
+        files = sorted(fn for pattern in ["*.jpg", "*.JPG", "*.jpeg", "*.png", "*.PNG"] for fn in glob.glob(os.path.join(image_dir, pattern)))
+        for fn in files[:count] :
+            img = cv2.imread(fn)
+            if(img is not None) :
+                images.append(img)
+    if(len(images) == 0) :
+        raise ValueError("autotune : no probe images from video {} / image_dir {}".format(video_fn, image_dir))
+    return (images, fps)
+
+
+def probe(paiv_url, payloads, num_threads, num_requests) :
+    '''
+    Send num_requests requests, num_threads at a time, cycling through payloads (encoded images)
+    returns : dict with throughput (requests / s), latency_p50 / latency_p95 (s), error_rate and
+              results (the first result of each payload, None if it failed)
+    '''
+    from ivi_scoring import post_image_to_paiv
+    latencies = [None] * num_requests
+    results = [None] * num_requests
+
+    def send(i) :
+        start = time.time()
+        json_rv = post_image_to_paiv(paiv_url, payloads[i % len(payloads)], "autotune_{}.jpg".format(i), i)
+        latencies[i] = time.time() - start
+        results[i] = json_rv if (json_rv != None and 'classified' in json_rv) else None
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=num_threads) as pool :
+        list(pool.map(send, range(num_requests)))
+    elapsed = time.time() - start
+
+    errors = sum(1 for r in results if r == None)
+    lat = np.array(latencies)
+    return {'num_threads' : num_threads, 'requests' : num_requests, 'throughput' : num_requests / max(elapsed, 1e-9),
+            'latency_p50' : float(np.percentile(lat, 50)), 'latency_p95' : float(np.percentile(lat, 95)),
+            'error_rate' : errors / float(num_requests), 'results' : results[:len(payloads)]}
+
+
+def _agreement(reference, results, iou_threshold=0.5) :
+    # fraction of the probe images whose detections did not change (ivi_sampling.detections_changed)
+    from ivi_boxes import BoxArray
+    from ivi_sampling import detections_changed
+    pairs = [(a, b) for (a, b) in zip(reference, results) if a != None and b != None]
+    if(len(pairs) == 0) :
+        return 0.0
+    if(not all(isinstance(a['classified'], list) for (a, b) in pairs)) :
+        # classification : same top class
+        same = [list(a['classified'].keys())[:1] == list(b['classified'].keys())[:1] for (a, b) in pairs]
+    else :
+        same = [not detections_changed(BoxArray.from_json(a), BoxArray.from_json(b), iou_threshold) for (a, b) in pairs]
+    return sum(same) / float(len(pairs))
+
+
+def autotune(paiv_url, images, levels=(1, 2, 4, 8, 16, 32), qualities=(95, 85, 75), requests_per_level=None, min_gain=0.1,
+             max_error_rate=0.02, min_agreement=0.95, fps=None, profile_fn=None, save=True) :
+    '''
+    Find the concurrency and jpeg quality an endpoint runs best at, and save them to the profile
+    images             : probe images (probe_images)
+    levels             : concurrency levels tried in order, the sweep stops at the first level that improves
+                         throughput by less than min_gain (e.g. 0.1 = 10%) or has more than max_error_rate errors
+    qualities          : jpeg qualities, the first is the reference.  A lower quality is kept if it is min_gain faster
+                         and at least min_agreement of the probe images get the same detections
+    requests_per_level : requests per measurement, default max(3 * level, 2 * len(images), 16)
+    fps                : frame rate of the videos to score, to also recommend the smallest sample_rate that keeps up
+                         with real time at the measured throughput
+    save               : write the settings to the profile (profile_fn, default profile_path())
+    returns : dict of settings (num_threads, quality, throughput, latency, ...) and the sweep measurements
+    '''
+    import cv2
+    payloads = {q : [cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, q])[1].tobytes() for img in images] for q in qualities}
+    def num_requests(level) :
+        return requests_per_level if requests_per_level != None else max(3 * level, 2 * len(images), 16)
+
+    # 1. concurrency, at the reference quality
+    sweep = []
+    best = None
+    for level in levels :
+        stats = probe(paiv_url, payloads[qualities[0]], level, num_requests(level))
+        nprint("{:3d} threads : {:7.2f} requests/s  latency p50 {:0.3f} p95 {:0.3f} (s)  errors {:0.1%}".format(
+            level, stats['throughput'], stats['latency_p50'], stats['latency_p95'], stats['error_rate']))
+        sweep.append(stats)
+        if(stats['error_rate'] > max_error_rate) :
+            nprint("Error rate above {:0.1%}, stopping the sweep".format(max_error_rate))
+            break
+        if(best != None and stats['throughput'] < best['throughput'] * (1 + min_gain)) :
+            if(stats['throughput'] > best['throughput']) :
+                best = stats
+            break
+        best = stats
+    if(best == None) :
+        raise RuntimeError("autotune : every request to {} failed at {} threads".format(paiv_url, levels[0]))
+    # the fewest threads within min_gain of the best throughput : more threads only add latency
+    ok = [s for s in sweep if s['error_rate'] <= max_error_rate]
+    chosen = min([s for s in ok if s['throughput'] * (1 + min_gain) >= best['throughput']], key=lambda s : s['num_threads'])
+    reference = next(s['results'] for s in ok)
+
+    # 2. payload, at the chosen concurrency
+    quality = qualities[0]
+    quality_stats = chosen
+    quality_sweep = []
+    for q in qualities[1:] :
+        stats = probe(paiv_url, payloads[q], chosen['num_threads'], num_requests(chosen['num_threads']))
+        stats['quality'] = q
+        stats['agreement'] = _agreement(reference, stats['results'])
+        stats['payload_bytes'] = int(np.mean([len(p) for p in payloads[q]]))
+        nprint("quality {:3d} : {:7.2f} requests/s  {} bytes  agreement {:0.0%}  errors {:0.1%}".format(
+            q, stats['throughput'], stats['payload_bytes'], stats['agreement'], stats['error_rate']))
+        quality_sweep.append(stats)
+        if(stats['error_rate'] <= max_error_rate and stats['agreement'] >= min_agreement and
+           stats['throughput'] >= quality_stats['throughput'] * (1 + min_gain)) :
+            (quality, quality_stats) = (q, stats)
+
+    settings = {'num_threads' : chosen['num_threads'], 'quality' : quality, 'throughput' : quality_stats['throughput'],
+                'latency_p50' : quality_stats['latency_p50'], 'latency_p95' : quality_stats['latency_p95'],
+                'error_rate' : quality_stats['error_rate'], 'tuned' : time.strftime("%Y-%m-%d %H:%M:%S")}
+    if(fps != None and fps > 0) :
+        settings['realtime_sample_rate'] = int(math.ceil(fps / settings['throughput']))
+    settings['sweep'] = [{k : v for (k, v) in s.items() if k != 'results'} for s in sweep + quality_sweep]
+    nprint("Recommended : num_threads {}, quality {} : {:0.2f} requests/s, latency p95 {:0.3f} (s){}".format(
+        settings['num_threads'], settings['quality'], settings['throughput'], settings['latency_p95'],
+        "" if 'realtime_sample_rate' not in settings else ", sample_rate >= {} keeps up with {:0.1f} fps".format(settings['realtime_sample_rate'], fps)))
+    if(save) :
+        save_profile(paiv_url, settings, profile_fn)
+    return settings
@@ -0,0 +1,371 @@
+# ivi_boxes.py
+
+# BoxArray : all the boxes of a frame (or a dataset) as numpy columns, with the Box geometry done for all
+# boxes at once.  Indexing a BoxArray with an int gives a BoxView, a Box that reads and writes its row,
+# so code written against Box keeps working.
+import numpy as np
+from ivi_common import nprint, Box
+
+
+def _intersections(a, b) :
+    # (N,M) intersection areas and the areas of a and b
+    iw = np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0])
+    ih = np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1])
+    inter = np.maximum(iw, 0.0) * np.maximum(ih, 0.0)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return (inter, area_a, area_b)
+
+
+def iou_matrix(a, b) :
+    '''
+    Pairwise IoU of two sets of boxes
+    a : (N,4) array of xmin,ymin,xmax,ymax
+    b : (M,4) array of xmin,ymin,xmax,ymax
+    returns : (N,M) array
+    '''
+    (inter, area_a, area_b) = _intersections(a, b)
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def ios_matrix(a, b) :
+    # Pairwise intersection over the smaller box, 1.0 when one box is inside the other (e.g. an object cut by a tile edge)
+    (inter, area_a, area_b) = _intersections(a, b)
+    smaller = np.minimum(area_a[:, None], area_b[None, :])
+    return np.divide(inter, smaller, out=np.zeros_like(inter), where=smaller > 0)
+
+
+def _label_codes(labels) :
+    # (unique labels, int code of each label), codes in order of first appearance
+    index = {}
+    codes = np.fromiter((index.setdefault(l, len(index)) for l in np.asarray(labels, dtype=object).tolist()), dtype=np.int64, count=len(labels))
+    return (list(index), codes)
+
+
+def nms(coords, scores, iou_threshold=0.5, labels=None, metric="iou") :
+    '''
+    Greedy non maximum suppression
+    coords        : (N,4) array of xmin,ymin,xmax,ymax
+    scores        : (N,) confidences
+    iou_threshold : a box is suppressed by a higher scoring box that overlaps it more than this
+    labels        : (N,) labels for class wise NMS (boxes of different labels never suppress each other), None for all together
+    metric        : "iou" | "ios" (intersection over the smaller box)
+    returns : indexes of the kept boxes, highest score first
+    '''
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 4)
+    order = np.argsort(-np.asarray(scores, dtype=np.float64), kind='stable')
+    if(len(order) <= 1) :
+        return order
+    sorted_coords = coords[order]
+    overlap = ios_matrix(sorted_coords, sorted_coords) if metric == "ios" else iou_matrix(sorted_coords, sorted_coords)
+    suppress = overlap > iou_threshold
+    if(labels is not None) :
+        codes = np.asarray(labels)
+        if(codes.dtype.kind not in 'iu') :
+            codes = _label_codes(codes)[1]
+        codes = codes[order]
+        suppress &= codes[:, None] == codes[None, :]
+    # only higher scoring boxes suppress
+    suppress = np.triu(suppress, 1)
+
+    removed = np.zeros(len(order), dtype=bool)
+    # only the boxes that suppress something matter, usually few
+    for i in np.flatnonzero(suppress.any(axis=1)).tolist() :
+        if(not removed[i]) :
+            removed |= suppress[i]
+    return order[~removed]
+
+
+class PostProcessor():
+    '''
+    Client side clean up of the boxes returned by a model, before they are drawn, counted or validated.
+    All numpy : confidences are cast once (BoxArray), then per label confidence thresholds, NMS and top k.
+    min_confidence   : drop boxes below this confidence, None to keep them all
+    class_thresholds : {label : min confidence}, overrides min_confidence for those labels
+    iou_threshold    : NMS of boxes overlapping more than this, None for no NMS
+    class_wise       : NMS within each label (True) or across labels
+    metric           : NMS overlap "iou" | "ios" (intersection over the smaller box)
+    top_k            : keep the top_k highest confidence boxes of each label, None for all
+    Call it on a BoxArray, or use apply_json on an api response.
+    '''
+    def __init__(self, min_confidence=None, class_thresholds=None, iou_threshold=None, class_wise=True, metric="iou", top_k=None):
+        self.min_confidence = min_confidence
+        self.class_thresholds = {} if class_thresholds == None else dict(class_thresholds)
+        self.iou_threshold = iou_threshold
+        self.class_wise = class_wise
+        self.metric = metric
+        self.top_k = top_k
+
+    def _thresholded(self, boxes, uniq, codes) :
+        # indexes of the boxes at or above the threshold of their label
+        if(self.min_confidence == None and len(self.class_thresholds) == 0) :
+            return np.arange(len(boxes))
+        default = -np.inf if self.min_confidence == None else self.min_confidence
+        thresholds = np.array([self.class_thresholds.get(l, default) for l in uniq], dtype=np.float64)
+        return np.nonzero(boxes.confidence >= thresholds[codes])[0]
+
+    def _top_k(self, idx, confidence, codes, groups=None) :
+        # idx restricted to the top_k highest confidence boxes of each (group, label)
+        if(self.top_k == None or len(idx) <= self.top_k) :
+            return idx
+        if(groups is None and np.bincount(codes[idx]).max() <= self.top_k) :
+            return idx
+        keys = [-confidence[idx], codes[idx]] + ([] if groups is None else [groups[idx]])
+        order = np.lexsort(keys)
+        ranked = idx[order]
+        same = np.ones(len(ranked), dtype=bool)
+        same[0] = False
+        same[1:] = codes[ranked[1:]] == codes[ranked[:-1]]
+        if(groups is not None) :
+            same[1:] &= groups[ranked[1:]] == groups[ranked[:-1]]
+        # position within each run of the same (group, label)
+        starts = np.maximum.accumulate(np.where(same, 0, np.arange(len(ranked))))
+        keep = np.zeros(len(confidence), dtype=bool)
+        keep[ranked[(np.arange(len(ranked)) - starts) < self.top_k]] = True
+        return idx[keep[idx]]
+
+    def keep(self, boxes) :
+        '''
+        returns : indexes of the boxes kept, highest confidence first when NMS is on
+        '''
+        if(len(boxes) == 0) :
+            return np.arange(0)
+        (uniq, codes) = _label_codes(boxes.labels)
+        idx = self._thresholded(boxes, uniq, codes)
+        if(self.iou_threshold != None and len(idx) > 1) :
+            idx = idx[nms(boxes.coords[idx], boxes.confidence[idx], self.iou_threshold,
+                          codes[idx] if self.class_wise else None, self.metric)]
+        return self._top_k(idx, boxes.confidence, codes)
+
+    def __call__(self, boxes) :
+        boxes = BoxArray.from_boxes(boxes)
+        return boxes[self.keep(boxes)]
+
+    def apply_json(self, json_rv) :
+        '''
+        Post process an api response
+        returns : a copy of the response with the boxes kept and float confidences, other responses unchanged
+        '''
+        if(json_rv == None or 'classified' not in json_rv or not isinstance(json_rv['classified'], list)) :
+            return json_rv
+        box_list = json_rv['classified']
+        boxes = BoxArray.from_json(json_rv)
+        confidence = boxes.confidence.tolist()
+        return dict(json_rv, classified=[dict(box_list[i], confidence=confidence[i]) for i in self.keep(boxes).tolist()])
+
+    def apply_slots(self, boxes, offsets, counts) :
+        '''
+        Post process the boxes of many results at once (e.g. ResultsCache.all_boxes)
+        boxes, offsets, counts : result k is boxes[offsets[k] : offsets[k]+counts[k]]
+        returns : (BoxArray, offsets, counts) of the kept boxes, results stored in order
+        '''
+        starts = np.cumsum(counts) - counts
+        idx = np.repeat(offsets - starts, counts) + np.arange(int(counts.sum()))
+        groups = np.repeat(np.arange(len(counts)), counts)
+        if(len(idx) == 0) :
+            return (BoxArray(), np.zeros(len(counts), dtype=np.int64), np.zeros(len(counts), dtype=np.int64))
+        (uniq, codes) = _label_codes(boxes.labels)
+        keep = self._thresholded(boxes[idx], uniq, codes[idx])
+        if(self.iou_threshold != None) :
+            # NMS is per result, only results left with more than one box need it
+            kept_counts = np.bincount(groups[keep], minlength=len(counts))
+            bounds = np.concatenate([[0], np.cumsum(kept_counts)])
+            parts = [keep[bounds[k]:bounds[k+1]] for k in range(len(counts)) if kept_counts[k] > 0]
+            for (i, part) in enumerate(parts) :
+                if(len(part) > 1) :
+                    src = idx[part]
+                    parts[i] = part[nms(boxes.coords[src], boxes.confidence[src], self.iou_threshold,
+                                        codes[src] if self.class_wise else None, self.metric)]
+            keep = np.concatenate(parts) if len(parts) > 0 else keep
+        keep = self._top_k(keep, boxes.confidence[idx], codes[idx], groups)
+        # back in result order
+        keep = keep[np.argsort(groups[keep], kind='stable')]
+        new_counts = np.bincount(groups[keep], minlength=len(counts)).astype(np.int64)
+        return (boxes[idx[keep]], np.cumsum(new_counts) - new_counts, new_counts)
+
+
+class BoxArray():
+    '''
+    N boxes stored as columns
+    labels     : (N,) object array of labels
+    coords     : (N,4) float array of xmin,ymin,xmax,ymax
+    confidence : (N,) float array
+    track_ids  : (N,) int array, -1 when not tracked
+    Methods mirror Box, returning arrays with one row per box.
+    '''
+    def __init__(self, labels=(), coords=None, confidence=None, track_ids=None):
+        n = len(labels)
+        self.labels = np.array(labels, dtype=object).reshape(n)
+        self.coords = np.zeros((0, 4)) if coords is None else np.asarray(coords, dtype=np.float64).reshape(n, 4)
+        self.confidence = np.ones(n) if confidence is None else np.asarray(confidence, dtype=np.float64).reshape(n)
+        self.track_ids = np.full(n, -1, dtype=np.int64) if track_ids is None else np.asarray(track_ids, dtype=np.int64).reshape(n)
+
+    @classmethod
+    def from_boxes(cls, boxes) :
+        # from a list of Box
+        if(isinstance(boxes, BoxArray)) :
+            return boxes
+        return cls([b.label for b in boxes], [(b.xmin, b.ymin, b.xmax, b.ymax) for b in boxes], [b.confidence for b in boxes],
+                   [-1 if b.track_id == None else b.track_id for b in boxes])
+
+    @classmethod
+    def from_json(cls, json_in) :
+        # same as get_boxes_from_json, straight into columns
+        if(json_in == None or 'classified' not in json_in) :
+            nprint("No Json available")
+            return cls()
+        box_list = json_in['classified']
+        return cls([b['label'] for b in box_list], [(b['xmin'], b['ymin'], b['xmax'], b['ymax']) for b in box_list],
+                   [b['confidence'] for b in box_list])
+
+    def to_boxes(self) :
+        # list of standalone Box
+        rv = []
+        for i in range(len(self)) :
+            (xmin, ymin, xmax, ymax) = self.coords[i].tolist()
+            box = Box(self.labels[i], xmin, ymin, xmax, ymax, float(self.confidence[i]))
+            box.track_id = None if self.track_ids[i] < 0 else int(self.track_ids[i])
+            rv.append(box)
+        return rv
+
+    def __len__(self) :
+        return len(self.labels)
+
+    def __getitem__(self, idx) :
+        # int : BoxView of that row.  slice, index array or bool mask : BoxArray of those rows (a copy)
+        if(isinstance(idx, (int, np.integer))) :
+            return BoxView(self, int(idx) % len(self))
+        return BoxArray(self.labels[idx], self.coords[idx], self.confidence[idx], self.track_ids[idx])
+
+    def __iter__(self) :
+        for i in range(len(self)) :
+            yield BoxView(self, i)
+
+    def concatenate(self, other) :
+        return BoxArray(np.concatenate([self.labels, other.labels]), np.concatenate([self.coords, other.coords]),
+                        np.concatenate([self.confidence, other.confidence]), np.concatenate([self.track_ids, other.track_ids]))
+
+    @property
+    def xmin(self) :
+        return self.coords[:, 0]
+
+    @property
+    def ymin(self) :
+        return self.coords[:, 1]
+
+    @property
+    def xmax(self) :
+        return self.coords[:, 2]
+
+    @property
+    def ymax(self) :
+        return self.coords[:, 3]
+
+    def center(self) :
+        # (N,2) int, truncated like Box.center
+        return np.trunc((self.coords[:, 0:2] + self.coords[:, 2:4]) / 2.0).astype(np.int64)
+
+    def _scaled_corner(self, x, y, sf, xoff, yoff) :
+        cent = self.center()
+        xs = np.trunc(sf * (x - cent[:, 0]) + cent[:, 0]).astype(np.int64) + xoff
+        ys = np.trunc(sf * (y - cent[:, 1]) + cent[:, 1]).astype(np.int64) + yoff
+        return np.stack([xs, ys], axis=1)
+
+    def ulc(self, sf=0.5, xoff=0, yoff=0) :
+        # (N,2) scaled upper left corners, same as Box.ulc for every box
+        return self._scaled_corner(self.coords[:, 0], self.coords[:, 1], sf, xoff, yoff)
+
+    def lrc(self, sf=0.5, xoff=0, yoff=0) :
+        return self._scaled_corner(self.coords[:, 2], self.coords[:, 3], sf, xoff, yoff)
+
+    def urc(self, sf=0.5, xoff=0, yoff=0) :
+        return self._scaled_corner(self.coords[:, 2], self.coords[:, 1], sf, xoff, yoff)
+
+    def area(self) :
+        wh = np.maximum(self.coords[:, 2:4] - self.coords[:, 0:2], 0.0)
+        return wh[:, 0] * wh[:, 1]
+
+    def iou(self, other) :
+        # (N,M) IoU with another BoxArray
+        return iou_matrix(self.coords, other.coords)
+
+    def scale(self, wratio, hratio, offset_px) :
+        # Box.scale for every box
+        coords = np.empty_like(self.coords)
+        coords[:, [0, 2]] = np.trunc(self.coords[:, [0, 2]] * wratio)
+        coords[:, [1, 3]] = np.trunc(self.coords[:, [1, 3]] * hratio + offset_px)
+        return BoxArray(self.labels, coords, self.confidence, self.track_ids)
+
+    def clip(self, width, height) :
+        # boxes clipped to a width x height image
+        coords = np.empty_like(self.coords)
+        coords[:, [0, 2]] = np.clip(self.coords[:, [0, 2]], 0, width)
+        coords[:, [1, 3]] = np.clip(self.coords[:, [1, 3]], 0, height)
+        return BoxArray(self.labels, coords, self.confidence, self.track_ids)
+
+    def nms(self, iou_threshold=0.5, class_wise=True, metric="iou") :
+        # boxes kept by non maximum suppression (see nms), highest confidence first
+        return self[nms(self.coords, self.confidence, iou_threshold, self.labels if class_wise else None, metric)]
+
+    def filter(self, labels=None, min_confidence=None) :
+        # boxes with one of labels and at least min_confidence
+        keep = np.ones(len(self), dtype=bool)
+        if(labels != None) :
+            keep &= np.isin(self.labels, list(labels))
+        if(min_confidence != None) :
+            keep &= self.confidence >= min_confidence
+        return self[keep]
+
+
+class BoxView(Box):
+    '''
+    Box backed by one row of a BoxArray.  Reads and writes go to the array
+    '''
+    __slots__ = ('_arr', '_idx')
+
+    def __init__(self, arr, idx):
+        self._arr = arr
+        self._idx = idx
+
+    def _get_coord(col) :
+        def getter(self) :
+            return self._arr.coords[self._idx, col].item()
+        def setter(self, value) :
+            self._arr.coords[self._idx, col] = value
+        return property(getter, setter)
+
+    xmin = _get_coord(0)
+    ymin = _get_coord(1)
+    xmax = _get_coord(2)
+    ymax = _get_coord(3)
+    del _get_coord
+
+    @property
+    def label(self) :
+        return self._arr.labels[self._idx]
+
+    @label.setter
+    def label(self, value) :
+        self._arr.labels[self._idx] = value
+
+    @property
+    def confidence(self) :
+        return self._arr.confidence[self._idx].item()
+
+    @confidence.setter
+    def confidence(self, value) :
+        self._arr.confidence[self._idx] = value
+
+    @property
+    def track_id(self) :
+        track_id = self._arr.track_ids[self._idx]
+        return None if track_id < 0 else int(track_id)
+
+    @track_id.setter
+    def track_id(self, value) :
+        self._arr.track_ids[self._idx] = -1 if value == None else value
+
+    def scale(self, wratio, hratio, offset_px):
+        # a standalone copy, a view can not be copied on its own
+        return Box(self.label, self.xmin, self.ymin, self.xmax, self.ymax, self.confidence).scale(wratio, hratio, offset_px)
@@ -0,0 +1,249 @@
+# ivi_cache.py
+
+# Compact binary cache of per frame object detection results, used by edit_video_objdet instead of cache.json.
+# A cache is three files sharing a prefix :
+#   <prefix>.idx       : one fixed size record per result slot (offset of its first box, number of boxes, status)
+#   <prefix>.box       : every box of every result, appended as results arrive (label code, coords, confidence)
+#   <prefix>.meta.json : label table and the number of slots
+# Both binary files are memory mapped when reading, so any result can be read in O(1) without loading the rest.
+# Only what the renderer uses is kept (label, box, confidence), not the rest of the API response.
+import json
+import os
+import numpy as np
+from threading import Lock
+from ivi_boxes import BoxArray
+from ivi_common import nprint
+
+CACHE_VERSION = 1
+
+IDX_DTYPE = np.dtype([('offset', '<i8'), ('count', '<i4'), ('status', '<i4')])
+BOX_DTYPE = np.dtype([('label', '<i4'), ('xmin', '<f4'), ('ymin', '<f4'), ('xmax', '<f4'), ('ymax', '<f4'), ('confidence', '<f4')])
+
+# slot status
+STATUS_MISSING = 0   # not scored (yet)
+STATUS_OK      = 1   # api returned boxes (possibly none)
+STATUS_FAILED  = 2   # api call failed, or no 'classified' in the response
+STATUS_SKIPPED = 3   # not scored on purpose (adaptive sampling), reads as the last scored result before it
+
+
+def _cache_files(prefix) :
+    return (prefix + ".idx", prefix + ".box", prefix + ".meta.json")
+
+
+def results_cache_exists(prefix) :
+    # True if a complete cache was written at prefix
+    (idx_fn, box_fn, meta_fn) = _cache_files(prefix)
+    if(not (os.path.isfile(idx_fn) and os.path.isfile(box_fn) and os.path.isfile(meta_fn))) :
+        return False
+    return json.loads(open(meta_fn).read()).get('complete', False)
+
+
+class ResultsCacheWriter():
+    '''
+    Writes results into a cache as they arrive, in any order.  Thread safe.
+    prefix    : file prefix (e.g. <output_directory>/cache)
+    num_slots : number of results expected, if known.  Slots past it can still be written
+    Results become readable (ResultsCache) as soon as put returns.  Call close when done.
+    '''
+    def __init__(self, prefix, num_slots=0):
+        self.prefix = prefix
+        (idx_fn, box_fn, meta_fn) = _cache_files(prefix)
+        for fn in [idx_fn, box_fn, meta_fn] :
+            if(os.path.isfile(fn)) :
+                os.remove(fn)
+        self.labels = []
+        self.label_codes = {}
+        self.num_slots = num_slots
+        self.num_boxes = 0
+        self.lock = Lock()
+        self._write_meta(complete=False)
+        self.box_f = open(box_fn, 'wb')
+        self.idx_f = open(idx_fn, 'w+b')
+        self.idx_f.truncate(num_slots * IDX_DTYPE.itemsize)
+
+    def _write_meta(self, complete) :
+        meta_fn = _cache_files(self.prefix)[2]
+        f = open(meta_fn + ".tmp", 'w')
+        f.write(json.dumps({'version' : CACHE_VERSION, 'labels' : self.labels, 'num_slots' : self.num_slots, 'complete' : complete}))
+        f.close()
+        os.replace(meta_fn + ".tmp", meta_fn)
+
+    def put(self, slot, json_rv) :
+        '''
+        Store one api response
+        slot    : result index (result k of a video is frame (k+1)*sample_rate)
+        json_rv : api json response
+        '''
+        status = STATUS_FAILED
+        box_list = []
+        if(json_rv != None and 'classified' in json_rv) :
+            status = STATUS_OK
+            box_list = json_rv['classified']
+
+        with self.lock :
+            new_labels = False
+            for b in box_list :
+                if(b['label'] not in self.label_codes) :
+                    self.label_codes[b['label']] = len(self.labels)
+                    self.labels.append(b['label'])
+                    new_labels = True
+            if(new_labels or slot >= self.num_slots) :
+                self.num_slots = max(self.num_slots, slot + 1)
+                self._write_meta(complete=False)
+
+            rec = np.zeros(len(box_list), dtype=BOX_DTYPE)
+            for (i, b) in enumerate(box_list) :
+                rec[i] = (self.label_codes[b['label']], b['xmin'], b['ymin'], b['xmax'], b['ymax'], b['confidence'])
+            # boxes first, then the index entry that points at them
+            self.box_f.write(rec.tobytes())
+            self.box_f.flush()
+            self.idx_f.seek(slot * IDX_DTYPE.itemsize)
+            self.idx_f.write(np.array([(self.num_boxes, len(box_list), status)], dtype=IDX_DTYPE).tobytes())
+            self.idx_f.flush()
+            self.num_boxes += len(box_list)
+
+    def skip(self, slot) :
+        # mark a slot that was not scored on purpose (see STATUS_SKIPPED)
+        with self.lock :
+            if(slot >= self.num_slots) :
+                self.num_slots = slot + 1
+                self._write_meta(complete=False)
+            self.idx_f.seek(slot * IDX_DTYPE.itemsize)
+            self.idx_f.write(np.array([(self.num_boxes, 0, STATUS_SKIPPED)], dtype=IDX_DTYPE).tobytes())
+            self.idx_f.flush()
+
+    def close(self) :
+        self.box_f.close()
+        self.idx_f.close()
+        self._write_meta(complete=True)
+
+
+class ResultsCache():
+    '''
+    Memory mapped reader for a cache written by ResultsCacheWriter
+    len(cache) is the number of result slots, cache.boxes(k) the BoxArray of result k.
+    Call refresh to see results added since it was opened.
+    postprocess : optional ivi_boxes.PostProcessor applied to the boxes read, the files keep the raw results
+    '''
+    def __init__(self, prefix, postprocess=None):
+        self.prefix = prefix
+        self.postprocess = postprocess
+        self.refresh()
+
+    def refresh(self) :
+        (idx_fn, box_fn, meta_fn) = _cache_files(self.prefix)
+        meta = json.loads(open(meta_fn).read())
+        if(meta['version'] != CACHE_VERSION) :
+            raise ValueError("{} : unsupported cache version {}".format(meta_fn, meta['version']))
+        self.label_table = np.array(meta['labels'], dtype=object)
+        self.num_slots = meta['num_slots']
+        self.idx = self._map(idx_fn, IDX_DTYPE)
+        self.box = self._map(box_fn, BOX_DTYPE)
+
+    def _map(self, fn, dtype) :
+        n = os.path.getsize(fn) // dtype.itemsize
+        if(n == 0) :
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(fn, dtype=dtype, mode='r', shape=(n,))
+
+    def __len__(self) :
+        return self.num_slots
+
+    def status(self, k) :
+        if(k >= len(self.idx)) :
+            return STATUS_MISSING
+        return int(self.idx[k]['status'])
+
+    def scored(self, k) :
+        # slot of the result shown for slot k : k itself, or for a skipped slot the last scored slot before it (-1 if none)
+        while(k >= 0 and self.status(k) == STATUS_SKIPPED) :
+            k -= 1
+        return k
+
+    def boxes(self, k) :
+        # BoxArray of result k (empty if it is missing or failed, held from the last scored result if skipped)
+        k = self.scored(k)
+        if(k < 0 or self.status(k) != STATUS_OK) :
+            return BoxArray()
+        entry = self.idx[k]
+        rec = self.box[entry['offset'] : entry['offset'] + entry['count']]
+        coords = np.stack([rec['xmin'], rec['ymin'], rec['xmax'], rec['ymax']], axis=1)
+        boxes = BoxArray(self.label_table[rec['label']], coords, rec['confidence'])
+        return boxes if self.postprocess == None else self.postprocess(boxes)
+
+    def all_boxes(self) :
+        '''
+        Every box in the cache in one BoxArray, for whole video passes (e.g. tracking)
+        returns : (BoxArray, offsets, counts) where result k is boxes[offsets[k] : offsets[k]+counts[k]]
+        (counts is 0 for missing or failed results, skipped results point at the last scored result)
+        '''
+        rec = np.asarray(self.box)
+        coords = np.stack([rec['xmin'], rec['ymin'], rec['xmax'], rec['ymax']], axis=1)
+        boxes = BoxArray(self.label_table[rec['label']], coords, rec['confidence'])
+        offsets = np.zeros(self.num_slots, dtype=np.int64)
+        counts = np.zeros(self.num_slots, dtype=np.int64)
+        n = min(self.num_slots, len(self.idx))
+        ok = self.idx['status'][:n] == STATUS_OK
+        offsets[:n] = np.where(ok, self.idx['offset'][:n], 0)
+        counts[:n] = np.where(ok, self.idx['count'][:n], 0)
+        skipped = self.idx['status'][:n] == STATUS_SKIPPED
+        if(skipped.any()) :
+            src = np.maximum.accumulate(np.where(skipped, -1, np.arange(n)))
+            held = np.nonzero(skipped & (src >= 0))[0]
+            offsets[held] = offsets[src[held]]
+            counts[held] = counts[src[held]]
+        if(self.postprocess != None) :
+            return self.postprocess.apply_slots(boxes, offsets, counts)
+        return (boxes, offsets, counts)
+
+    def json(self, k) :
+        # result k in the api json layout, only the fields kept in the cache
+        k = self.scored(k)
+        status = STATUS_MISSING if k < 0 else self.status(k)
+        if(status == STATUS_MISSING) :
+            return None
+        if(status == STATUS_FAILED) :
+            return {'empty_url' : 'fetch failed'}
+        boxes = self.boxes(k)
+        classified = [{'label' : l, 'xmin' : c[0], 'ymin' : c[1], 'xmax' : c[2], 'ymax' : c[3], 'confidence' : conf}
+                      for (l, c, conf) in zip(boxes.labels.tolist(), boxes.coords.tolist(), boxes.confidence.tolist())]
+        return {'classified' : classified, 'result' : 'success'}
+
+    # memmaps are not pickled, the copy reopens the files (e.g. in another process)
+    def __getstate__(self) :
+        return {'prefix' : self.prefix, 'postprocess' : self.postprocess}
+
+    def __setstate__(self, state) :
+        self.prefix = state['prefix']
+        self.postprocess = state.get('postprocess')
+        self.refresh()
+
+    def __deepcopy__(self, memo) :
+        return self
+
+
+def migrate_json_cache(json_fn, prefix) :
+    '''
+    One time conversion of a cache.json (list of api results) to a binary cache at prefix
+    returns : ResultsCache
+    '''
+    nprint("Migrating {} to {}.*".format(json_fn, prefix))
+    results_list = json.loads(open(json_fn).read())
+    writer = ResultsCacheWriter(prefix, num_slots=len(results_list))
+    for (k, json_rv) in enumerate(results_list) :
+        writer.put(k, json_rv)
+    writer.close()
+    return ResultsCache(prefix)
+
+
+def open_results_cache(path, postprocess=None) :
+    '''
+    ResultsCache for a cache prefix, or for a cache.json (migrated next to it the first time)
+    postprocess : optional ivi_boxes.PostProcessor, see ResultsCache
+    '''
+    if(path.endswith(".json")) :
+        prefix = path[:-len(".json")]
+        if(not results_cache_exists(prefix)) :
+            migrate_json_cache(path, prefix)
+        return ResultsCache(prefix, postprocess)
+    return ResultsCache(path, postprocess)
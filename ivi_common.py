@@ -0,0 +1,251 @@
+# ivi_common.py
+
+# Shared helpers used by all the ivi_* modules : logging, box data structure, PAIV dataset parsing.
+# Only standard library imports at module load.  cv2 is imported when a dataset is actually loaded.
+import colorsys
+import glob
+import hashlib
+import json
+import os
+import random
+import sys
+import xml.etree.ElementTree
+# functions that start with _ imply that these are private functions
+
+def nprint(mystring) :
+    print("{} : {}".format(sys._getframe(1).f_code.co_name,mystring))
+
+
+def _parse_paiv_xml(filein) :
+    e = xml.etree.ElementTree .parse(filein).getroot()
+    #class_list = []
+    #box_list = []
+
+    # The associated id is teh file name sans the xml
+    file_id = filein.split('/')[-1]
+    file_id = file_id.replace('.xml','')
+
+    rv_list = []
+    # Someday use the bbox class
+    for obj in e.findall('object') :
+        objclass = obj.find('name').text
+        objclass = objclass.replace(' ','_')
+        xmin = int(obj.find('bndbox').find('xmin').text)
+        ymin = int(obj.find('bndbox').find('ymin').text)
+        xmax = int(obj.find('bndbox').find('xmax').text)
+        ymax = int(obj.find('bndbox').find('ymax').text)
+
+        bbox = Box(objclass,xmin,ymin,xmax,ymax,1.0)
+
+        if(xmin < 0.0 or ymin < 0.0 or xmax < 0 or ymax <0 ) :
+            nprint("Error, file {} somehow has a negative pixel location recorded.  Omitting that box ....".format(filein))
+        else :
+            box_dict = {"_id": file_id, "label" : objclass, "xmin" : xmin, "ymin" : ymin, "xmax" : xmax, "ymax" : ymax, "xc" : bbox.center()[0], "yc" : bbox.center()[1]}
+            rv_list.append(box_dict)
+    # zip the class and box dimensions !
+    #rv = list(zip(class_list,box_list))
+    return rv_list
+
+def get_image_fn(paiv_file_name_base) :
+    image_file = paiv_file_name_base + ".JPG"
+    if(not(os.path.isfile(image_file))):
+        image_file = paiv_file_name_base + ".jpg"
+    if(not(os.path.isfile(image_file))):
+        image_file = paiv_file_name_base + ".png"
+    if(not(os.path.isfile(image_file))):
+        image_file = None
+
+    return image_file
+
+# Hash function to uniquely identify an image by just pixel values
+def get_np_hash(npary) :
+    return hashlib.md5(npary.data).hexdigest()
+
+#  Function to list the images of an AI Vision data directory without decoding them
+#  supports both object, classification modes (validate_mode setting)
+#  returns a list of (image file name, metadata dict) tuples
+#    metadata is {'id', 'boxes'} for object mode, {'id', 'class'} for classification
+def _list_paiv_dataset(data_dir, validate_mode) :
+    rv_list = []
+    if(validate_mode == "object") :
+        xml_file_list = sorted(glob.glob(data_dir + "/*.xml"))
+        for xf in xml_file_list :
+            xf_file_base = os.path.splitext(os.path.basename(xf))[0]
+            image_fn = get_image_fn(data_dir + "/" + xf_file_base)
+            if(image_fn != None) :
+                rv_list.append((image_fn, {'id' : xf_file_base , 'boxes' : _parse_paiv_xml(xf)}))
+    else : # classification
+        # read in prop.json file and stuff into hash !
+        json_str = open(data_dir + "/prop.json").read()
+        json_parsed = json.loads(json_str)
+        file_class_list = json.loads(json_parsed['file_prop_info'])
+
+        for i in file_class_list :
+            xf_file_base = i['_id']
+            image_fn = get_image_fn(data_dir + "/" + xf_file_base)
+            if(image_fn != None) :
+                rv_list.append((image_fn, {'id' : xf_file_base, 'class' : i['category_name']}))  # save the class for the image!
+
+    return rv_list
+
+#  Function to Read in an AI Vision data directory and return a python object (dict)
+#  to be used for all kinds of experiments.
+#  supports both object, classification modes (validate_mode setting)
+#  returns a dictionary of dictionaries
+#    top level dictionary keys are hash of np array
+#      second level dictionary is the metadata associated with the image
+def _load_paiv_dataset(data_dir, validate_mode) :
+    import cv2
+    paiv_dataset = {}
+    if(os.path.exists(data_dir)) :
+        for (image_fn, meta) in _list_paiv_dataset(data_dir, validate_mode) :
+            np_hash = get_np_hash(cv2.imread(image_fn))
+            paiv_dataset[np_hash] = meta
+
+    else :
+        nprint("Data Directory {} does not exist".format(data_dir))
+
+    return paiv_dataset
+
+
+def generate_colors(class_names=['a','b','c','d','a1','b1','c1','d1','a2','b2','c2','d2']):
+    hsv_tuples = [(x / len(class_names), 1., 1.) for x in range(len(class_names))]
+    colors = list(map(lambda x: colorsys.hsv_to_rgb(*x), hsv_tuples))
+    colors = list(map(lambda x: (int(x[0] * 255), int(x[1] * 255), int(x[2] * 255)), colors))
+    random.seed(10101)  # Fixed seed for consistent colors across runs.
+    random.shuffle(colors)  # Shuffle colors to decorrelate adjacent classes.
+    random.seed(None)  # Reset seed to default.
+    return colors
+
+
+
+def get_boxes_from_json(json_in) :
+    '''
+    Function to parse boxes in json form and read into a standard box class so that I can manipulate boxes ...
+    :param json_in: 
+    :return: list of boxes
+    '''
+    #print(json_in)
+    rv_box_list = []
+    if(json_in != None) :
+        try :
+            box_list = json_in['classified']
+            for box in box_list :
+                tmpbox = Box(box['label'],box['xmin'],box['ymin'],box['xmax'],box['ymax'],box['confidence'])
+                rv_box_list.append(tmpbox)
+
+        except KeyError :
+            nprint("No Json available")
+    else :
+        nprint("No Json available")
+
+    return rv_box_list
+
+
+class Box():
+    '''
+    data structure to hold box data
+    see ivi_boxes.BoxArray for many boxes at once
+    '''
+    __slots__ = ('label', 'xmin', 'ymin', 'xmax', 'ymax', 'confidence', 'track_id')
+
+    def __init__(self,label,xmin,ymin,xmax,ymax,confidence):
+        self.label = label
+        self.xmin = xmin
+        self.ymin=ymin
+        self.xmax=xmax
+        self.ymax = ymax
+        self.confidence = confidence
+        # set by the tracker (ivi_tracking.IouTracker) when tracking counters are used
+        self.track_id = None
+
+    def center(self) :
+        return (int((self.xmin+self.xmax)/2.0),int((self.ymin+self.ymax)/2.0))
+
+    def ul(self):
+        return (self.xmin,self.ymin)
+
+    def lr(self):
+        return (self.xmax,self.ymax)
+
+    def ur(self):
+        return (self.xmax,self.ymin)
+
+    def ll(self):
+        return (self.xmin,self.ymax)
+
+    def ulc(self, sf=0.5, xoff=0,yoff=0):
+        #scaled upper left box
+        cent = self.center()
+        ul =  self.ul()
+        xulc = int(sf*(ul[0]-cent[0])+cent[0]) + xoff
+        yulc = int(sf*(ul[1]-cent[1])+cent[1]) + yoff
+        return(xulc,yulc)
+
+    def lrc(self, sf=0.5, xoff=0,yoff=0):
+        #scaled upper left box
+        cent = self.center()
+        lr =  self.lr()
+        xlrc = int(sf*(lr[0]-cent[0])+cent[0]) + xoff
+        ylrc = int(sf*(lr[1]-cent[1])+cent[1]) + yoff
+        return(xlrc,ylrc)
+
+    def urc(self, sf=0.5, xoff=0,yoff=0):
+        #scaled upper left box
+        cent = self.center()
+        ur =  self.ur()
+        xurc = int(sf*(ur[0]-cent[0])+cent[0]) + xoff
+        yurc = int(sf*(ur[1]-cent[1])+cent[1]) + yoff
+        return(xurc,yurc)
+
+
+    def area(self):
+        return max(0, self.xmax - self.xmin) * max(0, self.ymax - self.ymin)
+
+    def iou(self, other):
+        # intersection over union with another box
+        iw = min(self.xmax, other.xmax) - max(self.xmin, other.xmin)
+        ih = min(self.ymax, other.ymax) - max(self.ymin, other.ymin)
+        if(iw <= 0 or ih <= 0) :
+            return 0.0
+        inter = iw * ih
+        return inter / float(self.area() + other.area() - inter)
+
+    def scale(self,wratio, hratio,offset_px):
+        '''
+        This function returns 480,640 boxes back to the original image scale
+        :param ratio: 
+        :param offset_px: 
+        :return: a new box, with scale [xy] min/maxes
+        '''
+        import copy
+        newbox = copy.copy(self)
+        newbox.xmin = int(newbox.xmin * wratio )
+        newbox.xmax = int(newbox.xmax * wratio )
+        newbox.ymin = int(newbox.ymin * hratio + offset_px)
+        newbox.ymax = int(newbox.ymax * hratio + offset_px)
+        return newbox
+
+
+
+
+
+
+        # SLOW SLOW SLOW PILLOW IMPLEMENTATION
+        #if(mode == "use_pillow") :
+        #    cv2_im_rgb = cv2.cvtColor(img,cv2.COLOR_BGR2RGB)
+        #    pil_im = Image.fromarray(cv2_im_rgb)
+        #    draw = ImageDraw.Draw(pil_im)
+        #    # use a truetype font
+        #    font = ImageFont.truetype("verdanab.ttf", 10)
+        #
+        #    # Draw the text
+        #    color_rgbf = (color_bgr[2],color_bgr[1],color_bgr[0],0)
+        #    color_rgbf_black = (0,0,0,0)
+        #
+        #    draw.text(box.ulc(yoff=-17,xoff=4), box.label, font=font, fill=color_rgbf_black)
+        #    #cv2.putText(img,box.label, box.ulc(), font, 0.5, color,1,cv2.LINE_AA)
+        #
+        #    # Get back the image to OpenCV
+        #    modified_img = cv2.cvtColor(np.array(pil_im), cv2.COLOR_RGB2BGR)
+        #elif(mode == "all") :
@@ -0,0 +1,225 @@
+# ivi_dedupe.py
+
+# Near duplicate images in exported datasets.  get_np_hash only matches identical pixels, but augmented
+# exports (augment_method in prop.json) and re-exports are full of images that differ by a blur, a color
+# shift, a flip or a re-encode.  Each image gets a 64 bit perceptual hash (difference hash of a small
+# grayscale thumbnail), near duplicates are hashes within a small Hamming distance (of the hash or of its
+# flips), found with a BK-tree without comparing every pair.  Used to skip near duplicates before scoring (fetch_scores dedupe_distance)
+# and to split a dataset without an image and its augmentations landing on both sides (split_dataset).
+import cv2
+import glob
+import json
+import multiprocessing
+import os
+import shutil
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from ivi_common import nprint
+
+IMAGE_PATTERNS = ["*.jpg", "*.JPG", "*.jpeg", "*.png", "*.PNG"]
+
+
+def image_hash(img, hash_size=8) :
+    '''
+    Difference hash of an image : hash_size x hash_size bits, is each pixel of a thumbnail brighter than its right neighbour
+    img : BGR or grayscale image
+    returns : int
+    '''
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA).astype(np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hash_variants(h, hash_size=8) :
+    '''
+    Hashes of the flipped image, from the hash alone : a vertical flip reverses the rows of bits, a horizontal
+    flip reverses each row and inverts it (right neighbours become left ones)
+    returns : [hash, horizontal flip, vertical flip, both]
+    '''
+    nbits = hash_size * hash_size
+    bits = np.unpackbits(np.frombuffer(h.to_bytes((nbits + 7) // 8, 'big'), dtype=np.uint8))[:nbits].reshape(hash_size, hash_size)
+    hflip = 1 - bits[:, ::-1]
+    return [int.from_bytes(np.packbits(v.flatten()).tobytes(), 'big') for v in [bits, hflip, bits[::-1], hflip[::-1]]]
+
+
+def hamming(a, b) :
+    return bin(a ^ b).count("1")
+
+
+def _hash_chunk(files, hash_size) :
+    # hashes of a list of image files (None if unreadable), decoded at a reduced size since only a thumbnail is needed
+    rv = []
+    for fn in files :
+        img = cv2.imread(fn, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        rv.append(None if img is None else image_hash(img, hash_size))
+    return rv
+
+
+def hash_files(files, num_procs=None, hash_size=8, chunk_size=64) :
+    '''
+    image_hash of image files, decoded and hashed in num_procs processes (default : one per core)
+    returns : list of hashes in the order of files, None for files that could not be read
+    '''
+    if(num_procs == None) :
+        num_procs = os.cpu_count() or 1
+    chunks = [files[i:i + chunk_size] for i in range(0, len(files), chunk_size)]
+    if(num_procs <= 1 or len(chunks) <= 1) :
+        return [h for chunk in chunks for h in _hash_chunk(chunk, hash_size)]
+    with ProcessPoolExecutor(max_workers=num_procs, mp_context=multiprocessing.get_context("spawn")) as pool :
+        results = pool.map(_hash_chunk, chunks, [hash_size] * len(chunks))
+        return [h for chunk in results for h in chunk]
+
+
+class BKTree():
+    '''
+    BK-tree over integer hashes with the Hamming distance.  A range query only visits the subtrees whose
+    distance to their parent is within max_distance of the query's, a small part of the tree for small distances.
+    add(hash, key), query(hash, max_distance) -> [(distance, key), ...]
+    '''
+    def __init__(self):
+        # node : [hash, [keys], {distance : child node}]
+        self.root = None
+        self.size = 0
+
+    def __len__(self) :
+        return self.size
+
+    def add(self, h, key) :
+        self.size += 1
+        if(self.root == None) :
+            self.root = [h, [key], {}]
+            return
+        node = self.root
+        while(True) :
+            d = hamming(h, node[0])
+            if(d == 0) :
+                node[1].append(key)
+                return
+            child = node[2].get(d)
+            if(child == None) :
+                node[2][d] = [h, [key], {}]
+                return
+            node = child
+
+    def query(self, h, max_distance) :
+        rv = []
+        stack = [] if self.root == None else [self.root]
+        while(len(stack) > 0) :
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if(d <= max_distance) :
+                rv.extend((d, key) for key in node[1])
+            for (dist, child) in node[2].items() :
+                if(d - max_distance <= dist <= d + max_distance) :
+                    stack.append(child)
+        return sorted(rv, key=lambda x : x[0])
+
+    def query_flips(self, h, max_distance, hash_size=8) :
+        # query for h and its flips (hash_variants), so flipped augmentations are found too
+        best = {}
+        for v in hash_variants(h, hash_size) :
+            for (d, key) in self.query(v, max_distance) :
+                best[key] = min(d, best.get(key, d))
+        return sorted([(d, key) for (key, d) in best.items()], key=lambda x : x[0])
+
+
+def duplicate_groups(keys, hashes, max_distance=4, links=(), flips=True) :
+    '''
+    Groups of near duplicates : keys linked by a chain of hashes within max_distance
+    keys, hashes : parallel lists, None hashes are left alone
+    flips        : flipped images are near duplicates too (BKTree.query_flips)
+    links        : extra (key, key) pairs that belong together (e.g. an image and its augmentation)
+    returns : dict key -> group id (a key of its group)
+    '''
+    parent = {k : k for k in keys}
+    def find(k) :
+        while(parent[k] != k) :
+            parent[k] = parent[parent[k]]
+            k = parent[k]
+        return k
+    def union(a, b) :
+        (ra, rb) = (find(a), find(b))
+        if(ra != rb) :
+            parent[ra] = rb
+    tree = BKTree()
+    for (key, h) in zip(keys, hashes) :
+        if(h == None or max_distance == None) :
+            continue
+        for (d, other) in (tree.query_flips(h, max_distance) if flips else tree.query(h, max_distance)) :
+            union(key, other)
+        tree.add(h, key)
+    for (a, b) in links :
+        union(a, b)
+    return {k : find(k) for k in keys}
+
+
+def _list_images(image_dir) :
+    return sorted(set(fn for pattern in IMAGE_PATTERNS for fn in glob.glob(os.path.join(image_dir, pattern))))
+
+
+def _augmentation_groups(image_dir) :
+    # image id -> original file name from prop.json, so an image and its augmentations share a group
+    prop_fn = os.path.join(image_dir, "prop.json")
+    if(not os.path.isfile(prop_fn)) :
+        return {}
+    prop = json.loads(open(prop_fn).read())
+    file_prop_info = json.loads(prop['file_prop_info']) if isinstance(prop.get('file_prop_info'), str) else prop.get('file_prop_info', [])
+    return {i['_id'] : i['original_file_name'] for i in file_prop_info if 'original_file_name' in i}
+
+
+def split_dataset(image_dir, train_dir, test_dir, test_fraction=0.2, max_distance=4, num_procs=None, seed=None) :
+    '''
+    Split an exported dataset into train and test directories, keeping near duplicates together :
+    images within max_distance of each other (image_hash), and images sharing an original_file_name in
+    prop.json (an original and its augmentations), always land in the same split
+    image_dir      : exported dataset, images with their .xml (object detection) and prop.json
+    test_fraction  : fraction of the images put in test_dir (whole groups are moved, so approximately)
+    max_distance   : Hamming distance for near duplicates, None to only group by prop.json
+    seed           : random seed for the choice of test groups
+    returns : dict with the number of images, groups and test images
+    '''
+    files = _list_images(image_dir)
+    ids = [os.path.splitext(os.path.basename(fn))[0] for fn in files]
+    nprint("Split : {} images in {}".format(len(files), image_dir))
+
+    # an image and its augmentations share an original_file_name in prop.json
+    originals = _augmentation_groups(image_dir)
+    first = {}
+    links = []
+    for i in ids :
+        if(i in originals) :
+            links.append((i, first.setdefault(originals[i], i)))
+    hashes = [None] * len(files) if max_distance == None else hash_files(files, num_procs)
+    groups = duplicate_groups(ids, hashes, max_distance, links)
+
+    group_ids = sorted(set(groups.values()))
+    sizes = {}
+    for g in groups.values() :
+        sizes[g] = sizes.get(g, 0) + 1
+    rng = np.random.default_rng(seed)
+    test_groups = set()
+    num_test = 0
+    for idx in rng.permutation(len(group_ids)) :
+        if(num_test >= test_fraction * len(ids)) :
+            break
+        test_groups.add(group_ids[idx])
+        num_test += sizes[group_ids[idx]]
+
+    for d in [train_dir, test_dir] :
+        if(os.path.exists(d)) :
+            shutil.rmtree(d)
+        os.makedirs(d)
+    for (fn, i) in zip(files, ids) :
+        out_dir = test_dir if groups[i] in test_groups else train_dir
+        shutil.copy(fn, out_dir + "/")
+        xml_fn = os.path.join(image_dir, i + ".xml")
+        if(os.path.isfile(xml_fn)) :
+            shutil.copy(xml_fn, out_dir + "/")
+    if(os.path.isfile(os.path.join(image_dir, "prop.json"))) :
+        for d in [train_dir, test_dir] :
+            shutil.copy(os.path.join(image_dir, "prop.json"), d + "/")
+
+    rv = {'images' : len(ids), 'groups' : len(group_ids), 'test_images' : num_test, 'train_images' : len(ids) - num_test}
+    nprint("Split : {} images in {} groups, {} train, {} test".format(rv['images'], rv['groups'], rv['train_images'], rv['test_images']))
+    return rv
@@ -0,0 +1,166 @@
+# ivi_export.py
+
+# Functions to reorganize exported PAIV datasets (object detection and classification)
+import glob
+import json
+import pathlib
+import shutil
+import pandas as pd
+from ivi_common import nprint, _parse_paiv_xml
+
+
+################################
+# Object Detection Conversion Functions
+##################################
+def copy_file_to_objdir(row, **kwargs) : #directory_in,directory_out
+    # copy ofn/agm to new subdir ...
+    #print(row)         
+    fin = kwargs["directory_in"]  + "/" + row.name + "."+ row.suffix
+    fout = kwargs["directory_out"] + "/" + row.new_file_name
+
+    print("fin : {}".format(fin))
+    print("fout : {}".format(fout))
+    print("=============")
+    shutil.copy(fin,fout)
+
+# Add a column for a new transposed file name ..
+# nfn means new file name.. basically composing a file of original name + transform + file id for traceablitly
+def new_file_name(df):
+    df["nfn"] = df["original_file_name"].str.split(".", n = 1, expand = True)[0]
+    df["suffix"] = df["original_file_name"].str.split(".", n = 1, expand = True)[1]
+    if "augment_method" in df.columns :
+        df["nfn"] = df["nfn"] + "_" + df["augment_method"]
+    else :
+        df["nfn"] = df["nfn"] + "_na"
+    
+    df["nfn"] = df["nfn"] + "_" + df.index.str[-8:]
+    df["nfn"] = df["nfn"] + "." + df["suffix"]
+    return df["nfn"]
+    
+def reformat_ivi_objdet_export(directory_in:str, directory_out:str="/tmp/output") :
+    '''
+    Function that will take an exported PAIV project that has classificatins, and re-organize
+    the images into subdirectories
+    directory_in : directory path of an unzipped exported dataset
+    returns : 0 pass, 1 fail
+    side effect : new subdirectories get written under directory_out using class name from prop.json
+    '''
+     
+    with open(directory_in + '/prop.json') as json_file:
+        data = json.load(json_file)
+        prop_df = pd.read_json(data['file_prop_info'], orient='records').set_index("_id")
+    
+    prop_df["new_file_name"] = new_file_name(prop_df)
+    
+        
+    obj_df = create_paiv_df(directory_in)
+    # df[["original_file_name","xmin","ymin","xmax","ymax","label"]]
+    # join obj table with meta data table to get the new file name based on augmentation
+    #display(prop_df.head())
+    obj_df = obj_df.merge(prop_df, left_on="_id", right_on="_id", how="left")
+    #display(obj_df.head())
+    
+    # Create new path to write out files
+    obj_df["path"] = directory_out + "/objdet/" + obj_df["new_file_name"]
+    obj_df = obj_df[["path","xmin","ymin","xmax","ymax","label"]]
+    
+    # Make a directory objdet in directory_out
+    p = pathlib.Path(directory_out + "/objdet")
+    #nprint(str(p))
+    if(not(p.exists())) :
+        nprint("Creating a new sub directory {}".format(str(p)))
+        p.mkdir(parents=True)
+    
+    ## Now iterate thruogh each row of dataframe and COPY image to sudirectory
+    prop_df.apply(copy_file_to_objdir,directory_in=directory_in, directory_out=str(p) ,axis=1)  
+
+    csv_fileout = str(p.absolute()) + "/labels.csv"
+    nprint("Writing CSV data out to {}".format(csv_fileout))
+    obj_df.to_csv(csv_fileout,index=False)
+
+    return prop_df,obj_df
+    
+
+################################
+# Classification Conversion Functions
+##################################
+def copy_file_to_subdir(row,**kwargs) : #directory_in,directory_out
+    # copy ofn/agm to new subdir ...
+    #print(row)
+    augm="na"
+    if "augment_method" in row.keys() :
+        augm = str(row["augment_method"])
+    ofn= str(row["original_file_name"])
+    fid = row.name[-8:len(row.name)]
+    (ofn_root,ofn_extention) = row["original_file_name"].split('.')
+    print("ofn : {}".format(ofn))
+    print("ofn_root : {}".format(ofn_root))
+    print("ofn_extention {}".format(ofn_extention))
+    print("augm : {}".format(augm))
+          
+    newfile = "{}_{}_{}.{}".format(ofn_root,augm,fid,ofn_extention)
+    print("newfile : {}".format(newfile))
+    
+    fin = kwargs["directory_in"]  + "/" + row.name + ".jpg"
+    fout = kwargs["directory_out"] + "/" + row["category_name"] + "/"+ newfile
+    print("fin : {}".format(fin))
+    print("fout : {}".format(fout))
+    print("=============")
+    shutil.copy(fin,fout)
+
+def reformat_paiv_cls_export(directory_in:str, directory_out:str="/tmp/output") :
+    '''
+    Function that will take an exported PAIV project that has classificatins, and re-organize
+    the images into subdirectories
+    directory_in : directory path of an unzipped exported dataset
+    returns : 0 pass, 1 fail
+    side effect : new subdirectories get written under directory_out using class name from prop.json
+    '''
+     
+    with open(directory_in + '/prop.json') as json_file:
+        data = json.load(json_file)
+        df = pd.read_json(data['file_prop_info'], orient='records').set_index("_id")
+    
+    classes = list(df.category_name.unique())
+    nprint("classes : {}".format(classes))
+    # Make a directory in directory_out
+    for c in classes :
+        p = pathlib.Path(directory_out + "/" + c)
+        print(str(p))
+        if(not(p.exists())) :
+           nprint("Creating a new sub directory {}".format(str(p)))
+           p.mkdir(parents=True)
+
+    # Now iterate thruogh each row of dataframe and COPY image to sudirectory
+    df.apply(copy_file_to_subdir,directory_in=directory_in, directory_out=directory_out,axis=1)    
+
+
+           
+def create_paiv_df(directory_in) :
+    '''
+    Function can be used to create a pandas dataframe of the metadata exported from PAIV
+    directory_in : location that contains exported paiv meta data for bboxes
+    returns : meta_df /<- pandas dataframe of metadata 
+                format : filename,class,x1,y1,x1,x2,center,prob
+    '''
+    # Read in prop.json
+    with open(directory_in + '/prop.json') as json_file:
+        data = json.load(json_file)
+        meta_df = pd.read_json(data['file_prop_info'], orient='records').set_index("_id")
+    # Now process all the xmls... create a row per bbox, and join to 
+    # prop.josn based on the _id field..
+
+    bbox_list = []
+    xmlfiles = glob.glob(directory_in+"/*.xml")
+    for xmlfile in xmlfiles :
+        bbox_list = bbox_list + _parse_paiv_xml(xmlfile)
+        #print(bbox_list)
+        #break
+    bbox_df = pd.DataFrame(bbox_list)
+    print(len(bbox_df))
+    if(len(bbox_df) == 0) :
+        print("Warning : No bounding boxes found in prop.json.  Verify that this is an object detection data set")
+        print("Returning json dataframe without bounding boxes")
+    else :
+        meta_df = meta_df[['original_file_name']].merge(bbox_df, left_index=True,right_on="_id")
+    return meta_df
@@ -0,0 +1,335 @@
+# ivi_jobs.py
+
+# Backfill jobs too big for one fetch_scores process (hundreds of videos, millions of frames).  A planner
+# splits the sources into work items (a frame range of a video, or a chunk of images) and puts them in a
+# durable queue, a SQLite file, so no outside service is needed.  Any number of worker processes, on this
+# host or on others sharing the filesystem, lease items, score them and write each item's results to a file
+# of its own.  A lease expires unless its worker keeps renewing it, so the items of a worker that died are
+# leased again by the others, and failed items are retried up to max_attempts times.  merge_results then
+# builds the usual outputs : a results cache per video (ivi_cache, reused by edit_video_objdet) and a
+# fetch_scores json for the images (ivi_validate.validate_model).
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import time
+from threading import Event, Thread
+from ivi_common import nprint
+
+ITEM_STATES = ["pending", "leased", "done", "failed"]
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS items (
+    id            INTEGER PRIMARY KEY,
+    job           TEXT NOT NULL,
+    kind          TEXT NOT NULL,
+    source        TEXT NOT NULL,
+    payload       TEXT NOT NULL,
+    state         TEXT NOT NULL DEFAULT 'pending',
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    owner         TEXT,
+    lease_expires REAL,
+    error         TEXT,
+    result_fn     TEXT,
+    updated       REAL
+);
+CREATE INDEX IF NOT EXISTS items_state ON items (state, id);
+'''
+
+
+class WorkQueue():
+    '''
+    Durable queue of work items in a SQLite file.  Every process opens its own WorkQueue on the same file.
+    The default rollback journal is kept (not WAL), so processes on several hosts can share the file on a
+    filesystem with working locks.
+    db_path      : queue file, created if needed
+    lease_secs   : a leased item goes back to the queue if it is not completed or renewed within this time
+    max_attempts : an item that failed or lost its lease this many times is marked failed
+    '''
+    def __init__(self, db_path, lease_secs=300, max_attempts=5):
+        self.db_path = db_path
+        self.lease_secs = lease_secs
+        self.max_attempts = max_attempts
+        # autocommit, transactions are opened explicitly
+        self.db = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.db.executescript(_SCHEMA)
+
+    def close(self) :
+        self.db.close()
+
+    def enqueue(self, job, kind, source, payloads) :
+        '''
+        Add work items
+        job      : job name, items of a job are merged together
+        kind     : "frames" | "images"
+        payloads : list of dicts describing each item (json)
+        returns : number of items added
+        '''
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try :
+            self.db.executemany("INSERT INTO items (job, kind, source, payload, updated) VALUES (?, ?, ?, ?, ?)",
+                                [(job, kind, source, json.dumps(p), now) for p in payloads])
+            self.db.execute("COMMIT")
+        except Exception :
+            self.db.execute("ROLLBACK")
+            raise
+        return len(payloads)
+
+    def lease(self, owner, num_items=1) :
+        '''
+        Lease up to num_items pending items (or items whose lease expired) for lease_secs
+        returns : list of item dicts (id, job, kind, source, payload, attempts)
+        '''
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try :
+            # expired leases that used up their attempts
+            self.db.execute("UPDATE items SET state='failed', error=COALESCE(error, 'lease expired'), updated=? "
+                            "WHERE state='leased' AND lease_expires < ? AND attempts >= ?", (now, now, self.max_attempts))
+            rows = self.db.execute("SELECT id, job, kind, source, payload, attempts FROM items "
+                                   "WHERE (state='pending' OR (state='leased' AND lease_expires < ?)) AND attempts < ? "
+                                   "ORDER BY id LIMIT ?", (now, self.max_attempts, num_items)).fetchall()
+            self.db.executemany("UPDATE items SET state='leased', owner=?, lease_expires=?, attempts=attempts+1, updated=? WHERE id=?",
+                                [(owner, now + self.lease_secs, now, r[0]) for r in rows])
+            self.db.execute("COMMIT")
+        except Exception :
+            self.db.execute("ROLLBACK")
+            raise
+        return [{'id' : r[0], 'job' : r[1], 'kind' : r[2], 'source' : r[3], 'payload' : json.loads(r[4]), 'attempts' : r[5] + 1} for r in rows]
+
+    def renew(self, item_id, owner) :
+        # extend a lease, False if the item is no longer leased by owner
+        now = time.time()
+        cur = self.db.execute("UPDATE items SET lease_expires=?, updated=? WHERE id=? AND owner=? AND state='leased'",
+                              (now + self.lease_secs, now, item_id, owner))
+        return cur.rowcount == 1
+
+    def complete(self, item_id, owner, result_fn) :
+        '''
+        Mark a leased item done with the file holding its results.  An item whose lease expired is still
+        completed if nobody else finished it first (results of an item are the same whoever scores it)
+        returns : False if the item was already done
+        '''
+        cur = self.db.execute("UPDATE items SET state='done', owner=?, result_fn=?, error=NULL, updated=? WHERE id=? AND state!='done'",
+                              (owner, result_fn, time.time(), item_id))
+        return cur.rowcount == 1
+
+    def fail(self, item_id, owner, error) :
+        # give a leased item back to the queue (or mark it failed after max_attempts)
+        self.db.execute("UPDATE items SET state=CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, error=?, lease_expires=NULL, updated=? "
+                        "WHERE id=? AND owner=? AND state='leased'", (self.max_attempts, str(error), time.time(), item_id, owner))
+
+    def retry_failed(self, job=None) :
+        # put failed items back in the queue with fresh attempts
+        cur = self.db.execute("UPDATE items SET state='pending', attempts=0, error=NULL, updated=? WHERE state='failed'" +
+                              ("" if job == None else " AND job=?"), (time.time(),) if job == None else (time.time(), job))
+        return cur.rowcount
+
+    def stats(self, job=None) :
+        '''
+        returns : dict state -> number of items (leases that expired count as pending)
+        '''
+        now = time.time()
+        rv = {s : 0 for s in ITEM_STATES}
+        rows = self.db.execute("SELECT CASE WHEN state='leased' AND lease_expires < ? THEN 'pending' ELSE state END AS s, COUNT(*) FROM items" +
+                               ("" if job == None else " WHERE job=?") + " GROUP BY s", (now,) if job == None else (now, job)).fetchall()
+        for (s, n) in rows :
+            rv[s] = n
+        return rv
+
+    def items(self, job, state="done") :
+        rows = self.db.execute("SELECT id, kind, source, payload, result_fn FROM items WHERE job=? AND state=? ORDER BY id", (job, state)).fetchall()
+        return [{'id' : r[0], 'kind' : r[1], 'source' : r[2], 'payload' : json.loads(r[3]), 'result_fn' : r[4]} for r in rows]
+
+
+def plan_videos(queue, job, videos, model_url, sample_rate=1, chunk_frames=3000, max_frames=None) :
+    '''
+    Enqueue the sampled frames of videos as frame range items of chunk_frames frames
+    Frames are sampled like fetch_scores (frame 0 is skipped, result k is frame (k+1)*sample_rate)
+    returns : number of items
+    '''
+    import cv2
+    chunk_frames = max(int(chunk_frames // sample_rate) * sample_rate, sample_rate)
+    num_items = 0
+    for video_fn in videos :
+        cap = cv2.VideoCapture(video_fn)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        if(max_frames != None) :
+            total_frames = min(total_frames, max_frames)
+        if(total_frames <= 0) :
+            nprint("Error : could not read {}, skipping it".format(video_fn))
+            continue
+        payloads = [{'model_url' : model_url, 'start' : start, 'stop' : min(start + chunk_frames, total_frames),
+                     'sample_rate' : sample_rate, 'total_frames' : total_frames}
+                    for start in range(0, total_frames, chunk_frames)]
+        num_items += queue.enqueue(job, "frames", os.path.abspath(video_fn), payloads)
+    nprint("Planned {} items for {} videos".format(num_items, len(videos)))
+    return num_items
+
+
+def plan_images(queue, job, image_dir, model_url, validate_mode="object", chunk_size=200) :
+    # Enqueue the images of an exported dataset in chunks of chunk_size images
+    from ivi_common import _list_paiv_dataset
+    files = [os.path.abspath(image_fn) for (image_fn, meta) in _list_paiv_dataset(image_dir, validate_mode)]
+    payloads = [{'model_url' : model_url, 'files' : files[i:i + chunk_size]} for i in range(0, len(files), chunk_size)]
+    num_items = queue.enqueue(job, "images", os.path.abspath(image_dir), payloads)
+    nprint("Planned {} items for {} images".format(num_items, len(files)))
+    return num_items
+
+
+def _check_results(item, results) :
+    # a request that failed after its retries fails the item, so the queue hands it out again (up to max_attempts)
+    failed = [json_rv for json_rv in results if json_rv == None or 'classified' not in json_rv]
+    if(len(failed) > 0) :
+        raise RuntimeError("{} of {} requests of item {} failed to score".format(len(failed), len(results), item['id']))
+
+
+def _score_item(item, num_threads) :
+    # results of one item : [[slot, json], ...] for frames, {md5 : json} for images.  Raises if any request failed
+    payload = item['payload']
+    if(item['kind'] == "frames") :
+        from ivi_video import _score_segment
+        (start, stop, sample_rate) = (payload['start'], payload['stop'], payload['sample_rate'])
+        first = max(start, 1)
+        first += (-first) % sample_rate
+        results = _score_segment(item['source'], payload['model_url'], start, stop, sample_rate, num_threads)
+        _check_results(item, results)
+        return [[first // sample_rate - 1 + k, json_rv] for (k, json_rv) in enumerate(results)]
+    import cv2
+    from concurrent.futures import ThreadPoolExecutor
+    from ivi_common import get_np_hash
+    from ivi_scoring import get_json_from_paiv
+    def score(fn) :
+        img = cv2.imread(fn)
+        if(img is None) :
+            # one bad file should not fail the whole chunk again and again
+            nprint("Error : could not read {}, skipping it".format(fn))
+            return (None, None)
+        return (get_np_hash(img), get_json_from_paiv(payload['model_url'], img, os.path.basename(fn), 0))
+    with ThreadPoolExecutor(max_workers=num_threads) as pool :
+        results = {key : json_rv for (key, json_rv) in pool.map(score, payload['files']) if key != None}
+    _check_results(item, list(results.values()))
+    return results
+
+
+def run_worker(db_path, results_dir=None, num_threads=4, lease_secs=300, max_attempts=5, poll_secs=5.0, wait=False, max_items=None) :
+    '''
+    Lease, score and complete items until the queue is empty (or forever with wait=True, polling every poll_secs)
+    results_dir : item results are written here as item_<id>.json, default <db_path>.results
+    num_threads : concurrent api requests of this worker
+    The lease is renewed every lease_secs / 3 while an item is scored, so only a worker that stopped loses it
+    returns : number of items completed
+    '''
+    if(results_dir == None) :
+        results_dir = db_path + ".results"
+    if(not os.path.exists(results_dir)) :
+        os.makedirs(results_dir, exist_ok=True)
+    queue = WorkQueue(db_path, lease_secs, max_attempts)
+    owner = "{}:{}".format(socket.gethostname(), os.getpid())
+    done = 0
+    while(max_items == None or done < max_items) :
+        items = queue.lease(owner)
+        if(len(items) == 0) :
+            if(not wait) :
+                break
+            time.sleep(poll_secs)
+            continue
+        item = items[0]
+        nprint("{} : item {} ({} of {}), attempt {}".format(owner, item['id'], item['kind'], os.path.basename(item['source']), item['attempts']))
+
+        # renew the lease from its own connection while the item is scored
+        stop = Event()
+        def renew() :
+            renewer = WorkQueue(db_path, lease_secs, max_attempts)
+            while(not stop.wait(lease_secs / 3.0)) :
+                if(not renewer.renew(item['id'], owner)) :
+                    nprint("{} : lost the lease of item {}".format(owner, item['id']))
+                    break
+            renewer.close()
+        renewer = Thread(target=renew, daemon=True)
+        renewer.start()
+        try :
+            results = _score_item(item, num_threads)
+            result_fn = os.path.join(results_dir, "item_{}.json".format(item['id']))
+            # written next to the result and moved over it, a result file is always complete
+            f = open(result_fn + ".{}.tmp".format(os.getpid()), 'w')
+            f.write(json.dumps(results))
+            f.close()
+            os.replace(result_fn + ".{}.tmp".format(os.getpid()), result_fn)
+            queue.complete(item['id'], owner, result_fn)
+            done += 1
+        except Exception as e :
+            nprint("Error : item {} failed : {}".format(item['id'], e))
+            queue.fail(item['id'], owner, "{} : {}".format(type(e).__name__, e))
+        finally :
+            stop.set()
+            renewer.join()
+    queue.close()
+    nprint("{} : completed {} items".format(owner, done))
+    return done
+
+
+def run_workers(db_path, num_procs=2, **worker_args) :
+    '''
+    run_worker in num_procs processes on this host
+    returns : number of items completed
+    '''
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=num_procs, mp_context=multiprocessing.get_context("spawn")) as pool :
+        futures = [pool.submit(run_worker, db_path, **worker_args) for i in range(num_procs)]
+        return sum(f.result() for f in futures)
+
+
+def merge_results(db_path, job, output_directory) :
+    '''
+    Build the outputs of a job from the results of its done items :
+      videos : <output_directory>/<video name>/cache, a results cache edit_video_objdet reuses with force_refresh=False
+      images : <output_directory>/<image directory name>.fetch_scores.json, for ivi_validate.validate_model
+    Sources of the job with the same name (cam1/day.mp4, cam2/day.mp4) get _<hash of their path> added to it
+    returns : dict of the queue stats of the job (items not done are reported and left out)
+    '''
+    from ivi_cache import ResultsCacheWriter
+    queue = WorkQueue(db_path)
+    stats = queue.stats(job)
+    if(stats['done'] < sum(stats.values())) :
+        nprint("Warning : job {} is not finished : {}".format(job, stats))
+    by_source = {}
+    for item in queue.items(job) :
+        by_source.setdefault((item['kind'], item['source']), []).append(item)
+    queue.close()
+
+    def base_name(source) :
+        return os.path.splitext(os.path.basename(source.rstrip("/")))[0]
+    name_counts = {}
+    for (kind, source) in by_source :
+        name_counts[base_name(source)] = name_counts.get(base_name(source), 0) + 1
+
+    for ((kind, source), items) in by_source.items() :
+        name = base_name(source)
+        if(name_counts[name] > 1) :
+            name += "_" + hashlib.md5(source.encode("utf-8")).hexdigest()[:8]
+        if(kind == "frames") :
+            payload = items[0]['payload']
+            out_dir = os.path.join(output_directory, name)
+            if(not os.path.exists(out_dir)) :
+                os.makedirs(out_dir)
+            writer = ResultsCacheWriter(os.path.join(out_dir, "cache"), int((payload['total_frames'] - 1) / payload['sample_rate']))
+            for item in items :
+                for (slot, json_rv) in json.loads(open(item['result_fn']).read()) :
+                    writer.put(slot, json_rv)
+            writer.close()
+            nprint("Merged {} items of {} into {}/cache.*".format(len(items), source, out_dir))
+        else :
+            results = {}
+            for item in items :
+                results.update(json.loads(open(item['result_fn']).read()))
+            out_fn = os.path.join(output_directory, name + ".fetch_scores.json")
+            f = open(out_fn, 'w')
+            f.write(json.dumps(results))
+            f.close()
+            nprint("Merged {} items of {} into {}".format(len(items), source, out_fn))
+    return stats
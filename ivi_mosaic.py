@@ -0,0 +1,113 @@
+# ivi_mosaic.py
+
+# Client side batching for the PAIV API, which takes one image per request : K frames are downscaled into
+# the tiles of one mosaic image, scored with a single request, and the boxes are split back per frame
+# (shifted to their tile and scaled back up, see Box.scale).  Boxes that cross a tile boundary are dropped.
+# Worth it when the model input is low resolution anyway (sampled video, small frames), where the
+# per request overhead dominates.  Settings are per model, see mosaic_settings.
+import cv2
+import json
+import numpy as np
+from threading import Lock
+from ivi_boxes import BoxArray
+from ivi_common import nprint
+from ivi_scoring import encode_image, post_image_to_paiv
+
+
+def mosaic_settings(model_url, settings_fn) :
+    '''
+    MosaicBatcher settings of a model from a json file of {model url : settings}, with an optional
+    "default" entry for the other models, e.g. {"default" : {"grid" : [2,2]}, "https://.../model-a" : {"grid" : [3,3], "tile_size" : [320,240]}}
+    returns : settings dict, None if the model should not be batched
+    '''
+    settings = json.loads(open(settings_fn).read())
+    return settings.get(model_url, settings.get("default"))
+
+
+class MosaicBatcher():
+    '''
+    Packs frames into mosaics for one model
+    model_url  : deployed model endpoint
+    grid       : (columns, rows) of tiles, up to columns*rows frames per request
+    tile_size  : (width, height) each frame is resized to.  Default : the first frame's size / grid,
+                 so the mosaic is the size of one frame
+    gutter     : black pixels between tiles, so objects of neighbouring tiles are not merged into one box
+    tolerance  : pixels a box may spill out of its tile before it is dropped
+    quality    : jpeg quality of the mosaic
+    '''
+    def __init__(self, model_url, grid=(2,2), tile_size=None, gutter=8, tolerance=2, quality=95):
+        self.model_url = model_url
+        self.grid = tuple(grid)
+        self.tile_size = None if tile_size == None else tuple(tile_size)
+        self.gutter = gutter
+        self.tolerance = tolerance
+        self.quality = quality
+        # request / frame counts, score runs on several consumer threads
+        self.lock = Lock()
+        self.requests = 0
+        self.frames = 0
+
+    @property
+    def batch_size(self) :
+        return self.grid[0] * self.grid[1]
+
+    def _tile_origin(self, i) :
+        (tw, th) = self.tile_size
+        (col, row) = (i % self.grid[0], i // self.grid[0])
+        return (col * (tw + self.gutter), row * (th + self.gutter))
+
+    def make_mosaic(self, frames) :
+        # mosaic image of up to batch_size frames, tiles in row order.  Unused tiles stay black
+        if(self.tile_size == None) :
+            (h, w) = frames[0].shape[:2]
+            self.tile_size = (max(w // self.grid[0], 1), max(h // self.grid[1], 1))
+        (tw, th) = self.tile_size
+        mosaic = np.zeros((self.grid[1] * (th + self.gutter) - self.gutter, self.grid[0] * (tw + self.gutter) - self.gutter, 3), dtype=np.uint8)
+        for (i, frame) in enumerate(frames) :
+            (x0, y0) = self._tile_origin(i)
+            mosaic[y0:y0+th, x0:x0+tw] = cv2.resize(frame, (tw, th), interpolation=cv2.INTER_AREA)
+        return mosaic
+
+    def split_results(self, json_rv, frames) :
+        '''
+        Split the api response for a mosaic into per frame responses
+        Each box goes to the tile its center is in, and is dropped if it crosses the tile boundary
+        returns : list of json responses (same layout as the api), one per frame
+        '''
+        if(json_rv == None or 'classified' not in json_rv) :
+            return [json_rv] * len(frames)
+        boxes = BoxArray.from_json(json_rv)
+        (tw, th) = self.tile_size
+        cent = (boxes.coords[:, 0:2] + boxes.coords[:, 2:4]) / 2.0
+        col = np.floor(cent[:, 0] / (tw + self.gutter)).astype(np.int64)
+        row = np.floor(cent[:, 1] / (th + self.gutter)).astype(np.int64)
+        tile = row * self.grid[0] + col
+        conf = [b['confidence'] for b in json_rv['classified']]
+
+        rv = []
+        for (i, frame) in enumerate(frames) :
+            (x0, y0) = self._tile_origin(i)
+            # boxes of this tile, shifted to the tile origin, that stay inside it
+            local = boxes.coords[tile == i] - np.array([x0, y0, x0, y0])
+            inside = ((local[:, 0] >= -self.tolerance) & (local[:, 1] >= -self.tolerance) &
+                      (local[:, 2] <= tw + self.tolerance) & (local[:, 3] <= th + self.tolerance))
+            idx = np.nonzero(tile == i)[0][inside]
+            tile_boxes = BoxArray(boxes.labels[idx], local[inside], None).clip(tw, th)
+            (h, w) = frame.shape[:2]
+            scaled = tile_boxes.scale(w / float(tw), h / float(th), 0)
+            classified = [{'label' : l, 'xmin' : int(c[0]), 'ymin' : int(c[1]), 'xmax' : int(c[2]), 'ymax' : int(c[3]), 'confidence' : conf[j]}
+                          for (l, c, j) in zip(scaled.labels.tolist(), scaled.coords.tolist(), idx.tolist())]
+            rv.append(dict(json_rv, classified=classified))
+        return rv
+
+    def score(self, frames, temporary_fn="mosaic.jpg", thr_id=0) :
+        '''
+        Score up to batch_size frames with one request
+        returns : list of json responses, one per frame
+        '''
+        mosaic = self.make_mosaic(frames)
+        json_rv = post_image_to_paiv(self.model_url, encode_image(mosaic, self.quality), temporary_fn, thr_id)
+        with self.lock :
+            self.requests += 1
+            self.frames += len(frames)
+        return self.split_results(json_rv, frames)
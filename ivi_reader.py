@@ -0,0 +1,205 @@
+# ivi_reader.py
+
+# Video readers.  The video paths open their input with open_video_reader, which returns an object with the
+# cv2.VideoCapture calls they use (read, grab, get / set of CAP_PROP_POS_FRAMES, get of the fps, frame count,
+# size and position in ms, release), so the decoding backend is picked per call :
+#   "cv2"  : cv2.VideoCapture, one decoding thread, the frame count is the container's estimate
+#   "pyav" : PyAV (the ffmpeg libraries) : frame / slice threaded decoding on every core, keyframe only
+#            decoding, timestamps from the frame pts, frames scaled to a smaller size while they are converted
+#            to bgr, and an exact frame count (the container index, or counting packets without decoding them)
+import cv2
+from ivi_common import nprint
+
+
+class Cv2Reader():
+    '''
+    cv2.VideoCapture with the reader interface
+    input_video : file name (or camera index / stream url)
+    size        : optional (width, height) to resize the frames to
+    '''
+    def __init__(self, input_video, size=None):
+        self.cap = cv2.VideoCapture(input_video)
+        self.size = None if size == None else tuple(int(v) for v in size)
+
+    def isOpened(self) :
+        return self.cap.isOpened()
+
+    def grab(self) :
+        return self.cap.grab()
+
+    def read(self) :
+        ret, frame = self.cap.read()
+        if(ret and self.size != None and (frame.shape[1], frame.shape[0]) != self.size) :
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return (ret, frame)
+
+    def get(self, prop) :
+        if(self.size != None and prop in [cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT]) :
+            return float(self.size[0] if prop == cv2.CAP_PROP_FRAME_WIDTH else self.size[1])
+        return self.cap.get(prop)
+
+    def set(self, prop, value) :
+        return self.cap.set(prop, value)
+
+    def release(self) :
+        self.cap.release()
+
+
+class PyAvReader():
+    '''
+    PyAV decoding with the reader interface
+    input_video    : file name
+    threads        : decoding threads, 0 lets ffmpeg use one per core.  Frame and slice threading are both
+                     enabled, so high bitrate H.264 / H.265 decoding scales with cores
+    keyframes_only : only decode keyframes (skip_frame NONKEY), a fast pass over a long video.  The frame
+                     position (CAP_PROP_POS_FRAMES) and timestamp then jump from keyframe to keyframe
+    size           : optional (width, height) : frames are scaled to this size while being converted to bgr,
+                     in the same swscale pass, so a reduced resolution costs less than a full size frame
+    count_frames   : count the packets for the frame count (no decoding) instead of trusting the container
+                     header.  Default : only when the header has no count
+    The position and timestamp come from the pts of the frames, so they stay right after a seek.
+    '''
+    def __init__(self, input_video, threads=0, keyframes_only=False, size=None, count_frames=False):
+        import av
+        self.input_video = input_video
+        self.container = av.open(input_video)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"
+        self.stream.thread_count = int(threads)
+        self.keyframes_only = keyframes_only
+        if(keyframes_only) :
+            self.stream.codec_context.skip_frame = "NONKEY"
+        self.size = None if size == None else tuple(int(v) for v in size)
+        rate = self.stream.average_rate or self.stream.guessed_rate
+        self.fps = float(rate) if rate else 0.0
+        self.time_base = self.stream.time_base
+        self.start_pts = self.stream.start_time or 0
+        self.frame_count = self.stream.frames
+        if(count_frames or self.frame_count <= 0) :
+            self.frame_count = self._count_packets()
+        self.frames = None
+        self.pending = None
+        self.pos = 0
+        self.timestamp = 0.0
+
+    def _count_packets(self) :
+        # one packet per frame for video, demuxed from a second handle without decoding
+        import av
+        container = av.open(self.input_video)
+        count = sum(1 for packet in container.demux(container.streams.video[0]) if packet.size > 0)
+        container.close()
+        return count
+
+    def _frame_index(self, frame) :
+        # frame number of a decoded frame (or packet) from its pts, None if it has none
+        if(frame.pts == None or self.fps <= 0) :
+            return None
+        return int(round(float((frame.pts - self.start_pts) * self.time_base) * self.fps))
+
+    def keyframe_indices(self) :
+        '''
+        Frame numbers of the keyframes, from the packet flags (demuxed from a second handle, nothing is decoded)
+        '''
+        import av
+        container = av.open(self.input_video)
+        frames = []
+        for packet in container.demux(container.streams.video[0]) :
+            if(packet.is_keyframe and packet.size > 0 and self._frame_index(packet) != None) :
+                frames.append(self._frame_index(packet))
+        container.close()
+        return sorted(frames)
+
+    def _next(self) :
+        # next decoded frame, None at the end of the video
+        if(self.pending != None) :
+            (frame, self.pending) = (self.pending, None)
+        else :
+            if(self.frames == None) :
+                self.frames = self.container.decode(self.stream)
+            try :
+                frame = next(self.frames)
+            except StopIteration :
+                return None
+        index = self._frame_index(frame)
+        self.pos = (index if (index != None and (self.keyframes_only or self.pos == 0)) else self.pos) + 1
+        if(frame.pts != None) :
+            self.timestamp = float((frame.pts - self.start_pts) * self.time_base)
+        elif(self.fps > 0) :
+            self.timestamp = (self.pos - 1) / self.fps
+        return frame
+
+    def isOpened(self) :
+        return True
+
+    def grab(self) :
+        # decode without converting to bgr
+        return self._next() != None
+
+    def read(self) :
+        frame = self._next()
+        if(frame == None) :
+            return (False, None)
+        if(self.size != None) :
+            return (True, frame.to_ndarray(format="bgr24", width=self.size[0], height=self.size[1]))
+        return (True, frame.to_ndarray(format="bgr24"))
+
+    def seek(self, frame_idx) :
+        '''
+        Position on frame frame_idx : seek to the keyframe before it and decode up to it
+        '''
+        frame_idx = max(int(frame_idx), 0)
+        target = self.start_pts + int(frame_idx / self.fps / self.time_base) if self.fps > 0 else self.start_pts
+        self.container.seek(target, stream=self.stream, backward=True)
+        self.frames = self.container.decode(self.stream)
+        self.pending = None
+        for frame in self.frames :
+            index = self._frame_index(frame)
+            if(index == None or index >= frame_idx or self.keyframes_only) :
+                self.pending = frame
+                break
+        self.pos = frame_idx if self.pending == None else max(self._frame_index(self.pending) or frame_idx, 0)
+        return True
+
+    def get(self, prop) :
+        if(prop == cv2.CAP_PROP_FPS) :
+            return self.fps
+        if(prop == cv2.CAP_PROP_FRAME_COUNT) :
+            return float(self.frame_count)
+        if(prop == cv2.CAP_PROP_POS_FRAMES) :
+            return float(self.pos)
+        if(prop == cv2.CAP_PROP_POS_MSEC) :
+            return 1000.0 * self.timestamp
+        if(prop == cv2.CAP_PROP_FRAME_WIDTH) :
+            return float(self.size[0] if self.size != None else self.stream.codec_context.width)
+        if(prop == cv2.CAP_PROP_FRAME_HEIGHT) :
+            return float(self.size[1] if self.size != None else self.stream.codec_context.height)
+        return 0.0
+
+    def set(self, prop, value) :
+        if(prop == cv2.CAP_PROP_POS_FRAMES) :
+            return self.seek(value)
+        return False
+
+    def release(self) :
+        self.container.close()
+
+
+READER_BACKENDS = {'cv2' : Cv2Reader, 'pyav' : PyAvReader}
+
+
+def open_video_reader(input_video, backend="cv2", **reader_args) :
+    '''
+    Open a video reader
+    backend     : 'cv2' | 'pyav'
+    reader_args : passed on to the backend (size for both, threads, keyframes_only, count_frames for pyav)
+    returns : reader with the cv2.VideoCapture read / grab / get / set / release calls
+    '''
+    if(backend not in READER_BACKENDS) :
+        raise ValueError("unknown video reader backend {}, use one of {}".format(backend, list(READER_BACKENDS.keys())))
+    if(backend == "cv2") :
+        return Cv2Reader(input_video, **reader_args)
+    try :
+        return PyAvReader(input_video, **reader_args)
+    except ImportError :
+        nprint("Warning : PyAV (pip install av) is not installed, reading {} with cv2".format(input_video))
+        return Cv2Reader(input_video, size=reader_args.get('size'))
@@ -0,0 +1,141 @@
+# ivi_render.py
+
+# Rendering helpers for the draw_* functions of ivi_video.  The per frame cost of an overlay should
+# depend on the size of the overlay, not of the frame :
+#   blend_rect   : shades a rectangle by blending only its region of interest, no full frame copy
+#   TextLayer    : text rendered once into a small color layer + alpha mask, then composited per frame
+#   LayerCache   : bounded cache of rendered layers, keyed on what is drawn, so a layer is only
+#                  rendered again when its content changes
+#   draw_text    : cv2.putText through cached text layers (titles and labels are rendered once)
+#   thumbnail    : thumbnails read and resized once per (file, size)
+#   label_color  : color of a label, md5 hashed once per label
+import cv2
+import hashlib
+import numpy as np
+import os
+from collections import OrderedDict
+from threading import Lock
+
+
+def _clip_roi(img, x0, y0, x1, y1) :
+    # (x0, y0, x1, y1) clipped to the image, None if nothing is left
+    (h, w) = img.shape[:2]
+    (cx0, cy0, cx1, cy1) = (max(x0, 0), max(y0, 0), min(x1, w), min(y1, h))
+    if(cx0 >= cx1 or cy0 >= cy1) :
+        return None
+    return (cx0, cy0, cx1, cy1)
+
+
+def blend_rect(img, ulc, lrc, color_bgr, alpha) :
+    '''
+    Shade the rectangle ulc-lrc (inclusive, like cv2.rectangle) in place : alpha * color + (1-alpha) * img
+    Same pixels as drawing a filled rectangle on a copy of img and cv2.addWeighted over the whole frame.
+    '''
+    roi = _clip_roi(img, ulc[0], ulc[1], lrc[0] + 1, lrc[1] + 1)
+    if(roi == None) :
+        return img
+    (x0, y0, x1, y1) = roi
+    patch = img[y0:y1, x0:x1]
+    shade = np.empty_like(patch)
+    shade[:] = color_bgr
+    cv2.addWeighted(shade, alpha, patch, 1.0 - alpha, 0, patch)
+    return img
+
+
+class TextLayer():
+    '''
+    Text drawn once into a layer the size of its bounding box
+    texts : list of (text, (x,y) origin, font, scale, color_bgr, thickness) with origins relative to the layer
+    size  : (width, height) of the layer
+    '''
+    def __init__(self, texts, size):
+        (w, h) = size
+        self.color = np.zeros((h, w, 3), dtype=np.uint8)
+        self.alpha = np.zeros((h, w), dtype=np.uint8)
+        for (text, org, ft, sz, color_bgr, thickness) in texts :
+            cv2.putText(self.color, text, org, ft, sz, color_bgr, thickness, cv2.LINE_AA)
+            cv2.putText(self.alpha, text, org, ft, sz, 255, thickness, cv2.LINE_AA)
+        # only the rows / columns with text are composited
+        (ys, xs) = np.nonzero(self.alpha)
+        if(len(ys) == 0) :
+            self.bbox = None
+        else :
+            self.bbox = (int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1)
+            (x0, y0, x1, y1) = self.bbox
+            self.color = self.color[y0:y1, x0:x1].astype(np.uint16)
+            self.alpha = self.alpha[y0:y1, x0:x1, None].astype(np.uint16)
+            self.inv_alpha = 255 - self.alpha
+
+    def draw(self, img, x, y) :
+        # composite the layer with its origin at (x,y) of img, in place
+        if(self.bbox == None) :
+            return img
+        (bx0, by0, bx1, by1) = self.bbox
+        roi = _clip_roi(img, x + bx0, y + by0, x + bx1, y + by1)
+        if(roi == None) :
+            return img
+        (x0, y0, x1, y1) = roi
+        (lx0, ly0) = (x0 - x - bx0, y0 - y - by0)
+        (lx1, ly1) = (lx0 + x1 - x0, ly0 + y1 - y0)
+        patch = img[y0:y1, x0:x1]
+        # the color layer is already alpha weighted (text drawn over black)
+        blended = (patch * self.inv_alpha[ly0:ly1, lx0:lx1] + 127) // 255 + self.color[ly0:ly1, lx0:lx1]
+        patch[:] = np.minimum(blended, 255)
+        return img
+
+
+class LayerCache():
+    '''
+    Bounded LRU cache of rendered layers, thread safe (frames are drawn by several threads)
+    get(key, render_fn) returns the layer for key, calling render_fn() only if it is not cached
+    '''
+    def __init__(self, max_items=256):
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key, render_fn) :
+        with self.lock :
+            if(key in self.items) :
+                self.items.move_to_end(key)
+                return self.items[key]
+        layer = render_fn()
+        with self.lock :
+            self.items[key] = layer
+            if(len(self.items) > self.max_items) :
+                self.items.popitem(last=False)
+        return layer
+
+
+_text_layers = LayerCache(max_items=1024)
+
+def draw_text(img, text, org, font, scale, color_bgr, thickness) :
+    '''
+    cv2.putText(img, text, org, font, scale, color_bgr, thickness, cv2.LINE_AA) from a cached TextLayer,
+    the text is only rendered the first time it is drawn with these settings
+    '''
+    def render() :
+        ((w, h), baseline) = cv2.getTextSize(text, font, scale, thickness)
+        pad = thickness + 2
+        layer = TextLayer([(text, (pad, h + pad), font, scale, color_bgr, thickness)], (w + 2*pad, h + baseline + 2*pad))
+        layer.org = (pad, h + pad)
+        return layer
+    layer = _text_layers.get((text, font, scale, tuple(color_bgr), thickness), render)
+    return layer.draw(img, org[0] - layer.org[0], org[1] - layer.org[1])
+
+
+_thumbnails = LayerCache(max_items=16)
+
+def thumbnail(image_fn, size_xy) :
+    # image_fn read and resized to size_xy, cached until the file changes
+    key = (image_fn, tuple(size_xy), os.path.getmtime(image_fn))
+    return _thumbnails.get(key, lambda : cv2.resize(cv2.imread(image_fn), tuple(size_xy)))
+
+
+_label_colors = {}
+
+def label_color(label, colors) :
+    # colors[hash of label % 6], the same color for a label in every run
+    if(label not in _label_colors) :
+        _label_colors[label] = int(hashlib.md5(label.encode('utf-8')).hexdigest(), 16 ) % 6
+    return colors[_label_colors[label]]
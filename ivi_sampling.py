@@ -0,0 +1,222 @@
+# ivi_sampling.py
+
+# Adaptive sampling for scoring a video : instead of one request every sample_rate frames, frames are scored
+# densely while the detections change (labels, counts, boxes moving) and the stride backs off exponentially,
+# up to max_stride frames, while they are stable.  When a change shows up after a long stride, the frames
+# skipped in between are scored too (backfill), so an event is not only seen from its first sampled frame.
+# Slots stay on the sample_rate grid of the results cache (result k is frame (k+1)*sample_rate), slots that
+# were not scored are marked skipped (ivi_cache.STATUS_SKIPPED) and read as the last scored result, so
+# rendering, sidecars and tracking use the video as if it had been scored at sample_rate.
+import cv2
+import json
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition
+from ivi_boxes import BoxArray, iou_matrix
+from ivi_common import nprint
+from ivi_reader import open_video_reader
+
+
+def detections_changed(boxes_a, boxes_b, iou_threshold=0.5) :
+    '''
+    True if the detections of two frames differ : a different number of boxes of some label, or a box
+    without a box of the same label overlapping it by at least iou_threshold in the other frame (it moved)
+    '''
+    if(len(boxes_a) != len(boxes_b)) :
+        return True
+    if(len(boxes_a) == 0) :
+        return False
+    if(sorted(boxes_a.labels.tolist()) != sorted(boxes_b.labels.tolist())) :
+        return True
+    iou = iou_matrix(boxes_a.coords, boxes_b.coords)
+    iou[boxes_a.labels[:, None] != boxes_b.labels[None, :]] = 0.0
+    return bool(iou.max(axis=1).min() < iou_threshold or iou.max(axis=0).min() < iou_threshold)
+
+
+class AdaptiveSampler():
+    '''
+    Picks the slots to score from the results seen so far.  Not thread safe, call under a lock.
+    max_stride    : longest stride, in slots
+    backoff       : stride multiplier after each stable result
+    iou_threshold : see detections_changed
+    Each chosen slot is compared with the previous chosen slot once both results are in, so results
+    may arrive in any order.  A change resets the stride to 1 and returns the slots in between for backfill.
+    '''
+    def __init__(self, max_stride=16, backoff=2, iou_threshold=0.5):
+        self.max_stride = max(int(max_stride), 1)
+        self.backoff = backoff
+        self.iou_threshold = iou_threshold
+        self.stride = 1
+        self.next_slot = 0
+        self.chain = []
+        self.pos = 0
+        self.results = {}
+        self.last = None
+        self.changes = 0
+
+    def due(self, slot) :
+        return slot >= self.next_slot
+
+    def choose(self, slot) :
+        self.chain.append(slot)
+        self.next_slot = slot + self.stride
+
+    def unresolved(self) :
+        # chosen slots not compared yet
+        return len(self.chain) - self.pos
+
+    def observe(self, slot, boxes) :
+        '''
+        Result of a chosen slot (results of other slots are ignored)
+        returns : list of slots to backfill
+        '''
+        if(slot not in self.chain[self.pos:]) :
+            return []
+        self.results[slot] = boxes
+        backfill = []
+        while(self.pos < len(self.chain) and self.chain[self.pos] in self.results) :
+            s = self.chain[self.pos]
+            b = self.results.pop(s)
+            if(self.last != None) :
+                (prev_slot, prev_boxes) = self.last
+                if(detections_changed(prev_boxes, b, self.iou_threshold)) :
+                    self.changes += 1
+                    self.stride = 1
+                    backfill.extend(range(prev_slot + 1, s))
+                else :
+                    self.stride = min(int(self.stride * self.backoff), self.max_stride)
+            self.last = (s, b)
+            self.pos += 1
+        # the new stride applies from the newest chosen slot
+        self.next_slot = self.chain[-1] + self.stride
+        return backfill
+
+
+def score_video_adaptive(score_fn, video_fn, frame_limit, sample_rate=1, max_stride=16, backoff=2, iou_threshold=0.5,
+                         num_threads=2, results_cache=None, paiv_results_file=None, reader="cv2", reader_args=None) :
+    '''
+    Score a video with adaptive sampling (called by ivi_scoring.fetch_scores with adaptive settings)
+    score_fn      : score_fn(frame, temporary_fn, thr_id) returns the api json (get_json_from_paiv, TiledScorer.score, ...)
+    frame_limit   : frames of the video to score
+    sample_rate   : shortest stride in frames, and the slot grid of the results
+    max_stride    : longest stride in frames (rounded down to a multiple of sample_rate)
+    backoff, iou_threshold : see AdaptiveSampler
+    num_threads   : concurrent requests.  The decoder stays at most num_threads chosen frames ahead of the
+                    results, so the stride reacts within num_threads requests
+    results_cache : ResultsCacheWriter, skipped slots are marked skipped
+    paiv_results_file : json list of results (like fetch_scores), {'skipped' : ...} for skipped slots
+    reader, reader_args : video reader backend and its settings (ivi_reader.open_video_reader)
+    returns : dict of stats (slots, scored, backfilled, changes)
+    '''
+    reader_args = dict(reader_args or {})
+    cap = open_video_reader(video_fn, reader, **reader_args)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frame_limit = int(min(frame_limit, total_frames))
+    num_slots = max(int((frame_limit - 1) / sample_rate), 0)
+    sampler = AdaptiveSampler(max(max_stride // sample_rate, 1), backoff, iou_threshold)
+    nprint("Adaptive sampling : {} frames, stride {} to {} frames".format(frame_limit, sample_rate, sampler.max_stride * sample_rate))
+
+    results = [None] * num_slots
+    scored = set()
+    backfill_q = []
+    pending = [0]
+    cond = Condition()
+    pool = ThreadPoolExecutor(max_workers=num_threads)
+
+    def score(slot, frame) :
+        return score_fn(frame, "adaptive_{}.jpg".format(slot), slot)
+
+    def submit(slot, frame) :
+        scored.add(slot)
+        with cond :
+            pending[0] += 1
+        pool.submit(score, slot, frame).add_done_callback(lambda future, slot=slot : done(slot, future))
+
+    def done(slot, future) :
+        try :
+            json_rv = future.result()
+        except Exception as e :
+            nprint("Error : scoring slot {} failed : {}".format(slot, e))
+            json_rv = None
+        results[slot] = json_rv
+        if(results_cache != None) :
+            results_cache.put(slot, json_rv)
+        boxes = BoxArray.from_json(json_rv) if (json_rv != None and 'classified' in json_rv) else BoxArray()
+        with cond :
+            backfill_q.extend(sampler.observe(slot, boxes))
+            pending[0] -= 1
+            cond.notify_all()
+
+    def run_backfill(slots) :
+        # the skipped frames of a gap, from a second capture seeked to the start of each run of slots
+        slots = sorted(set(slots) - scored)
+        bcap = open_video_reader(video_fn, reader, **reader_args)
+        pos = -1
+        for slot in slots :
+            frame_idx = (slot + 1) * sample_rate
+            if(pos < 0 or frame_idx - pos > 2 * sample_rate * sampler.max_stride) :
+                bcap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+                pos = frame_idx
+            while(pos < frame_idx) :
+                bcap.grab()
+                pos += 1
+            ret, frame = bcap.read()
+            pos += 1
+            if(frame is not None) :
+                submit(slot, frame)
+        bcap.release()
+
+    def wait(ready) :
+        # run backfills until ready() holds
+        while(True) :
+            with cond :
+                while(len(backfill_q) == 0 and not ready()) :
+                    cond.wait()
+                todo = list(backfill_q)
+                del backfill_q[:]
+            if(len(todo) > 0) :
+                run_backfill(todo)
+            else :
+                return
+
+    # Frame 0 is skipped like the annotation pass does
+    cap.grab()
+    for frame_idx in range(1, frame_limit) :
+        if(frame_idx % sample_rate != 0 or frame_idx // sample_rate > num_slots) :
+            cap.grab()
+            continue
+        slot = frame_idx // sample_rate - 1
+        wait(lambda : sampler.unresolved() < num_threads)
+        with cond :
+            due = sampler.due(slot)
+            if(due) :
+                sampler.choose(slot)
+        if(due) :
+            ret, frame = cap.read()
+            if(frame is None) :
+                break
+            submit(slot, frame)
+        else :
+            cap.grab()
+        if(frame_idx % 500 == 0) :
+            nprint("Adaptive sampling : frame {}, stride {} frames, {} scored".format(frame_idx, sampler.stride * sample_rate, len(scored)))
+    wait(lambda : pending[0] == 0)
+    pool.shutdown()
+    cap.release()
+
+    num_chosen = len(sampler.chain)
+    for slot in range(num_slots) :
+        if(slot not in scored) :
+            results[slot] = {'skipped' : 'adaptive sampling'}
+            if(results_cache != None) :
+                results_cache.skip(slot)
+    stats = {'slots' : num_slots, 'scored' : len(scored), 'backfilled' : len(scored) - num_chosen, 'changes' : sampler.changes}
+    nprint("Adaptive sampling : scored {} of {} frames ({} backfilled, {} changes), {:0.0f}% fewer requests than sample_rate {}".format(
+        stats['scored'], num_slots, stats['backfilled'], stats['changes'], 100.0 * (1 - stats['scored'] / float(max(num_slots, 1))), sample_rate))
+
+    if(paiv_results_file != None) :
+        nprint("Writing json data to {}".format(paiv_results_file))
+        f = open(paiv_results_file, 'w')
+        f.write(json.dumps(results))
+        f.close()
+    return stats
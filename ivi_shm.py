@@ -0,0 +1,198 @@
+# ivi_shm.py
+
+# Process based frame pipeline.  run_frame_pipeline (ivi_video) draws on threads, which scales while the cv2
+# calls release the GIL, but the python side of drawing, encoding and hashing each frame still runs one
+# thread at a time, and handing frames to processes through a pipe would pickle megabytes per frame.
+# Here frames go through a ring of fixed shape slots in multiprocessing.shared_memory : the decoder copies
+# each frame into a free slot once, worker processes attach to the ring by name and work on the slot in
+# place, and only (seq, slot, small args / small result) tuples go through the queues.
+import multiprocessing
+import os
+import numpy as np
+from itertools import chain
+from multiprocessing import shared_memory
+from queue import Empty, Queue
+from threading import Event, Thread
+from ivi_common import nprint
+
+
+class FrameRing():
+    '''
+    num_slots frames of one shape and dtype in one shared memory block.  ring[i] is a numpy view of slot i (no copy).
+    A ring pickles as its name and layout, so a process it is passed to attaches to the same memory.
+    The process that created the ring owns it : close() in every process, then unlink() in the owner
+    name : attach to an existing ring, None to create one
+    '''
+    def __init__(self, num_slots, shape, dtype=np.uint8, name=None):
+        self.num_slots = int(num_slots)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = name == None
+        size = self.num_slots * int(np.prod(self.shape)) * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size if self.owner else 0)
+        self.frames = np.ndarray((self.num_slots,) + self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    @property
+    def name(self) :
+        return self.shm.name
+
+    def __len__(self) :
+        return self.num_slots
+
+    def __getitem__(self, slot) :
+        return self.frames[slot]
+
+    def __getstate__(self) :
+        return {'name' : self.shm.name, 'num_slots' : self.num_slots, 'shape' : self.shape, 'dtype' : self.dtype.str}
+
+    def __setstate__(self, state) :
+        self.__init__(state['num_slots'], state['shape'], state['dtype'], name=state['name'])
+
+    def close(self) :
+        # views of the slots must not be used after this
+        self.frames = None
+        self.shm.close()
+
+    def unlink(self) :
+        if(self.owner) :
+            self.shm.unlink()
+
+
+def _ring_worker(ring, work_fn, tasks, results) :
+    # worker process : run work_fn on the slots named by tasks until a None task
+    while(True) :
+        item = tasks.get()
+        if(item == None) :
+            break
+        (seq, slot, args) = item
+        try :
+            frame = ring[slot]
+            rv = work_fn(frame, args)
+            if(isinstance(rv, np.ndarray)) :
+                # a drawn frame stays in the slot, copied back if it was not drawn in place
+                if(not np.shares_memory(rv, frame)) :
+                    frame[...] = rv
+                rv = None
+            results.put((seq, slot, rv, None))
+        except Exception as e :
+            results.put((seq, slot, None, "{} : {}".format(type(e).__name__, e)))
+    ring.close()
+
+
+def run_process_pipeline(frame_source, work_fn, result_fn, num_procs=None, num_slots=None) :
+    '''
+    Staged pipeline like ivi_video.run_frame_pipeline, with the per frame work in processes on a FrameRing :
+      decoder   : this thread iterates frame_source, which yields (frame, args) in output order, and copies
+                  each frame into a free slot.  Every frame must have the shape and dtype of the first one
+      workers   : num_procs processes (default one per core) run work_fn(frame, args) on the slot.  work_fn must
+                  pickle (a module level function, or a functools.partial of one).  A returned array is the new
+                  frame (drawn in place, or copied back into the slot), anything else is the result
+      collector : a thread calls result_fn(frame, args, result) in the original order, frame is the slot itself
+                  and is only valid during the call, then the slot is reused
+    Only slot numbers, args and results are pickled, the pixels stay in shared memory.  At most num_slots
+    (default 2 * num_procs + 2) frames are in flight, so memory stays bounded.
+    Errors in work_fn are raised once the frames are done (the frame is still passed on, like run_frame_pipeline).
+    returns : number of frames passed to result_fn
+    '''
+    if(num_procs == None) :
+        num_procs = os.cpu_count() or 1
+    if(num_slots == None) :
+        num_slots = 2 * num_procs + 2
+
+    source = iter(frame_source)
+    first = next(source, None)
+    if(first == None) :
+        return 0
+    (shape, dtype) = (first[0].shape, first[0].dtype)
+
+    ctx = multiprocessing.get_context("spawn")
+    ring = FrameRing(num_slots, shape, dtype)
+    tasks = ctx.Queue()
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_ring_worker, args=(ring, work_fn, tasks, results), daemon=True) for i in range(num_procs)]
+    try :
+        for w in workers :
+            w.start()
+    except Exception :
+        # e.g. a work_fn that does not pickle
+        for w in workers :
+            if(w.is_alive()) :
+                w.terminate()
+        ring.close()
+        ring.unlink()
+        raise
+
+    free = Queue()
+    for slot in range(num_slots) :
+        free.put(slot)
+    pending_args = {}
+    total = [None]
+    count = [0]
+    errors = []
+    stop = Event()
+
+    def collector() :
+        buffered = {}
+        next_seq = 0
+        while(total[0] == None or next_seq < total[0]) :
+            try :
+                item = results.get(timeout=0.5)
+            except Empty :
+                dead = [w.exitcode for w in workers if w.exitcode not in [None, 0]]
+                if(len(dead) > 0) :
+                    errors.append(RuntimeError("run_process_pipeline : worker process exited with {}".format(dead[0])))
+                    break
+                continue
+            buffered[item[0]] = item[1:]
+            # reorder : pass on every frame that is next in line
+            while(next_seq in buffered) :
+                (slot, rv, err) = buffered.pop(next_seq)
+                if(err != None) :
+                    errors.append(RuntimeError("run_process_pipeline : frame {} : {}".format(next_seq, err)))
+                try :
+                    result_fn(ring[slot], pending_args.pop(next_seq), rv)
+                except Exception as e :
+                    errors.append(e)
+                free.put(slot)
+                next_seq += 1
+        count[0] = next_seq
+        stop.set()
+
+    collect = Thread(target=collector)
+    collect.start()
+
+    seq = 0
+    try :
+        for (frame, args) in chain([first], source) :
+            if(frame.shape != shape or frame.dtype != dtype) :
+                raise ValueError("run_process_pipeline : frame {} is {} {}, the ring holds {} {}".format(seq, frame.shape, frame.dtype, shape, dtype))
+            slot = None
+            while(slot == None and not stop.is_set()) :
+                try :
+                    slot = free.get(timeout=0.5)
+                except Empty :
+                    pass
+            if(slot == None) :
+                break
+            np.copyto(ring[slot], frame)
+            pending_args[seq] = args
+            tasks.put((seq, slot, args))
+            seq += 1
+    except Exception as e :
+        errors.append(e)
+    total[0] = seq
+    for w in workers :
+        tasks.put(None)
+    collect.join()
+
+    for w in workers :
+        w.join(timeout=5)
+        if(w.is_alive()) :
+            w.terminate()
+    ring.close()
+    ring.unlink()
+
+    if(len(errors) > 0) :
+        raise errors[0]
+    nprint("Process pipeline : {} frames through {} slots of {} in {} processes".format(count[0], num_slots, shape, num_procs))
+    return count[0]
@@ -0,0 +1,121 @@
+# ivi_sidecar.py
+
+# Time coded detection sidecars, written straight from the results cache (ivi_cache) and the source fps,
+# for players and dashboards that draw the boxes themselves.  No frame is decoded or encoded.
+#   <prefix>.boxes.json     : every scored frame with its boxes (and track ids)
+#   <prefix>.boxes.vtt      : WebVTT metadata track, one cue per scored frame with boxes, JSON cue payload
+#   <prefix>.intervals.json : per label on screen intervals and screen time
+# Result k of the cache is frame (k+1)*sample_rate and stands for the sample_rate frames from there.
+import json
+import numpy as np
+from ivi_cache import open_results_cache
+from ivi_common import nprint
+from ivi_tracking import IouTracker
+
+
+def _slot_boxes(results, sample_rate, track=True) :
+    '''
+    Every box of the cache in slot order, with track ids
+    returns : (BoxArray, starts, counts) where result k is boxes[starts[k] : starts[k]+counts[k]]
+    '''
+    (boxes, offsets, counts) = results.all_boxes()
+    starts = np.cumsum(counts) - counts
+    # results are stored in arrival order, gather them back in slot order
+    boxes = boxes[np.repeat(offsets - starts, counts) + np.arange(int(counts.sum()))]
+    if(track) :
+        # same tracker settings as the tracking counter modes of edit_video_objdet
+        tracker = IouTracker(max_age=2*sample_rate, frame_step=sample_rate)
+        labels = boxes.labels.tolist()
+        for k in range(len(counts)) :
+            (start, stop) = (starts[k], starts[k] + counts[k])
+            boxes.track_ids[start:stop] = tracker.update((k+1)*sample_rate, boxes.coords[start:stop], labels[start:stop])
+    return (boxes, starts, counts)
+
+
+def _box_dicts(boxes, start, stop) :
+    rv = []
+    for i in range(start, stop) :
+        box = {'label' : boxes.labels[i], 'xmin' : float(boxes.coords[i, 0]), 'ymin' : float(boxes.coords[i, 1]),
+               'xmax' : float(boxes.coords[i, 2]), 'ymax' : float(boxes.coords[i, 3]), 'confidence' : round(float(boxes.confidence[i]), 4)}
+        if(boxes.track_ids[i] >= 0) :
+            box['track_id'] = int(boxes.track_ids[i])
+        rv.append(box)
+    return rv
+
+
+def _vtt_time(secs) :
+    ms = int(round(secs * 1000))
+    return "{:02d}:{:02d}:{:02d}.{:03d}".format(ms // 3600000, (ms // 60000) % 60, (ms // 1000) % 60, ms % 1000)
+
+
+def label_intervals(boxes, starts, counts, sample_rate, fps, total_frames=None) :
+    '''
+    On screen intervals of each label, from the boxes of _slot_boxes
+    A label is on screen for the sample_rate frames of every result that has one of its boxes.
+    returns : dict label -> {'intervals' : [[start_s, end_s], ...], 'screen_time' : seconds on screen,
+                             'box_seconds' : seconds summed over boxes, like the screen_time counter of edit_video_objdet}
+    '''
+    num_slots = len(counts)
+    (label_names, codes) = np.unique(boxes.labels.astype(str), return_inverse=True)
+    slots = np.repeat(np.arange(num_slots), counts)
+    present = np.zeros((len(label_names), num_slots + 2), dtype=bool)
+    present[codes, slots + 1] = True
+    box_counts = np.zeros(len(label_names), dtype=np.int64)
+    np.add.at(box_counts, codes, 1)
+
+    end_frame = (num_slots + 1) * sample_rate if total_frames == None else total_frames
+    rv = {}
+    for (l, label) in enumerate(label_names.tolist()) :
+        # runs of consecutive results with the label
+        edges = np.diff(present[l].astype(np.int8))
+        run_start = np.nonzero(edges == 1)[0]
+        run_stop = np.nonzero(edges == -1)[0]
+        start_frames = (run_start + 1) * sample_rate
+        stop_frames = np.minimum((run_stop + 1) * sample_rate, end_frame)
+        rv[label] = {'intervals' : [[round(a / fps, 3), round(b / fps, 3)] for (a, b) in zip(start_frames.tolist(), stop_frames.tolist())],
+                     'screen_time' : round(float((stop_frames - start_frames).sum()) / fps, 3),
+                     'box_seconds' : round(float(box_counts[l] * sample_rate) / fps, 3)}
+    return rv
+
+
+def write_sidecars(cache_file, output_prefix, sample_rate, fps, total_frames=None, track=True, source=None, postprocess=None) :
+    '''
+    Write the detection sidecars for a scored video
+    cache_file    : results cache prefix (or an older cache.json)
+    output_prefix : the files are <output_prefix>.boxes.json, .boxes.vtt and .intervals.json
+    sample_rate   : sample rate the video was scored at
+    fps           : frame rate of the source video
+    total_frames  : frame count of the source, clips the last interval
+    track         : run the IoU tracker so boxes carry track ids
+    source        : source video name recorded in the files
+    postprocess   : optional ivi_boxes.PostProcessor applied to the cached boxes
+    returns : list of files written
+    '''
+    results = open_results_cache(cache_file, postprocess)
+    (boxes, starts, counts) = _slot_boxes(results, sample_rate, track)
+    end_frame = (len(counts) + 1) * sample_rate if total_frames == None else total_frames
+    header = {'source' : source, 'fps' : fps, 'sample_rate' : sample_rate, 'frame_count' : end_frame}
+
+    frames = []
+    f = open(output_prefix + ".boxes.vtt", 'w')
+    f.write("WEBVTT - object detections, one JSON cue per scored frame\n\n")
+    for k in range(len(counts)) :
+        frame_idx = (k+1) * sample_rate
+        box_list = _box_dicts(boxes, starts[k], starts[k] + counts[k])
+        frames.append({'frame' : frame_idx, 'time' : round(frame_idx / fps, 3), 'status' : results.status(k), 'boxes' : box_list})
+        if(len(box_list) > 0) :
+            f.write("{}\n{} --> {}\n{}\n\n".format(frame_idx, _vtt_time(frame_idx / fps), _vtt_time(min(frame_idx + sample_rate, end_frame) / fps),
+                                                  json.dumps({'frame' : frame_idx, 'boxes' : box_list})))
+    f.close()
+
+    f = open(output_prefix + ".boxes.json", 'w')
+    f.write(json.dumps(dict(header, frames=frames)))
+    f.close()
+
+    f = open(output_prefix + ".intervals.json", 'w')
+    f.write(json.dumps(dict(header, labels=label_intervals(boxes, starts, counts, sample_rate, fps, total_frames))))
+    f.close()
+
+    rv = [output_prefix + ext for ext in [".boxes.json", ".boxes.vtt", ".intervals.json"]]
+    nprint("Wrote {} results ({} boxes) to {}".format(len(counts), len(boxes), ", ".join(rv)))
+    return rv
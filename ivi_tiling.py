@@ -0,0 +1,92 @@
+# ivi_tiling.py
+
+# Tiled inference for high resolution images (4K video, drone imagery) : the server downsamples a full
+# frame to the model input size, so small objects get lost.  TiledScorer splits the image into overlapping
+# tiles, scores them concurrently, shifts the boxes back to image coordinates and merges the duplicates
+# found in the overlaps with class wise NMS.  Tiles are scored in parallel, so the latency of an image stays
+# close to that of one tile request.
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from ivi_boxes import BoxArray, PostProcessor
+from ivi_common import nprint
+from ivi_scoring import get_json_from_paiv
+
+
+def tile_grid(width, height, tile_size=(1024,1024), overlap=0.2) :
+    '''
+    Overlapping tiles covering a width x height image, the last row / column is aligned to the image edge
+    tile_size : (width, height) of the tiles
+    overlap   : fraction of a tile shared with its neighbour
+    returns : list of (xmin, ymin, xmax, ymax)
+    '''
+    def starts(length, tile) :
+        if(length <= tile) :
+            return [0]
+        stride = max(int(tile * (1.0 - overlap)), 1)
+        rv = list(range(0, length - tile, stride))
+        return rv + [length - tile]
+    (tw, th) = tile_size
+    return [(x, y, min(x + tw, width), min(y + th, height)) for y in starts(height, th) for x in starts(width, tw)]
+
+
+class TiledScorer():
+    '''
+    Scores an image as overlapping tiles for one model
+    model_url     : deployed model endpoint
+    tile_size     : (width, height) of the tiles, ideally close to the model input size
+    overlap       : fraction of a tile shared with its neighbour, at least the size of the objects relative to a tile
+    num_threads   : concurrent tile requests, shared by all the images being scored
+    iou_threshold : overlap above which boxes of the same label from different tiles are merged
+    merge_metric  : "ios" (intersection over the smaller box, also merges an object cut by a tile edge
+                    with the full box from the next tile) or "iou"
+    full_frame    : also score the whole (downsampled) frame, for objects larger than a tile
+    '''
+    def __init__(self, model_url, tile_size=(1024,1024), overlap=0.2, num_threads=8, iou_threshold=0.5, merge_metric="ios", full_frame=False):
+        self.model_url = model_url
+        self.tile_size = tuple(tile_size)
+        self.overlap = overlap
+        self.full_frame = full_frame
+        self.merge = PostProcessor(iou_threshold=iou_threshold, class_wise=True, metric=merge_metric)
+        self.pool = ThreadPoolExecutor(max_workers=num_threads)
+
+    def close(self) :
+        # stop the tile request threads, the scorer can not be used after this
+        self.pool.shutdown()
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *exc_info) :
+        self.close()
+
+    def score(self, img, temporary_fn="tile.jpg", thr_id=0) :
+        '''
+        Score one image
+        returns : json response in the api layout, boxes in image coordinates
+        '''
+        (h, w) = img.shape[:2]
+        tiles = tile_grid(w, h, self.tile_size, self.overlap)
+        if(self.full_frame and len(tiles) > 1) :
+            tiles = tiles + [(0, 0, w, h)]
+        futures = [self.pool.submit(get_json_from_paiv, self.model_url, img[y0:y1, x0:x1], "{}_{}".format(i, temporary_fn), thr_id)
+                   for (i, (x0, y0, x1, y1)) in enumerate(tiles)]
+
+        boxes = BoxArray()
+        ok = 0
+        for ((x0, y0, x1, y1), f) in zip(tiles, futures) :
+            json_rv = f.result()
+            if(json_rv == None or 'classified' not in json_rv) :
+                continue
+            ok += 1
+            tile_boxes = BoxArray.from_json(json_rv)
+            tile_boxes.coords += np.array([x0, y0, x0, y0])
+            boxes = boxes.concatenate(tile_boxes)
+        if(ok == 0) :
+            return {'result' : 'fail'}
+        if(ok < len(tiles)) :
+            nprint("Warning : {} of {} tiles failed for {}".format(len(tiles) - ok, len(tiles), temporary_fn))
+
+        boxes = self.merge(boxes)
+        classified = [{'label' : l, 'xmin' : int(c[0]), 'ymin' : int(c[1]), 'xmax' : int(c[2]), 'ymax' : int(c[3]), 'confidence' : conf}
+                      for (l, c, conf) in zip(boxes.labels.tolist(), boxes.coords.tolist(), boxes.confidence.tolist())]
+        return {'classified' : classified, 'result' : 'success', 'tiles' : len(tiles)}
@@ -0,0 +1,212 @@
+# ivi_tracking.py
+
+# Lightweight multi-object tracker (SORT style, without the Kalman filter) for per frame detections.
+# Tracks are associated to detections by IoU of the track's constant velocity prediction, everything is
+# kept in numpy arrays so it can run over the cached results of a whole video without touching the video.
+import numpy as np
+from ivi_boxes import BoxArray, iou_matrix
+from ivi_cache import open_results_cache
+
+# draw_counter_box modes that need the tracker
+TRACKER_COUNTER_MODES = ["unique", "dwell", "visible"]
+
+
+def greedy_match(score, threshold) :
+    '''
+    Greedy one to one assignment, highest score first, only pairs with score >= threshold
+    score : (N,M) array
+    returns : (rows, cols) index arrays of the matched pairs
+    '''
+    (rows, cols) = np.nonzero(score >= threshold)
+    # usual case, no track or detection has more than one candidate
+    if(len(rows) <= 1 or (np.all(rows[1:] != rows[:-1]) and len(np.unique(cols)) == len(cols))) :
+        return (rows, cols)
+    order = np.argsort(-score[rows, cols], kind='stable')
+    rows = rows[order]
+    cols = cols[order]
+
+    used_r = np.zeros(score.shape[0], dtype=bool)
+    used_c = np.zeros(score.shape[1], dtype=bool)
+    keep = np.zeros(len(rows), dtype=bool)
+    for k in range(len(rows)) :
+        if(not used_r[rows[k]] and not used_c[cols[k]]) :
+            used_r[rows[k]] = True
+            used_c[cols[k]] = True
+            keep[k] = True
+    return (rows[keep], cols[keep])
+
+
+class IouTracker():
+    '''
+    Multi object tracker over per frame detections
+    iou_threshold : min IoU between a track's predicted box and a detection of the same label
+    max_age       : frames a track survives without a detection
+    min_hits      : detections needed before a track is counted (filters one frame false positives)
+    frame_step    : nominal frames between updates (the sample rate), used as the dwell time of a single detection
+    Call update (or update_boxes) once per scored frame, in frame order.
+    '''
+    def __init__(self, iou_threshold=0.3, max_age=30, min_hits=1, frame_step=1):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.frame_step = frame_step
+
+        self.label_codes = {}
+        self.labels = []
+        self.next_id = 0
+
+        # live tracks, one row each
+        self.boxes = np.zeros((0, 4))
+        self.vel = np.zeros((0, 4))
+        self.label = np.zeros(0, dtype=np.int64)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.last = np.zeros(0, dtype=np.int64)
+        self.hits = np.zeros(0, dtype=np.int64)
+        self.dwell = np.zeros(0, dtype=np.int64)
+
+        # per label totals of the tracks that have ended
+        self.done_unique = np.zeros(0, dtype=np.int64)
+        self.done_dwell = np.zeros(0, dtype=np.int64)
+        self.frame_idx = None
+
+    def _label_code(self, label) :
+        if(label not in self.label_codes) :
+            self.label_codes[label] = len(self.labels)
+            self.labels.append(label)
+            self.done_unique = np.append(self.done_unique, 0)
+            self.done_dwell = np.append(self.done_dwell, 0)
+        return self.label_codes[label]
+
+    def _keep(self, mask) :
+        self.boxes = self.boxes[mask]
+        self.vel = self.vel[mask]
+        self.label = self.label[mask]
+        self.ids = self.ids[mask]
+        self.last = self.last[mask]
+        self.hits = self.hits[mask]
+        self.dwell = self.dwell[mask]
+
+    def update(self, frame_idx, boxes, labels) :
+        '''
+        Add one frame of detections
+        frame_idx : frame number (non decreasing)
+        boxes     : (N,4) array of xmin,ymin,xmax,ymax
+        labels    : list of N labels
+        returns : (N,) array of track ids for the detections
+        '''
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        codes = np.array([self._label_code(l) for l in labels], dtype=np.int64)
+        self.frame_idx = frame_idx
+
+        # retire tracks that have not been seen for too long
+        gap = frame_idx - self.last
+        expired = gap > self.max_age
+        if(expired.any()) :
+            counted = expired & (self.hits >= self.min_hits)
+            nl = len(self.labels)
+            self.done_unique += np.bincount(self.label[counted], minlength=nl)
+            self.done_dwell += np.bincount(self.label[counted], weights=self.dwell[counted], minlength=nl).astype(np.int64)
+            self._keep(~expired)
+            gap = gap[~expired]
+
+        # associate detections with the constant velocity prediction of each track
+        if(len(gap) > 0 and len(boxes) > 0) :
+            pred = self.boxes + self.vel * gap[:, None]
+            score = iou_matrix(pred, boxes)
+            score[self.label[:, None] != codes[None, :]] = 0.0
+            (rows, cols) = greedy_match(score, self.iou_threshold)
+        else :
+            rows = cols = np.zeros(0, dtype=np.int64)
+
+        det_ids = np.empty(len(boxes), dtype=np.int64)
+        if(len(rows) > 0) :
+            step = np.maximum(gap[rows], 1)[:, None]
+            self.vel[rows] = 0.5 * self.vel[rows] + 0.5 * (boxes[cols] - self.boxes[rows]) / step
+            self.boxes[rows] = boxes[cols]
+            self.dwell[rows] += frame_idx - self.last[rows]
+            self.last[rows] = frame_idx
+            self.hits[rows] += 1
+            det_ids[cols] = self.ids[rows]
+
+        # every unmatched detection starts a new track
+        new = np.ones(len(boxes), dtype=bool)
+        new[cols] = False
+        n_new = int(new.sum())
+        if(n_new > 0) :
+            new_ids = np.arange(self.next_id, self.next_id + n_new)
+            self.next_id += n_new
+            self.boxes = np.concatenate([self.boxes, boxes[new]])
+            self.vel = np.concatenate([self.vel, np.zeros((n_new, 4))])
+            self.label = np.concatenate([self.label, codes[new]])
+            self.ids = np.concatenate([self.ids, new_ids])
+            self.last = np.concatenate([self.last, np.full(n_new, frame_idx, dtype=np.int64)])
+            self.hits = np.concatenate([self.hits, np.ones(n_new, dtype=np.int64)])
+            self.dwell = np.concatenate([self.dwell, np.full(n_new, self.frame_step, dtype=np.int64)])
+            det_ids[new] = new_ids
+
+        return det_ids
+
+    def update_boxes(self, frame_idx, boxes) :
+        # update with a BoxArray (or a list of Box)
+        boxes = BoxArray.from_boxes(boxes)
+        return self.update(frame_idx, boxes.coords, boxes.labels)
+
+    def counters(self, counter_mode="unique") :
+        '''
+        Per label counters for draw_counter_box
+        counter_mode : "unique"  : distinct objects seen so far
+                       "dwell"   : total frames objects of the label have been on screen (divide by fps for seconds)
+                       "visible" : objects seen in the latest frame
+        returns : dict label -> value (labels with a zero value are left out)
+        '''
+        nl = len(self.labels)
+        confirmed = self.hits >= self.min_hits
+        if(counter_mode == "unique") :
+            values = self.done_unique + np.bincount(self.label[confirmed], minlength=nl)
+        elif(counter_mode == "dwell") :
+            values = self.done_dwell + np.bincount(self.label[confirmed], weights=self.dwell[confirmed], minlength=nl).astype(np.int64)
+        elif(counter_mode == "visible") :
+            visible = confirmed & (self.last == self.frame_idx)
+            values = np.bincount(self.label[visible], minlength=nl)
+        else :
+            raise ValueError("unknown counter_mode {}".format(counter_mode))
+        return {self.labels[i] : int(values[i]) for i in range(nl) if values[i] > 0}
+
+
+def track_results(results_list, frame_indices, **tracker_args) :
+    '''
+    Run the tracker over a list of per frame api results
+    without decoding the video.
+    results_list  : list of api json results
+    frame_indices : frame number of each result
+    returns : (tracker, list of track id arrays per result)
+    '''
+    tracker = IouTracker(**tracker_args)
+    ids_list = []
+    for (json_rv, frame_idx) in zip(results_list, frame_indices) :
+        dets = []
+        if(json_rv != None and 'classified' in json_rv) :
+            dets = json_rv['classified']
+        coords = [(d['xmin'], d['ymin'], d['xmax'], d['ymax']) for d in dets]
+        ids_list.append(tracker.update(frame_idx, coords, [d['label'] for d in dets]))
+    return (tracker, ids_list)
+
+
+def track_cache_file(cache_file, sample_rate, **tracker_args) :
+    '''
+    Run the tracker over the results cache written by edit_video_objdet (<output_directory>/cache, or an
+    older cache.json which gets migrated), result k is frame (k+1)*sample_rate
+    returns : dict counter_mode -> counters at the end of the video, and the tracker
+    '''
+    results = open_results_cache(cache_file)
+    # same defaults as edit_video_objdet, tracks survive one missed sample
+    tracker_args.setdefault('frame_step', sample_rate)
+    tracker_args.setdefault('max_age', 2*sample_rate)
+    tracker = IouTracker(**tracker_args)
+    (boxes, offsets, counts) = results.all_boxes()
+    labels = boxes.labels.tolist()
+    for k in range(len(results)) :
+        (start, stop) = (offsets[k], offsets[k] + counts[k])
+        tracker.update((k+1)*sample_rate, boxes.coords[start:stop], labels[start:stop])
+    rv = {mode : tracker.counters(mode) for mode in ["unique", "dwell"]}
+    return (rv, tracker)
@@ -0,0 +1,242 @@
+# ivi_validate.py
+
+# Validate a model against an exported golden dataset using scores from ivi_scoring.fetch_scores
+import json
+import time
+import numpy as np
+import bootstrap_utils as bu
+import sklearn_utils as su
+from ivi_common import nprint, _load_paiv_dataset, _list_paiv_dataset
+
+
+def validate_model(paiv_results_file,  image_dir,  validate_mode, num_resamples=1000, ci=0.95, num_procs=1, plot_fn=None, postprocess=None) :
+    '''
+    Validate model : 
+        prerequisites : 
+        1.  first need to run paiv.fetch_scores to build a paiv_results_file.  This file contains
+        all the scored results from hitting a PAIV model with images/video from a directory
+        2.  need to specify the image directory where the source images exist
+        
+        3.  validate_mode is based on either doing object detection or classification validation ['object'|'classification']
+
+        4.  num_resamples / ci / num_procs control the bootstrap confidence intervals reported
+        for precision, recall, accuracy and mAP.  num_resamples=0 skips the bootstrap
+
+        5.  plot_fn : optional image file to save the confusion matrix plot to (rendered headless).
+        No plot is made by default
+
+        6.  postprocess : optional ivi_boxes.PostProcessor (confidence thresholds, NMS, top k) applied to the
+        predicted boxes before matching (object mode), same clean up as the video path
+
+    returns : dict of bootstrap results from bootstrap_utils.bootstrap_metrics (None if skipped)
+    '''
+    from sklearn.metrics import confusion_matrix
+    model_predictions_json = open(paiv_results_file).read()
+    model_predictions = json.loads(model_predictions_json)
+
+    #test exists
+    nprint("Loading Dataset to get ground truth labels")
+    ground_truth = _load_paiv_dataset(image_dir, validate_mode)
+
+    #  Truth table
+    # use sklearn metrics confusion_matrix.  need to build a long list of y_true, y_pred
+    tt_label = {}
+    ytrue_cum = []
+    ypred_cum = []
+    image_matches = []
+    for mykey in model_predictions.keys() :
+        # Each prediction could have a list of boxes ..
+        print("model prediction : {}".format(model_predictions[mykey]))
+        print("ground_truth     : {}".format(ground_truth[mykey]))
+        (ytrue, ypred, detections) = _match_image(ground_truth[mykey], model_predictions[mykey], validate_mode, postprocess)
+        ytrue_cum = ytrue_cum + ytrue
+        ypred_cum = ypred_cum + ypred
+        image_matches.append({'ytrue' : ytrue, 'ypred' : ypred, 'detections' : detections})
+    # Function to automatically fetch data from API in threaded mode...
+    # modes = video / image_dir
+    classes = list(set(ytrue_cum+ypred_cum))
+    cm = confusion_matrix(ytrue_cum, ypred_cum, labels=classes)
+    if(plot_fn != None) :
+        su.plot_confusion_matrix(cm, classes, title='confusion matrix',normalize=False, output_fn=plot_fn)
+        nprint("Saved confusion matrix plot to {}".format(plot_fn))
+    print(cm)
+    diag_sum = 0
+    total_sum = np.sum(cm)
+    for i in range(len(classes)) :
+        tp = float(cm[i,i])
+        diag_sum += tp
+        tpfp = float(np.sum(cm[:,i]))
+        tpfn = float(np.sum(cm[i,:]))
+        fn = tpfn - tp
+        fp = tpfp - tp
+        if(tpfp != 0) :
+            precision = tp / tpfp
+        else :
+            precision = 0.0
+
+        if(tpfn != 0) :
+            recall    = tp / tpfn
+        else :
+            recall = 0.0
+
+        #nprint("class  = {} TP = {}  TP+FP ={}  TP+FN = {} ".format(classes[i], cm[i,i],np.sum(cm[:,i]),np.sum(cm[i,:])))
+        nprint("class = {} : tp = {} : fp = {} : fn = {} : Precision = {:0.2f}  Recall = {:0.2f}".format(classes[i],tp,fp, fn,precision,recall))
+    nprint("Overall Accuracy = {:0.2f}".format(diag_sum/total_sum))
+
+    if(num_resamples <= 0) :
+        return None
+
+    # Bootstrap over images to get a sense of the variance of the numbers above
+    table = bu.build_match_table(image_matches)
+    start = time.time()
+    bs = bu.bootstrap_metrics(table, num_resamples=num_resamples, ci=ci, num_procs=num_procs)
+    nprint("Bootstrap : {} resamples of {} images in {:0.2f} (s), {:0.0f}% confidence intervals".format(num_resamples, table.num_images(), time.time()-start, 100*ci))
+    for (i, c) in enumerate(table.classes) :
+        nprint("class = {} : Precision = {:0.2f} [{:0.2f}, {:0.2f}]  Recall = {:0.2f} [{:0.2f}, {:0.2f}]  AP = {:0.2f} [{:0.2f}, {:0.2f}]".format(c,
+            bs['precision']['estimate'][i], bs['precision']['low'][i], bs['precision']['high'][i],
+            bs['recall']['estimate'][i], bs['recall']['low'][i], bs['recall']['high'][i],
+            bs['ap']['estimate'][i], bs['ap']['low'][i], bs['ap']['high'][i]))
+    nprint("Overall Accuracy = {:0.2f} [{:0.2f}, {:0.2f}]".format(bs['accuracy']['estimate'], bs['accuracy']['low'], bs['accuracy']['high']))
+    nprint("mAP = {:0.2f} [{:0.2f}, {:0.2f}]".format(bs['map']['estimate'], bs['map']['low'], bs['map']['high']))
+    bs['classes'] = table.classes
+
+    return bs
+
+
+def _match_image(ground_truth, model_prediction, validate_mode, postprocess=None) :
+    # Match one image's predictions against its ground truth
+    # returns (ytrue, ypred, detections) where detections is a list of (label, confidence)
+    if(validate_mode == 'object') :
+        if(postprocess != None) :
+            model_prediction = postprocess.apply_json(model_prediction)
+        (ytrue, ypred) = return_ytrue_ypre_objdet(ground_truth['boxes'], model_prediction['classified'])
+        detections = [(p['label'], p['confidence']) for p in model_prediction['classified']]
+    elif(validate_mode == 'classification') :
+        (ytrue, ypred) = return_ytrue_ypre_classification(ground_truth, model_prediction['classified'])
+        detections = list(model_prediction['classified'].items())[:1]
+    else :
+        nprint("Error : invalid validate_mode passed")
+    return (ytrue, ypred, detections)
+
+
+def compare_models(paiv_results_file, image_dir, validate_mode, report_fn="compare_report.json", postprocess=None) :
+    '''
+    Compare models scored side by side with ivi_scoring.fetch_scores_multi
+    paiv_results_file : output of fetch_scores_multi
+    image_dir         : exported dataset with the ground truth
+    validate_mode     : ['object'|'classification']
+    report_fn         : json report with per model metrics, per class deltas vs the first model
+                        and the list of images where the models disagree
+    postprocess       : optional ivi_boxes.PostProcessor applied to every model's boxes (object mode)
+    returns : the report dict
+    '''
+    scores = json.loads(open(paiv_results_file).read())
+    models = scores['models']
+    results = scores['results']
+
+    # Ground truth by image id, no need to decode the images again
+    ground_truth = {meta['id'] : meta for (image_fn, meta) in _list_paiv_dataset(image_dir, validate_mode)}
+
+    image_matches = [[] for m in models]
+    disagree = []
+    for (mykey, entry) in results.items() :
+        if(entry['id'] not in ground_truth) :
+            nprint("Warning : no ground truth for image {}, skipping".format(entry['id']))
+            continue
+        if(any(s == None or 'classified' not in s for s in entry['scores'])) :
+            nprint("Warning : missing scores for image {}, skipping".format(entry['id']))
+            continue
+
+        labels = []
+        for (midx, model_prediction) in enumerate(entry['scores']) :
+            (ytrue, ypred, detections) = _match_image(ground_truth[entry['id']], model_prediction, validate_mode, postprocess)
+            image_matches[midx].append({'ytrue' : ytrue, 'ypred' : ypred, 'detections' : detections})
+            labels.append(sorted([d[0] for d in detections]))
+        if(any(l != labels[0] for l in labels)) :
+            disagree.append({'id' : entry['id'], 'hash' : mykey, 'labels' : labels})
+
+    # Same class list for every model so the metrics line up
+    classes = bu.match_classes([m for matches in image_matches for m in matches])
+    metrics = [bu.point_metrics(bu.build_match_table(matches, classes=classes)) for matches in image_matches]
+
+    report = {'models' : models, 'classes' : classes, 'num_images' : len(image_matches[0]), 'models_metrics' : [], 'disagreements' : disagree}
+    for (midx, m) in enumerate(metrics) :
+        model_report = {'url' : models[midx], 'accuracy' : float(m['accuracy']), 'map' : float(m['map']), 'classes' : {}}
+        for (i, c) in enumerate(classes) :
+            class_report = {}
+            for k in ['precision', 'recall', 'ap'] :
+                class_report[k] = float(m[k][i])
+                class_report[k + '_delta'] = float(m[k][i] - metrics[0][k][i])
+            model_report['classes'][c] = class_report
+        model_report['accuracy_delta'] = float(m['accuracy'] - metrics[0]['accuracy'])
+        model_report['map_delta'] = float(m['map'] - metrics[0]['map'])
+        report['models_metrics'].append(model_report)
+
+    for (midx, model_report) in enumerate(report['models_metrics']) :
+        nprint("model {} : {}".format(midx, model_report['url']))
+        for c in classes :
+            cr = model_report['classes'][c]
+            nprint("  class = {} : Precision = {:0.2f} ({:+0.2f})  Recall = {:0.2f} ({:+0.2f})  AP = {:0.2f} ({:+0.2f})".format(c,
+                cr['precision'], cr['precision_delta'], cr['recall'], cr['recall_delta'], cr['ap'], cr['ap_delta']))
+        nprint("  Overall Accuracy = {:0.2f} ({:+0.2f})  mAP = {:0.2f} ({:+0.2f})".format(model_report['accuracy'], model_report['accuracy_delta'],
+            model_report['map'], model_report['map_delta']))
+    nprint("Models disagree on {} of {} images".format(len(disagree), report['num_images']))
+
+    nprint("Writing comparison report to {}".format(report_fn))
+    f = open(report_fn, 'w')
+    f.write(json.dumps(report, indent=2))
+    f.close()
+
+    return report
+
+
+def return_ytrue_ypre_classification(ground_truth, model_predictions) :
+    # Examples of whats passed
+    #model prediction : {'classified': {'No Nest': '0.95683'}, 'result': 'success', 'imageMd5': '0acfd6f5b3368d380a67ca9c8d309acd', 'imageUrl': 'http://powerai-vision-portal:9080/powerai-vision-api/uploads/temp/8f80467f-470c-47f3-bf3c-ab7e0880a66b/18c20462-c693-4735-875a-64a30d9974d4.jpg', 'webAPIId': '8f80467f-470c-47f3-bf3c-ab7e0880a66b'}
+    #ground_truth     : {'class': 'No Nest', 'id': 'ffbc9c99-201a-4b1a-bce1-a1a1c3ecdc92'}
+
+    # To be compatible with object detection, need to return a list of one item ...
+    ytrue = []
+    ytrue.append((ground_truth['class']))
+    ypred = []
+    ypred.append(list(model_predictions.keys())[0])
+    return (ytrue, ypred)
+
+
+def return_ytrue_ypre_objdet(ground_truth, model_predictions) :
+    # 1. build a sorted list of labels
+    a = ground_truth
+    ytrue_labels = [a["label"] for a in ground_truth]
+    ypred_labels = [a["label"] for a in model_predictions]
+
+    ytrue_labels = sorted(ytrue_labels)
+    ypred_labels = sorted(ypred_labels)
+    # 2. smart zipper labels
+
+    ip = 0
+    it = 0
+    ytrue = []
+    ypred = []
+    # yaesh
+    while( not( it >= len(ytrue_labels) and ip >= len(ypred_labels))) :
+
+        ytl =  "zzzzzzzzz_null" if it >= len(ytrue_labels) else  ytrue_labels[it]
+        ypl =  "zzzzzzzzz_null" if ip >= len(ypred_labels) else  ypred_labels[ip]
+
+        if(ytl == ypl) :
+            ytrue.append(ytl)
+            ypred.append(ypl)
+            it += 1
+            ip += 1
+        elif(ytl != ypl and ytl <= ypl) :
+            ytrue.append(ytl)
+            ypred.append("null")
+            it += 1
+        elif(ytl != ypl and ypl < ytl) :
+            ytrue.append("null")
+            ypred.append(ypl)
+            ip += 1
+
+    print("ytrue = {}".format(ytrue))
+    print("ypred = {}".format(ypred))
+    return (ytrue, ypred)
@@ -0,0 +1,1278 @@
+# ivi_video.py
+
+# Video splitting, annotation and drawing functions
+import copy
+import csv
+import cv2
+import numpy as np
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import time
+import urllib3
+from collections import defaultdict
+from collections import deque
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from queue import Empty, Queue
+from threading import Condition, Semaphore, Thread
+from ivi_autotune import tuned_setting
+from ivi_boxes import BoxArray
+from ivi_cache import ResultsCache, ResultsCacheWriter, results_cache_exists, migrate_json_cache, STATUS_SKIPPED
+from ivi_common import nprint, Box, generate_colors
+from ivi_scoring import fetch_scores, get_json_from_paiv
+from ivi_tracking import IouTracker, TRACKER_COUNTER_MODES, greedy_match
+from ivi_writer import open_video_writer
+from ivi_reader import open_video_reader
+from ivi_sidecar import write_sidecars
+from ivi_render import blend_rect, draw_text, label_color, thumbnail
+
+
+############################################################################################################
+# Video Funcs
+############################################################################################################
+def split_video(input_video, output_directory, max_frames=4, force_refresh=True, sample_rate=1, reader="cv2", reader_args=None) :
+    # Write every sample_rate'th frame (up to max_frames) as <video name>_<frame>_.png, see extract_frames
+    return extract_frames(input_video, output_directory, sample_rate=sample_rate, max_frames=max_frames, image_format="png",
+                          reader=reader, reader_args=reader_args)
+
+
+# imwrite quality flag per image format
+IMAGE_QUALITY_FLAGS = {'jpg' : cv2.IMWRITE_JPEG_QUALITY, 'png' : cv2.IMWRITE_PNG_COMPRESSION, 'webp' : cv2.IMWRITE_WEBP_QUALITY}
+
+
+def sampled_frame_indices(total_frames, fps, sample_rate=1, start_frame=0, end_frame=None, start_time=None, end_time=None,
+                          every_secs=None, max_frames=None) :
+    '''
+    Frame numbers picked by extract_frames, in increasing order
+    start_frame, end_frame : frame range [start_frame, end_frame)
+    start_time, end_time   : same in seconds, used instead of the frame range when given
+    sample_rate            : every sample_rate'th frame of the range
+    every_secs             : one frame every every_secs seconds instead of sample_rate
+    max_frames             : at most this many frames
+    '''
+    if(start_time != None) :
+        start_frame = int(round(start_time * fps))
+    if(end_time != None) :
+        end_frame = int(round(end_time * fps))
+    end_frame = total_frames if end_frame == None else min(end_frame, total_frames)
+    if(every_secs != None) :
+        frames = np.unique(np.round(np.arange(start_frame * 1.0 / fps, end_frame * 1.0 / fps, every_secs) * fps).astype(np.int64))
+        frames = frames[(frames >= start_frame) & (frames < end_frame)]
+    else :
+        frames = np.arange(start_frame, end_frame, sample_rate, dtype=np.int64)
+    if(max_frames != None) :
+        frames = frames[:max_frames]
+    return frames.tolist()
+
+
+def extract_frames(input_video, output_directory, sample_rate=1, start_frame=0, end_frame=None, start_time=None, end_time=None,
+                   every_secs=None, max_frames=None, image_format="png", quality=None, num_threads=4, seek_gap=None,
+                   manifest_fn="manifest.csv", reader="cv2", reader_args=None) :
+    '''
+    Save sampled frames of a video as images, e.g. to build a labeling dataset.
+    Only the sampled frames are decoded : short gaps are skipped with grab (no color conversion), long gaps
+    with a seek, and decoding stops after the last sampled frame.  Images are encoded and written by a
+    pool of num_threads writer threads while the video is being decoded.
+    sample_rate, start_frame, end_frame, start_time, end_time, every_secs, max_frames : see sampled_frame_indices
+    image_format : "png" | "jpg" | "webp"
+    quality      : jpg / webp quality 0-100, png compression level 0-9.  Default : the cv2 default
+    num_threads  : writer threads
+    seek_gap     : seek when the next frame is more than this many frames ahead.  Default : 2 seconds of video
+    manifest_fn  : csv (frame, timestamp in seconds, file) written in output_directory, None for no manifest
+    reader       : video reader backend (ivi_reader) : "cv2" or "pyav" (threaded decode, timestamps from the frame pts)
+    reader_args  : dict passed to the backend, e.g. {'threads' : 8, 'size' : (640,360)}.  With {'keyframes_only' : True}
+                   (pyav) only the keyframes are decoded and every keyframe in the frame / time range is written,
+                   sample_rate and every_secs are ignored
+    Images are named <video name>_<frame>_.<image_format>
+    returns : list of (frame, timestamp, file name)
+    '''
+    if(image_format not in IMAGE_QUALITY_FLAGS) :
+        raise ValueError("unknown image_format {}, use one of {}".format(image_format, list(IMAGE_QUALITY_FLAGS.keys())))
+    os.makedirs(output_directory, exist_ok=True)
+
+    reader_args = dict(reader_args or {})
+    cap = open_video_reader(input_video, reader, **reader_args)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) # fps = video.get(cv2.CAP_PROP_FPS)
+    nprint("Total number of frames  = {} (frames)".format(total_frames))
+    nprint("Frame rate              = {} (fps)".format(fps))
+    nprint("Total seconds for video = {} (s)".format(total_frames / fps))
+
+    frames = sampled_frame_indices(total_frames, fps, sample_rate, start_frame, end_frame, start_time, end_time, every_secs, max_frames)
+    if(seek_gap == None) :
+        seek_gap = int(2 * fps)
+    if(reader_args.get('keyframes_only')) :
+        # the keyframes of the range, from the packet index.  Each one is a seek and a single frame decode
+        in_range = set(sampled_frame_indices(total_frames, fps, 1, start_frame, end_frame, start_time, end_time))
+        frames = [frame_idx for frame_idx in cap.keyframe_indices() if frame_idx in in_range][:max_frames]
+        seek_gap = 0
+    params = [] if quality == None else [IMAGE_QUALITY_FLAGS[image_format], int(quality)]
+    base_fn = os.path.splitext(os.path.basename(input_video))[0]
+
+    # bound the frames decoded but not yet written
+    pool = ThreadPoolExecutor(max_workers=num_threads)
+    pending = Semaphore(4 * num_threads)
+    def write_image(fn, frame) :
+        try :
+            if(not cv2.imwrite(fn, frame, params)) :
+                raise IOError("could not write {}".format(fn))
+        finally :
+            pending.release()
+
+    manifest = []
+    futures = []
+    pos = 0   # frame number of the next cap.read / grab
+    for frame_idx in frames :
+        if(frame_idx - pos > seek_gap) :
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+            pos = frame_idx
+        while(pos < frame_idx and cap.grab()) :
+            pos += 1
+        ret, frame = cap.read()
+        if(not ret) :
+            nprint("Warning : could not read frame {}, stopping".format(frame_idx))
+            break
+        pos += 1
+        # pyav : the timestamp of the frame (pts), right for variable frame rate videos
+        timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0 if reader == "pyav" else frame_idx / fps
+
+        fn = "{}_{}_.{}".format(base_fn, frame_idx, image_format)
+        pending.acquire()
+        futures.append(pool.submit(write_image, output_directory + "/" + fn, frame))
+        manifest.append((frame_idx, round(timestamp, 3), fn))
+        if(len(manifest) % 100 == 0) :
+            nprint("Extracted {} of {} frames".format(len(manifest), len(frames)))
+    cap.release()
+    for f in futures :
+        f.result()
+    pool.shutdown()
+
+    if(manifest_fn != None) :
+        f = open(output_directory + "/" + manifest_fn, 'w', newline='')
+        w = csv.writer(f)
+        w.writerow(["frame", "timestamp", "file"])
+        w.writerows(manifest)
+        f.close()
+
+    nprint("Complete.  Wrote {} frames to {}".format(len(manifest), output_directory))
+    return manifest
+
+
+# This is the workhorse function .....
+#
+def edit_video_objdet(input_video, model_url,output_directory, output_fn, max_frames=50, force_refresh=True, sample_rate=1, counter_mode="counts",
+                      single_pass=False, num_threads=None, max_buffer=64, draw_threads=None, full_frame_rate=False, num_procs=1,
+                      writer="cv2", writer_args=None, copy_audio=False, output_mode="video", mosaic=None,
+                      tiling=None, postprocess=None, adaptive=None, pipeline="threads", reader="cv2", reader_args=None):
+    '''
+    Score a video with a PAIV object detection model and write an annotated copy
+    single_pass : decode the video once, scoring frames and writing them (in order) as their results arrive.
+                  Default is two passes : fetch_scores over the whole video, then annotate from the results cache (ivi_cache)
+    num_threads : concurrent api requests, default the autotuned setting of model_url (ivi_autotune) or 6
+    max_buffer  : single_pass only, max frames held waiting for their scores
+    draw_threads: frames are decoded, drawn and encoded in a staged pipeline (run_frame_pipeline),
+                  this is the number of drawing workers.  Default : one per core
+    full_frame_rate : write every source frame, not just the sampled ones.  Boxes in between sampled
+                  frames are interpolated (BoxInterpolator) and counters count real frames, so
+                  screen_time is in real seconds
+    counter_mode: "counts" | "screen_time" : raw box counts / box frames, over the frames that are drawn
+                  "unique" | "dwell" | "visible" : boxes are tracked across frames (ivi_tracking.IouTracker)
+                  and the counter shows distinct objects, their total seconds on screen, or objects in view now.
+                  Track ids are drawn on the boxes
+    num_procs   : two pass mode only, split the video into num_procs frame ranges that are scored, annotated
+                  and encoded in their own processes (counters carry over between them), then joined
+    writer      : output video backend (ivi_writer) : "cv2" (mp4v) or "ffmpeg" (H.264/H.265 through a local ffmpeg)
+    writer_args : dict passed to the backend, e.g. {'codec' : 'h265', 'preset' : 'fast', 'crf' : 26, 'threads' : 8}
+    copy_audio  : ffmpeg writer with full_frame_rate only, copy the source audio track into the output
+    output_mode : "video"   : write the annotated video
+                  "sidecar" : no video, only score and write time coded detections next to output_fn (ivi_sidecar) :
+                              <name>.boxes.json, <name>.boxes.vtt (WebVTT) and <name>.intervals.json (per label screen time)
+                              No frame is drawn or encoded, so this takes as long as the scoring
+    mosaic      : optional ivi_mosaic.MosaicBatcher settings (e.g. {'grid' : (2,2)}) to score several frames per request.
+                  Used by the scoring pass of the default two pass mode and the sidecar mode (num_procs=1)
+    tiling      : optional ivi_tiling.TiledScorer settings (e.g. {'tile_size' : (1024,1024), 'overlap' : 0.2}) to score
+                  high resolution frames as overlapping tiles.  Same scoring passes as mosaic
+    postprocess : optional ivi_boxes.PostProcessor (confidence thresholds, NMS, top k) applied to the boxes before
+                  they are drawn, counted or written to sidecars.  The results cache keeps the raw results,
+                  so other settings can be tried on a cached video without hitting the API again
+    adaptive    : optional ivi_sampling settings (e.g. {'max_stride' : 64}) for adaptive sampling : sample_rate is the shortest
+                  stride, the stride grows while the detections are stable.  Frames that are not scored show the last
+                  scored detections.  Same scoring passes as mosaic
+    pipeline    : "threads" | "processes" : draw (and encode the frames sent for scoring) on threads, or in draw_threads
+                  worker processes reading the frames from a shared memory ring (ivi_shm.run_process_pipeline),
+                  for when the python side of drawing is the limit.  Output is the same
+    reader      : input video backend (ivi_reader) : "cv2" or "pyav" (multi-threaded decode and an exact frame count,
+                  for high resolution H.264 / H.265 sources where decoding is the limit)
+    reader_args : dict passed to the backend, e.g. {'threads' : 8} or {'size' : (1280,720)} to score and annotate
+                  a reduced resolution copy.  Every pass of the video uses the same reader
+    '''
+    paiv_colors = generate_colors()
+    BOX_TITLE = "AD Logo Time"
+    if(num_threads == None) :
+        num_threads = tuned_setting(model_url, 'num_threads', 6)
+
+    if(not(os.path.isfile(input_video))) :
+        nprint("Error : Input File {} does not exist.  Check path".format(input_video))
+        return 1;
+    print(input_video)
+
+
+    counter_dict = defaultdict(int)
+
+    reader_args = dict(reader_args or {})
+    writer_args = dict(writer_args or {})
+    if(copy_audio) :
+        if(writer != "ffmpeg") :
+            nprint("Warning : copy_audio needs writer=ffmpeg, not copying audio")
+        elif(not full_frame_rate) :
+            nprint("Warning : copy_audio needs full_frame_rate (sampled output is shorter than the source), not copying audio")
+        else :
+            writer_args['audio_source'] = input_video
+
+    if(output_mode not in ["video", "sidecar"]) :
+        nprint("Error : unknown output_mode {}, use video or sidecar".format(output_mode))
+        return 1
+
+    # Make
+    if(not(os.path.exists(output_directory))) :
+        #shutil.rmtree(output_directory)
+        os.mkdir(output_directory)
+
+
+    # Scores are cached in a binary results cache (ivi_cache), cache.json from older runs is migrated once
+    cache_file = output_directory + "/cache"
+    json_cache_file = output_directory + "/cache.json"
+    if(force_refresh==False and not results_cache_exists(cache_file) and os.path.isfile(json_cache_file)) :
+        migrate_json_cache(json_cache_file, cache_file)
+
+    if(output_mode == "sidecar") :
+        return _edit_video_sidecar(input_video, model_url, output_directory, output_fn, cache_file, max_frames, sample_rate,
+                                   force_refresh, num_threads, num_procs, mosaic, tiling, postprocess, adaptive, reader, reader_args)
+    if(single_pass and (not results_cache_exists(cache_file) or force_refresh==True)) :
+        return _edit_video_single_pass(input_video, model_url, output_directory, output_fn, cache_file, max_frames, sample_rate,
+                                       counter_mode, num_threads, max_buffer, draw_threads, full_frame_rate, BOX_TITLE, paiv_colors,
+                                       writer, writer_args, postprocess, pipeline, reader, reader_args)
+    if(num_procs > 1) :
+        return _edit_video_parallel(input_video, model_url, output_directory, output_fn, cache_file, max_frames, sample_rate, counter_mode,
+                                    force_refresh, num_threads, num_procs, draw_threads, full_frame_rate, BOX_TITLE, paiv_colors,
+                                    writer, writer_args, postprocess, pipeline, reader, reader_args)
+
+    # Step1 : Determine if i need to fetch data or if cache file exists ...
+    # if it doesnt exist, build it ....
+
+    if(not results_cache_exists(cache_file) or force_refresh==True) :
+        nprint("Fetching scores from PAIV url = {}, output dir = {} ".format(model_url, output_directory))
+        _score_video(input_video, model_url, cache_file, max_frames, sample_rate, num_threads, mosaic, tiling, adaptive, pipeline,
+                     reader, reader_args)
+        #def fetch_scores(paiv_url, validate_mode="classification", media_mode="video", num_threads=2, frame_limit=50, image_dir="na", video_fn="na", paiv_results_file="fetch_scores.json"):
+    else :
+        nprint("Not hitting API : Using results cache {}.*  Use --force_refresh=True to hit the API".format(cache_file))
+    results = ResultsCache(cache_file, postprocess)
+
+    nprint("Read in {} cached results".format(len(results)))
+
+    # Second Pass over video
+    nprint("Annotating {} and saving in {}".format(input_video, output_directory))
+    cap  = open_video_reader(input_video, reader, **reader_args)
+    total_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    fps = cap.get(cv2.CAP_PROP_FPS) # fps = video.get(cv2.CAP_PROP_FPS)
+    secs = total_frames / fps
+    nprint("Total number of frames  = {} (frames)".format(total_frames))
+    nprint("Frame rate              = {} (fps)".format(fps))
+    nprint("Total seconds for video = {} (s)".format(secs))
+
+    if(max_frames > total_frames) :
+        max_frames = total_frames
+        print("Processing number of frames  = {} (frames)".format(max_frames))
+    ret, frame = cap.read()
+
+    output  = open_video_writer(output_directory + "/" + output_fn, fps, (frame.shape[1],frame.shape[0]), writer, **writer_args)
+
+    # Decoder thread : reads frames and works out each frame's overlays (running counters are order dependent)
+    # Drawing pool     : draws the overlays
+    # Encoder thread   : writes frames back in order
+    state = _CachedOverlays(results, sample_rate, full_frame_rate, counter_mode, paiv_colors)
+
+    draw_fn = partial(_draw_overlays, box_title=BOX_TITLE, counter_mode=counter_mode, fps=fps)
+    _run_pipeline(pipeline, _cached_source(cap, state, 0, max_frames, frame), draw_fn, output.write, draw_threads)
+
+    cap.release()
+    output.release()
+    nprint("Program Complete : Wrote new movie : {}/{}".format(output_directory,output_fn))
+
+
+class _CachedOverlays():
+    '''
+    Overlays for the output frames of the two pass mode, worked out from the cached results.
+    Holds all the order dependent state (counters, colors, tracker, interpolator), so it can be
+    advanced through a video without decoding it and copied (snapshot) to start annotating part way in.
+    Call overlays with increasing frame indexes.
+    '''
+    def __init__(self, results, sample_rate, full_frame_rate, counter_mode, paiv_colors):
+        self.results = results
+        self.sample_rate = sample_rate
+        self.full_frame_rate = full_frame_rate
+        self.counter_mode = counter_mode
+        self.paiv_colors = paiv_colors
+        self.metric_dict = defaultdict(int)
+        self.color_dict = defaultdict()
+        self.tracker = _make_tracker(counter_mode, sample_rate, full_frame_rate)
+        self.interp = BoxInterpolator(hold_frames=sample_rate)
+        self.next_key = 0
+
+    def is_output_frame(self, frame_idx):
+        # every frame at full frame rate, otherwise the sampled frames.  Result k is frame (k+1)*sample_rate
+        if(self.full_frame_rate) :
+            return True
+        return frame_idx > 0 and frame_idx % self.sample_rate == 0 and frame_idx // self.sample_rate <= len(self.results)
+
+    def overlays(self, frame_idx):
+        if(not self.full_frame_rate) :
+            return _box_overlays(self.results.boxes(frame_idx // self.sample_rate - 1), self.metric_dict, self.color_dict,
+                                 self.paiv_colors, frame_idx, self.tracker, self.counter_mode)
+
+        # keep one key frame ahead of the current frame to interpolate towards
+        while(self.next_key < len(self.results) and (self.next_key+1)*self.sample_rate <= frame_idx + self.sample_rate) :
+            # frames skipped by adaptive sampling are not keys, boxes are interpolated across them
+            if(self.results.status(self.next_key) != STATUS_SKIPPED) :
+                self.interp.add_key((self.next_key+1)*self.sample_rate, self.results.boxes(self.next_key))
+            self.next_key += 1
+        return _box_overlays(self.interp.boxes_at(frame_idx), self.metric_dict, self.color_dict, self.paiv_colors,
+                             frame_idx, self.tracker, self.counter_mode)
+
+    def advance(self, start, stop):
+        # update the counters for frames [start, stop) without drawing them
+        for frame_idx in range(start, stop) :
+            if(self.is_output_frame(frame_idx)) :
+                self.overlays(frame_idx)
+
+    def snapshot(self):
+        # copy of the state, sharing the (read only) cached results
+        return copy.deepcopy(self, {id(self.results) : self.results})
+
+
+def _cached_source(cap, state, start, stop, frame) :
+    # (frame, overlays) for the output frames in [start, stop).  frame is frame start, already decoded
+    frame_idx = start
+    while(frame_idx < stop and frame is not None) :
+        if(state.is_output_frame(frame_idx)) :
+            yield (frame, state.overlays(frame_idx))
+        frame_idx += 1
+        if(frame_idx % 100 == 0 ) :
+            nprint("Complete {} frames".format(frame_idx))
+        if(frame_idx < stop) :
+            ret, frame = cap.read()
+
+
+def _edit_video_parallel(input_video, model_url, output_directory, output_fn, cache_file, max_frames, sample_rate, counter_mode,
+                         force_refresh, num_threads, num_procs, draw_threads, full_frame_rate, box_title, paiv_colors,
+                         writer="cv2", writer_args={}, postprocess=None, pipeline="threads", reader="cv2", reader_args={}) :
+    '''
+    Two pass edit_video_objdet split into num_procs frame range segments, each handled by its own process.
+    1. each segment decodes and scores its own sampled frames (unless the results cache is reused)
+    2. the counters at each segment boundary are worked out from the cached results, no decoding
+    3. each segment is decoded, annotated and encoded to its own file, starting from its boundary counters
+    4. the segment files are joined : stream copy with ffmpeg if it is installed, otherwise re-encoded with the writer
+    Segments are encoded with the writer backend, the source audio (writer_args audio_source) is added when joining.
+    '''
+    cap  = open_video_reader(input_video, reader, **reader_args)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    max_frames = int(min(max_frames, total_frames))
+    nprint("Parallel : {} frames at {} (fps) in {} segments".format(max_frames, fps, num_procs))
+
+    bounds = [int(round(i * max_frames / float(num_procs))) for i in range(num_procs + 1)]
+    segments = list(zip(bounds[:-1], bounds[1:]))
+    pool = ProcessPoolExecutor(max_workers=num_procs, mp_context=multiprocessing.get_context("spawn"))
+
+    if(not results_cache_exists(cache_file) or force_refresh==True) :
+        nprint("Fetching scores from PAIV url = {}, output dir = {} ".format(model_url, output_directory))
+        _score_segments(pool, input_video, model_url, cache_file, segments, sample_rate, num_threads, reader, reader_args)
+    else :
+        nprint("Not hitting API : Using results cache {}.*  Use --force_refresh=True to hit the API".format(cache_file))
+    results = ResultsCache(cache_file, postprocess)
+
+    # Counters carried across the segment boundaries
+    state = _CachedOverlays(results, sample_rate, full_frame_rate, counter_mode, paiv_colors)
+    states = []
+    for (start, stop) in segments :
+        states.append(state.snapshot())
+        state.advance(start, stop)
+
+    segment_args = dict(writer_args)
+    audio_source = segment_args.pop('audio_source', None)
+    segment_fns = ["{}/segment_{}_{}".format(output_directory, i, output_fn) for i in range(len(segments))]
+    futures = [pool.submit(_annotate_segment, input_video, segment_fns[i], states[i], start, stop, box_title, counter_mode, draw_threads,
+                           writer, segment_args, pipeline, reader, reader_args)
+               for (i, (start, stop)) in enumerate(segments)]
+    frames_written = sum(f.result() for f in futures)
+    pool.shutdown()
+
+    _join_segments(segment_fns, output_directory + "/" + output_fn, fps, writer, segment_args, audio_source)
+    for fn in segment_fns :
+        os.remove(fn)
+    nprint("Program Complete : Wrote new movie with {} frames : {}/{}".format(frames_written, output_directory, output_fn))
+
+
+def _score_video(input_video, model_url, cache_file, max_frames, sample_rate, num_threads, mosaic=None, tiling=None, adaptive=None,
+                 pipeline="threads", reader="cv2", reader_args={}) :
+    # Score the sampled frames with fetch_scores, into the results cache
+    cache_writer = ResultsCacheWriter(cache_file)
+    fetch_scores(model_url, 'object', media_mode='video',num_threads=num_threads,frame_limit=max_frames, sample_rate=sample_rate,image_dir="na", video_fn=input_video, paiv_results_file=None, results_cache=cache_writer,
+                 mosaic=mosaic, tiling=tiling, adaptive=adaptive, pipeline=pipeline, reader=reader, reader_args=reader_args)
+    cache_writer.close()
+
+
+def _score_segments(pool, input_video, model_url, cache_file, segments, sample_rate, num_threads, reader="cv2", reader_args={}) :
+    # Score the frame range segments in the process pool, into the results cache
+    threads_per_segment = max(1, num_threads // len(segments))
+    futures = [pool.submit(_score_segment, input_video, model_url, start, stop, sample_rate, threads_per_segment, reader, reader_args)
+               for (start, stop) in segments]
+    cache_writer = ResultsCacheWriter(cache_file)
+    slot = 0
+    for f in futures :
+        for json_rv in f.result() :
+            cache_writer.put(slot, json_rv)
+            slot += 1
+    cache_writer.close()
+    nprint("Wrote {} results to {}.*".format(slot, cache_file))
+
+
+def _edit_video_sidecar(input_video, model_url, output_directory, output_fn, cache_file, max_frames, sample_rate,
+                        force_refresh, num_threads, num_procs, mosaic=None, tiling=None, postprocess=None, adaptive=None,
+                        reader="cv2", reader_args={}) :
+    '''
+    edit_video_objdet with output_mode="sidecar" : score the video (or reuse the results cache) and write
+    the detection sidecars (ivi_sidecar.write_sidecars).  Only the frame count and fps are read from the video
+    after scoring, nothing is drawn or encoded.
+    '''
+    cap  = open_video_reader(input_video, reader, **reader_args)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    max_frames = int(min(max_frames, total_frames))
+    nprint("Sidecar : {} frames at {} (fps)".format(max_frames, fps))
+
+    if(not results_cache_exists(cache_file) or force_refresh==True) :
+        nprint("Fetching scores from PAIV url = {}, output dir = {} ".format(model_url, output_directory))
+        if(num_procs > 1) :
+            bounds = [int(round(i * max_frames / float(num_procs))) for i in range(num_procs + 1)]
+            pool = ProcessPoolExecutor(max_workers=num_procs, mp_context=multiprocessing.get_context("spawn"))
+            _score_segments(pool, input_video, model_url, cache_file, list(zip(bounds[:-1], bounds[1:])), sample_rate, num_threads,
+                            reader, reader_args)
+            pool.shutdown()
+        else :
+            _score_video(input_video, model_url, cache_file, max_frames, sample_rate, num_threads, mosaic, tiling, adaptive,
+                         reader=reader, reader_args=reader_args)
+    else :
+        nprint("Not hitting API : Using results cache {}.*  Use --force_refresh=True to hit the API".format(cache_file))
+
+    output_prefix = output_directory + "/" + os.path.splitext(output_fn)[0]
+    write_sidecars(cache_file, output_prefix, sample_rate, fps, total_frames=max_frames, source=input_video, postprocess=postprocess)
+    nprint("Program Complete : Wrote sidecars : {}.*".format(output_prefix))
+
+
+def _score_segment(input_video, model_url, start, stop, sample_rate, num_threads, reader="cv2", reader_args={}) :
+    # Score the sampled frames in [start, stop), returns their results in frame order
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    cap  = open_video_reader(input_video, reader, **reader_args)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    pool = ThreadPoolExecutor(max_workers=num_threads)
+    futures = []
+    for frame_idx in range(start, stop) :
+        ret, frame = cap.read()
+        if(frame is None) :
+            break
+        if(frame_idx > 0 and frame_idx % sample_rate == 0) :
+            fetch_fn = "paiv_{}.jpg".format(frame_idx)
+            futures.append(pool.submit(get_json_from_paiv, model_url, frame, fetch_fn, frame_idx))
+    cap.release()
+    rv = [f.result() for f in futures]
+    pool.shutdown()
+    return rv
+
+
+def _annotate_segment(input_video, segment_fn, state, start, stop, box_title, counter_mode, draw_threads, writer="cv2", writer_args={},
+                      pipeline="threads", reader="cv2", reader_args={}) :
+    # Annotate frames [start, stop) to segment_fn, state holds the counters at frame start.  returns frames written
+    cap  = open_video_reader(input_video, reader, **reader_args)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    ret, frame = cap.read()
+    if(frame is None) :
+        nprint("Error : could not seek to frame {} of {}".format(start, input_video))
+        return 0
+    output  = open_video_writer(segment_fn, fps, (frame.shape[1],frame.shape[0]), writer, **writer_args)
+
+    draw_fn = partial(_draw_overlays, box_title=box_title, counter_mode=counter_mode, fps=fps)
+    frames_written = _run_pipeline(pipeline, _cached_source(cap, state, start, stop, frame), draw_fn, output.write, draw_threads)
+    cap.release()
+    output.release()
+    return frames_written
+
+
+def _join_segments(segment_fns, output_path, fps, writer="cv2", writer_args={}, audio_source=None) :
+    # Concatenate the segment files into output_path, adding the audio of audio_source if given
+    ffmpeg_bin = writer_args.get('ffmpeg_bin', "ffmpeg")
+    if(shutil.which(ffmpeg_bin) != None) :
+        list_fn = output_path + ".segments.txt"
+        f = open(list_fn, 'w')
+        for fn in segment_fns :
+            f.write("file '{}'\n".format(os.path.abspath(fn)))
+        f.close()
+        cmd = [ffmpeg_bin, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_fn]
+        if(audio_source != None) :
+            cmd += ["-i", audio_source, "-map", "0:v", "-map", "1:a?", "-shortest"]
+        rv = subprocess.run(cmd + ["-c", "copy", output_path])
+        os.remove(list_fn)
+        if(rv.returncode == 0) :
+            return
+        nprint("Warning : ffmpeg concat failed, re-encoding the segments")
+
+    output = None
+    for fn in segment_fns :
+        cap = cv2.VideoCapture(fn)
+        while(True) :
+            ret, frame = cap.read()
+            if(frame is None) :
+                break
+            if(output == None) :
+                output  = open_video_writer(output_path, fps, (frame.shape[1],frame.shape[0]), writer, **writer_args)
+            output.write(frame)
+        cap.release()
+    if(output != None) :
+        output.release()
+
+
+def _make_tracker(counter_mode, sample_rate, full_frame_rate) :
+    # Tracker for the tracking counter modes, None otherwise.  Tracks survive one missed sample
+    if(counter_mode not in TRACKER_COUNTER_MODES) :
+        return None
+    frame_step = 1 if full_frame_rate else sample_rate
+    return IouTracker(max_age=2*sample_rate, frame_step=frame_step)
+
+
+def _frame_overlays(json_rv, metric_dict, color_dict, paiv_colors, frame_idx=1, tracker=None, counter_mode="counts", postprocess=None) :
+    # Sequential part of annotating a frame : parse the boxes and update the running metrics in place.
+    # returns what _draw_overlays needs, with snapshots of the counters so frames can be drawn in any order
+    boxes = BoxArray.from_json(json_rv)
+    if(postprocess != None) :
+        boxes = postprocess(boxes)
+    return _box_overlays(boxes, metric_dict, color_dict, paiv_colors, frame_idx, tracker, counter_mode)
+
+
+def _box_overlays(boxes, metric_dict, color_dict, paiv_colors, frame_idx=1, tracker=None, counter_mode="counts") :
+    # _frame_overlays for boxes that are already parsed (BoxArray or list of Box)
+    boxes = BoxArray.from_boxes(boxes)
+    if(tracker != None) :
+        # the tracker writes track ids into the boxes, and the interpolator can hand out the same boxes again
+        boxes = boxes[:]
+    metric_dict = update_metrics(boxes, frame_idx, metric_dict, tracker, counter_mode)
+
+    box_colors = []
+    for label in boxes.labels.tolist() :
+        if(label not in color_dict) :
+            color_dict[label] = label_color(label, paiv_colors)
+        box_colors.append(color_dict[label])
+
+    return (boxes, box_colors, dict(metric_dict), dict(color_dict))
+
+
+def _draw_overlays(frame, overlays, box_title, counter_mode, fps) :
+    # Draw the boxes and the counter box returned by _frame_overlays
+    (boxes, box_colors, metrics, colors) = overlays
+    frame = draw_annotated_boxes(frame, boxes, box_colors)
+
+    frame = draw_counter_box(frame,box_title, metrics, colors, counter_mode=counter_mode, fps=fps)
+    return frame
+
+
+def run_frame_pipeline(frame_source, draw_fn, write_fn, num_draw_threads=None, max_inflight=None) :
+    '''
+    Staged pipeline for annotating video frames :
+      decoder thread  : iterates frame_source, which yields (frame, draw_args) in output order
+      drawing workers : draw_fn(frame, draw_args) -> frame, num_draw_threads of them
+      encoder thread  : write_fn(frame) in the original order
+    Stages are connected by bounded queues, and at most max_inflight frames are decoded but
+    not yet written, so memory stays bounded even if one frame is slow to draw.
+    cv2 drawing and encoding release the GIL, so throughput scales with cores until write_fn is the limit.
+    returns : number of frames written
+    '''
+    if(num_draw_threads == None) :
+        num_draw_threads = os.cpu_count() or 1
+    if(max_inflight == None) :
+        max_inflight = 4 * num_draw_threads + 4
+
+    draw_q = Queue(maxsize=2 * num_draw_threads)
+    write_q = Queue(maxsize=2 * num_draw_threads)
+    inflight = Semaphore(max_inflight)
+    errors = []
+
+    def decoder() :
+        seq = 0
+        try :
+            for (frame, draw_args) in frame_source :
+                inflight.acquire()
+                draw_q.put((seq, frame, draw_args))
+                seq += 1
+        except Exception as e :
+            errors.append(e)
+        for i in range(num_draw_threads) :
+            draw_q.put(None)
+
+    def drawer() :
+        while(True) :
+            item = draw_q.get()
+            if(item == None) :
+                write_q.put(None)
+                break
+            (seq, frame, draw_args) = item
+            try :
+                frame = draw_fn(frame, draw_args)
+            except Exception as e :
+                errors.append(e)
+            write_q.put((seq, frame))
+
+    frames_written = [0]
+    def encoder() :
+        pending = {}
+        next_seq = 0
+        done = 0
+        while(done < num_draw_threads) :
+            item = write_q.get()
+            if(item == None) :
+                done += 1
+                continue
+            pending[item[0]] = item[1]
+            # reorder : write every frame that is next in line
+            while(next_seq in pending) :
+                try :
+                    write_fn(pending.pop(next_seq))
+                except Exception as e :
+                    errors.append(e)
+                next_seq += 1
+                inflight.release()
+        frames_written[0] = next_seq
+
+    threads = [Thread(target=decoder), Thread(target=encoder)] + [Thread(target=drawer) for i in range(num_draw_threads)]
+    for t in threads :
+        t.start()
+    for t in threads :
+        t.join()
+
+    if(len(errors) > 0) :
+        raise errors[0]
+    return frames_written[0]
+
+
+def _run_pipeline(pipeline, frame_source, draw_fn, write_fn, draw_threads) :
+    # run_frame_pipeline, or with pipeline="processes" the same stages with draw_fn in worker processes on a
+    # shared memory ring (draw_fn and the draw args must pickle)
+    if(pipeline == "processes") :
+        from ivi_shm import run_process_pipeline
+        return run_process_pipeline(frame_source, draw_fn, lambda frame, overlays, rv : write_fn(frame), num_procs=draw_threads)
+    if(pipeline != "threads") :
+        raise ValueError("unknown pipeline {}, use threads or processes".format(pipeline))
+    return run_frame_pipeline(frame_source, draw_fn, write_fn, num_draw_threads=draw_threads)
+
+
+def _edit_video_single_pass(input_video, model_url, output_directory, output_fn, cache_file, max_frames, sample_rate,
+                            counter_mode, num_threads, max_buffer, draw_threads, full_frame_rate, box_title, paiv_colors,
+                            writer="cv2", writer_args={}, postprocess=None, pipeline="threads", reader="cv2", reader_args={}) :
+    '''
+    Single pass version of edit_video_objdet.  Each sampled frame is submitted for scoring and
+    appended to a reorder buffer (a deque of (frame, future) in frame order).  The head of the buffer
+    is sent on to be drawn and written as soon as its result is back, so output starts with the first
+    result and decode, inference and encode all overlap.  The buffer is bounded by max_buffer frames.
+    Frame sampling and the results cache match the two pass mode, results are appended to the cache as they arrive.
+    '''
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    metric_dict = defaultdict(int)
+    color_dict = defaultdict()
+
+    nprint("Single pass : scoring and annotating {} and saving in {}".format(input_video, output_directory))
+    cap  = open_video_reader(input_video, reader, **reader_args)
+    total_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    fps = cap.get(cv2.CAP_PROP_FPS) # fps = video.get(cv2.CAP_PROP_FPS)
+    nprint("Total number of frames  = {} (frames)".format(total_frames))
+    nprint("Frame rate              = {} (fps)".format(fps))
+
+    if(max_frames > total_frames) :
+        max_frames = total_frames
+        print("Processing number of frames  = {} (frames)".format(max_frames))
+    ret, frame = cap.read()
+
+    output  = open_video_writer(output_directory + "/" + output_fn, fps, (frame.shape[1],frame.shape[0]), writer, **writer_args)
+
+    cache_writer = ResultsCacheWriter(cache_file)
+    reorder_buffer = deque()
+    tracker = _make_tracker(counter_mode, sample_rate, full_frame_rate)
+
+    def pop_head() :
+        (head_idx, head_frame, future) = reorder_buffer.popleft()
+        json_rv = future.result()
+        cache_writer.put(head_idx // sample_rate - 1, json_rv)
+        return (head_frame, _frame_overlays(json_rv, metric_dict, color_dict, paiv_colors, head_idx, tracker, counter_mode, postprocess))
+
+    # Runs on the pipeline's decoder thread : decode, submit for scoring, and hand frames on
+    # to the drawing workers in order as soon as their scores are back
+    def scored_source() :
+        loopcnt = 1 # loopcnt set to one since we read the first frame
+        while(loopcnt < max_frames) :
+            ret, frame = cap.read()
+            if(frame is None) :
+                break
+
+            if(loopcnt % sample_rate == 0) :
+                fetch_fn = "paiv_{}.jpg".format(loopcnt)
+                reorder_buffer.append((loopcnt, frame, pool.submit(get_json_from_paiv, model_url, frame, fetch_fn, loopcnt)))
+
+                # Pass on everything at the head that is already scored, block only when the buffer is full
+                while(len(reorder_buffer) > 0 and (reorder_buffer[0][2].done() or len(reorder_buffer) >= max_buffer)) :
+                    yield pop_head()
+
+            loopcnt += 1
+            if(loopcnt % 100 == 0 ) :
+                nprint("Decoded {} frames, scored {}, buffered {}".format(loopcnt, cache_writer.num_slots, len(reorder_buffer)))
+
+        while(len(reorder_buffer) > 0) :
+            yield pop_head()
+
+    # Full frame rate : every frame goes in the buffer, (frame_idx, frame, future or None for unsampled frames).
+    # A frame can go once the next sampled frame at or after it is scored.  The buffer always holds
+    # more than sample_rate frames so that next sampled frame is in it.
+    interp = BoxInterpolator(hold_frames=sample_rate)
+    last_key = [0]
+
+    def head_ready() :
+        for (idx, buf_frame, future) in reorder_buffer :
+            if(future != None) :
+                return future.done()
+        return False
+
+    def pop_head_interpolated() :
+        (head_idx, head_frame, head_future) = reorder_buffer.popleft()
+        # feed the interpolator every key up to the first one at or after this frame
+        for (idx, buf_frame, future) in ([(head_idx, head_frame, head_future)] + list(reorder_buffer)) :
+            if(future != None and idx > last_key[0]) :
+                json_rv = future.result()
+                cache_writer.put(idx // sample_rate - 1, json_rv)
+                boxes = BoxArray.from_json(json_rv)
+                interp.add_key(idx, boxes if postprocess == None else postprocess(boxes))
+                last_key[0] = idx
+            if(idx >= head_idx and idx <= last_key[0]) :
+                break
+        return (head_frame, _box_overlays(interp.boxes_at(head_idx), metric_dict, color_dict, paiv_colors, head_idx, tracker, counter_mode))
+
+    def interpolated_source(frame) :
+        bound = max(max_buffer, sample_rate + 2)
+        loopcnt = 0
+        while(True) :
+            decoding = (loopcnt < max_frames and frame is not None)
+            if(decoding) :
+                future = None
+                if(loopcnt > 0 and loopcnt % sample_rate == 0) :
+                    fetch_fn = "paiv_{}.jpg".format(loopcnt)
+                    future = pool.submit(get_json_from_paiv, model_url, frame, fetch_fn, loopcnt)
+                reorder_buffer.append((loopcnt, frame, future))
+                loopcnt += 1
+                if(loopcnt % 100 == 0 ) :
+                    nprint("Decoded {} frames, scored {}, buffered {}".format(loopcnt, cache_writer.num_slots, len(reorder_buffer)))
+                ret, frame = cap.read()
+
+            while(len(reorder_buffer) > 0 and (not decoding or len(reorder_buffer) >= bound or head_ready())) :
+                yield pop_head_interpolated()
+            if(not decoding) :
+                break
+
+    draw_fn = partial(_draw_overlays, box_title=box_title, counter_mode=counter_mode, fps=fps)
+    pool = ThreadPoolExecutor(max_workers=num_threads)
+    source = interpolated_source(frame) if full_frame_rate else scored_source()
+    frames_written = _run_pipeline(pipeline, source, draw_fn, output.write, draw_threads)
+    pool.shutdown()
+
+    cap.release()
+    output.release()
+
+    cache_writer.close()
+    nprint("Wrote {} results to {}.*".format(cache_writer.num_slots, cache_file))
+    nprint("Program Complete : Wrote new movie with {} frames : {}/{}".format(frames_written, output_directory,output_fn))
+
+
+class _LatestFrameReader():
+    '''
+    Reads a capture on its own thread and only keeps the newest frame, so a slow consumer never
+    falls behind the source : frames it does not pick up in time are dropped (and counted).
+    realtime   : pace the reads to fps, for files replayed as if they were live.  Live sources are paced by the device
+    max_frames : stop after this many source frames, None for no limit
+    '''
+    def __init__(self, cap, fps, realtime, max_frames=None):
+        self.cap = cap
+        self.fps = fps
+        self.realtime = realtime
+        self.max_frames = max_frames
+        self.cond = Condition()
+        self.latest = None
+        self.done = False
+        self.stopped = False
+        self.frames_read = 0
+        self.dropped = 0
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self) :
+        t0 = time.perf_counter()
+        frame_idx = 0
+        while(not self.stopped and (self.max_frames == None or frame_idx < self.max_frames)) :
+            if(self.realtime) :
+                lag = time.perf_counter() - (t0 + frame_idx / self.fps)
+                if(lag < 0) :
+                    time.sleep(-lag)
+                elif(lag > 1.0 / self.fps) :
+                    # decoding is behind the source clock, skip frames without converting them
+                    if(not self.cap.grab()) :
+                        break
+                    frame_idx += 1
+                    self.frames_read += 1
+                    self.dropped += 1
+                    continue
+            ret, frame = self.cap.read()
+            if(not ret) :
+                break
+            t_capture = time.perf_counter()
+            with self.cond :
+                if(self.latest != None) :
+                    self.dropped += 1
+                self.latest = (frame_idx, t_capture, frame)
+                self.cond.notify()
+            frame_idx += 1
+            self.frames_read += 1
+        with self.cond :
+            self.done = True
+            self.cond.notify()
+
+    def get(self) :
+        # newest (frame_idx, capture time, frame), waits for one.  None once the source has ended
+        with self.cond :
+            while(self.latest == None and not self.done) :
+                self.cond.wait()
+            item = self.latest
+            self.latest = None
+            return item
+
+    def stop(self) :
+        self.stopped = True
+        self.thread.join()
+
+
+def _latency_ms(values) :
+    if(len(values) == 0) :
+        return None
+    values = np.array(values) * 1000.0
+    return {'p50' : round(float(np.percentile(values, 50)), 1), 'p95' : round(float(np.percentile(values, 95)), 1),
+            'max' : round(float(values.max()), 1)}
+
+
+def stream_video_objdet(input_source, model_url, output_directory=None, output_fn="stream.mov", latency_budget=0.5, max_inflight=2,
+                        sample_rate=1, hold_secs=None, realtime=None, max_frames=None, counter_mode="counts", writer="cv2",
+                        writer_args=None, report_secs=5.0, postprocess=None) :
+    '''
+    Annotate a live stream (camera, rtsp url, or a file replayed in real time) with a PAIV object detection model.
+    Output frames never wait for the model : every frame is drawn with the most recent detections, so the
+    pipeline keeps up with the source however slow the endpoint is.
+      - frames are read at the source rate on their own thread, frames the annotator is too slow for are dropped
+      - a frame is sent for inference only if fewer than max_inflight requests are outstanding (and at most
+        one every sample_rate frames), the others are skipped for inference
+      - a result that arrives more than latency_budget seconds after its frame was captured is discarded,
+        so the boxes drawn are never older than the budget.  Boxes are cleared after hold_secs without a new result
+    input_source   : video file, stream url, or camera index (int or digit string)
+    output_directory, output_fn : annotated output video (and stream_stats.json), None to only report
+    latency_budget : seconds, max age of the detections drawn
+    hold_secs      : default 2 * latency_budget
+    realtime       : replay at the source fps, default True for files (live sources are paced by the device)
+    max_frames     : stop after this many source frames
+    counter_mode, writer, writer_args, postprocess : as edit_video_objdet
+    report_secs    : seconds between progress reports
+    returns : dict of stats (frames read / written / dropped, inference submitted / skipped / late,
+              end to end latency and detection latency percentiles in ms)
+    '''
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    paiv_colors = generate_colors()
+    BOX_TITLE = "AD Logo Time"
+    if(hold_secs == None) :
+        hold_secs = 2 * latency_budget
+    if(isinstance(input_source, str) and input_source.isdigit()) :
+        input_source = int(input_source)
+    if(realtime == None) :
+        realtime = isinstance(input_source, str) and os.path.isfile(input_source)
+
+    cap = cv2.VideoCapture(input_source)
+    if(not cap.isOpened()) :
+        nprint("Error : could not open {}".format(input_source))
+        return None
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if(not fps > 0) :
+        fps = 30.0
+    nprint("Streaming {} at {} (fps), latency budget {} (s), {} requests in flight".format(input_source, fps, latency_budget, max_inflight))
+
+    output = None
+    if(output_directory != None) :
+        os.makedirs(output_directory, exist_ok=True)
+    writer_args = dict(writer_args or {})
+
+    metric_dict = defaultdict(int)
+    color_dict = defaultdict()
+    tracker = _make_tracker(counter_mode, sample_rate, False)
+    overlays = (BoxArray(), [], {}, {})
+    applied = (-1, 0.0)   # frame index and capture time of the detections drawn
+
+    # results come back on the request threads, the main loop picks them up
+    results_q = Queue()
+    pool = ThreadPoolExecutor(max_workers=max_inflight)
+    def submit(frame_idx, t_capture, frame) :
+        def done(future) :
+            try :
+                json_rv = future.result()
+            except Exception as e :
+                nprint("Warning : request for frame {} failed : {}".format(frame_idx, e))
+                json_rv = None
+            results_q.put((frame_idx, t_capture, json_rv, time.perf_counter()))
+        pool.submit(get_json_from_paiv, model_url, frame, "stream_{}.jpg".format(frame_idx), frame_idx).add_done_callback(done)
+
+    stats = defaultdict(int)
+    e2e_latency = []
+    det_latency = []
+    inflight = 0
+    last_submit = -sample_rate
+    t_report = time.perf_counter()
+    reader = _LatestFrameReader(cap, fps, realtime, max_frames)
+    try :
+        while(True) :
+            item = reader.get()
+            if(item == None) :
+                break
+            (frame_idx, t_capture, frame) = item
+
+            # newest result within the budget becomes the detections drawn
+            while(True) :
+                try :
+                    (res_idx, res_capture, json_rv, t_done) = results_q.get_nowait()
+                except Empty :
+                    break
+                inflight -= 1
+                det_latency.append(t_done - res_capture)
+                if(t_done - res_capture > latency_budget) :
+                    stats['results_late'] += 1
+                elif(res_idx < applied[0]) :
+                    stats['results_superseded'] += 1
+                else :
+                    overlays = _frame_overlays(json_rv, metric_dict, color_dict, paiv_colors, res_idx, tracker, counter_mode, postprocess)
+                    applied = (res_idx, res_capture)
+
+            if(inflight < max_inflight and frame_idx - last_submit >= sample_rate) :
+                submit(frame_idx, t_capture, frame.copy())
+                inflight += 1
+                last_submit = frame_idx
+                stats['inference_submitted'] += 1
+            else :
+                stats['inference_skipped'] += 1
+
+            if(len(overlays[0]) > 0 and time.perf_counter() - applied[1] > hold_secs) :
+                overlays = (BoxArray(), [], overlays[2], overlays[3])
+
+            frame = _draw_overlays(frame, overlays, BOX_TITLE, counter_mode, fps)
+            if(output_directory != None) :
+                if(output == None) :
+                    output = open_video_writer(output_directory + "/" + output_fn, fps, (frame.shape[1],frame.shape[0]), writer, **writer_args)
+                output.write(frame)
+            stats['frames_written'] += 1
+            e2e_latency.append(time.perf_counter() - t_capture)
+
+            if(time.perf_counter() - t_report > report_secs) :
+                t_report = time.perf_counter()
+                nprint("Frames read {}, written {}, dropped {}, inference sent {} skipped {} late {}, latency (ms) {}".format(
+                       reader.frames_read, stats['frames_written'], reader.dropped, stats['inference_submitted'],
+                       stats['inference_skipped'], stats['results_late'], _latency_ms(e2e_latency[-300:])))
+    except KeyboardInterrupt :
+        nprint("Interrupted, stopping")
+    reader.stop()
+    cap.release()
+    pool.shutdown(wait=False, cancel_futures=True)
+    if(output != None) :
+        output.release()
+
+    frames_read = reader.frames_read
+    rv = {'frames_read' : frames_read, 'frames_written' : stats['frames_written'], 'frames_dropped' : reader.dropped,
+          'drop_rate' : round(reader.dropped / float(max(frames_read, 1)), 4),
+          'inference_submitted' : stats['inference_submitted'], 'inference_skipped' : stats['inference_skipped'],
+          'results_late' : stats['results_late'], 'results_superseded' : stats['results_superseded'],
+          'latency_ms' : _latency_ms(e2e_latency), 'detection_latency_ms' : _latency_ms(det_latency)}
+    if(output_directory != None) :
+        f = open(output_directory + "/stream_stats.json", 'w')
+        f.write(json.dumps(rv, indent=2))
+        f.close()
+    nprint("Stream Complete : {}".format(rv))
+    return rv
+
+
+def match_boxes(boxes_a, boxes_b, iou_threshold=0.3) :
+    '''
+    Greedy matching of two sets of boxes (BoxArray or lists of Box) : same label, highest IoU first, IoU >= iou_threshold
+    returns : list of (index in boxes_a, index in boxes_b)
+    '''
+    boxes_a = BoxArray.from_boxes(boxes_a)
+    boxes_b = BoxArray.from_boxes(boxes_b)
+    score = boxes_a.iou(boxes_b)
+    score[boxes_a.labels[:, None] != boxes_b.labels[None, :]] = 0.0
+    (rows, cols) = greedy_match(score, iou_threshold)
+    return list(zip(rows.tolist(), cols.tolist()))
+
+
+def interpolate_boxes(boxes_a, boxes_b, matches, alpha) :
+    '''
+    Boxes at fraction alpha (0..1) of the way from boxes_a to boxes_b
+    matched boxes move linearly, unmatched boxes show for the half of the interval closest to their own frame
+    returns : BoxArray
+    '''
+    boxes_a = BoxArray.from_boxes(boxes_a)
+    boxes_b = BoxArray.from_boxes(boxes_b)
+    ia = [i for (i, j) in matches]
+    ib = [j for (i, j) in matches]
+    a = boxes_a.coords[ia]
+    coords = np.round(a + alpha*(boxes_b.coords[ib] - a))
+    rv = BoxArray(boxes_a.labels[ia], coords, boxes_a.confidence[ia])
+
+    if(alpha < 0.5) :
+        unmatched = np.ones(len(boxes_a), dtype=bool)
+        unmatched[ia] = False
+        return rv.concatenate(boxes_a[unmatched])
+    unmatched = np.ones(len(boxes_b), dtype=bool)
+    unmatched[ib] = False
+    return rv.concatenate(boxes_b[unmatched])
+
+
+class BoxInterpolator():
+    '''
+    Boxes for every frame of a video from the detections on its sampled (key) frames.
+    Detections of neighbouring key frames are matched (match_boxes) and interpolated (interpolate_boxes),
+    the last key frame's boxes are held for hold_frames frames.
+    Add keys in frame order with add_key, and call boxes_at with non decreasing frame indexes
+    after adding the first key at or after that frame.
+    '''
+    def __init__(self, hold_frames=1, iou_threshold=0.3):
+        self.hold_frames = hold_frames
+        self.iou_threshold = iou_threshold
+        self.keys = deque()
+        self.matches = None
+
+    def add_key(self, frame_idx, boxes):
+        self.keys.append((frame_idx, BoxArray.from_boxes(boxes)))
+
+    def boxes_at(self, frame_idx):
+        while(len(self.keys) > 1 and self.keys[1][0] <= frame_idx) :
+            self.keys.popleft()
+            self.matches = None
+
+        if(len(self.keys) == 0 or self.keys[0][0] > frame_idx) :
+            return BoxArray()
+        (idx_a, boxes_a) = self.keys[0]
+        if(len(self.keys) == 1) :
+            return boxes_a if (frame_idx - idx_a) < self.hold_frames else BoxArray()
+
+        (idx_b, boxes_b) = self.keys[1]
+        if(self.matches == None) :
+            self.matches = match_boxes(boxes_a, boxes_b, self.iou_threshold)
+        alpha = (frame_idx - idx_a) / float(idx_b - idx_a)
+        return interpolate_boxes(boxes_a, boxes_b, self.matches, alpha)
+
+
+# Custom Logic for this soccer video
+# Keep track of raw box counts
+# Also track
+# - current opppent players (smoothed using ewma)
+# - current csa players (smoothed using ewma)
+# - ball touches with timer
+
+def update_metrics(boxes, frame_count, metric_dict, tracker=None, counter_mode="counts"):
+    # With a tracker (ivi_tracking.IouTracker) the boxes are tracked as frame frame_count,
+    # each box gets its track_id and metric_dict is replaced by the tracker's counters for counter_mode
+    if(tracker != None) :
+        track_ids = tracker.update_boxes(frame_count, boxes)
+        if(isinstance(boxes, BoxArray)) :
+            boxes.track_ids[:] = track_ids
+        else :
+            for (box, track_id) in zip(boxes, track_ids) :
+                box.track_id = int(track_id)
+        metric_dict.clear()
+        metric_dict.update(tracker.counters(counter_mode))
+        return metric_dict
+
+    labels = boxes.labels.tolist() if isinstance(boxes, BoxArray) else [box.label for box in boxes]
+    for label in labels :
+        # Running counts
+        metric_dict[label]+=1
+
+    return metric_dict
+
+
+# This Function draws a nice looking bounding box ...
+def draw_annotated_dot(img, box, color_bgr) :
+    cv2.circle(img, box.center(), 6,  color_bgr, thickness=-1, lineType=8, shift=0)
+    return img
+
+def draw_annotated_box(img, box, color_bgr, mode="all") :
+    cv2.rectangle(img, box.ulc(), box.lrc(), color_bgr, 1 )
+
+    cv2.rectangle(img, box.ulc(yoff=-20), box.urc(), color_bgr, -1 ,)
+
+    cv2.circle(img, box.center(), 6,  color_bgr, thickness=-1, lineType=8, shift=0)
+
+    # Add a better looking font
+    # cv2 use bgr, pil uses rgb!
+    modified_img = img
+    ft = cv2.FONT_HERSHEY_COMPLEX_SMALL
+    COLOR_BLACK=(0,0,0)   # Make the text of the labels and the title white
+
+    sz = 0.35
+    # Draw Header ...
+    txt_y_off = 30
+    label = box.label if box.track_id == None else "{} {}".format(box.label, box.track_id)
+    cv2.putText(img, label, box.ulc(yoff=-10,xoff=4), ft, sz, COLOR_BLACK, 1, cv2.LINE_AA)
+
+    return modified_img
+
+
+def draw_annotated_boxes(img, boxes, colors_bgr) :
+    # draw_annotated_box for all the boxes of a frame, corners worked out for every box at once
+    boxes = BoxArray.from_boxes(boxes)
+    ulc = boxes.ulc().tolist()
+    lrc = boxes.lrc().tolist()
+    hdr_ulc = boxes.ulc(yoff=-20).tolist()
+    urc = boxes.urc().tolist()
+    cent = boxes.center().tolist()
+    txt = boxes.ulc(yoff=-10,xoff=4).tolist()
+    labels = boxes.labels.tolist()
+    track_ids = boxes.track_ids.tolist()
+
+    ft = cv2.FONT_HERSHEY_COMPLEX_SMALL
+    COLOR_BLACK=(0,0,0)
+    sz = 0.35
+    for i in range(len(labels)) :
+        color_bgr = colors_bgr[i]
+        cv2.rectangle(img, tuple(ulc[i]), tuple(lrc[i]), color_bgr, 1 )
+        cv2.rectangle(img, tuple(hdr_ulc[i]), tuple(urc[i]), color_bgr, -1 ,)
+        cv2.circle(img, tuple(cent[i]), 6,  color_bgr, thickness=-1, lineType=8, shift=0)
+        label = labels[i] if track_ids[i] < 0 else "{} {}".format(labels[i], track_ids[i])
+        cv2.putText(img, label, tuple(txt[i]), ft, sz, COLOR_BLACK, 1, cv2.LINE_AA)
+
+    return img
+
+
+
+
+
+# This Function will parse a counter dictionary and draw a nice box in upper left hand corner
+# counter_mode = ["counts" | "screen_time" | "unique" | "dwell" | "visible"]
+def draw_counter_box(img, counter_title, counter_dict, color_dict, counter_mode="counts", fps=30 ) :
+    # This is the location on the screen where the ad times will go - if you want to move it to the right increase the AD_START_X
+    num_counters = len(counter_dict)
+    sorted_counter_dict = sorted(counter_dict.items(), key=lambda kv: kv[1])
+    sorted_counter_dict.reverse()
+
+    if(len(sorted_counter_dict) > 0) :
+        # Start at (25,25) for ulc, and scale accordingly for counters ....
+        box_length = 300
+        y_offset = 90
+        x_offset = 25
+        overlay_box = Box('none', x_offset,y_offset,x_offset+box_length, y_offset+65+num_counters*25,1.0)
+
+        AD_BOX_COLOR=(180,160,160)  # Make the ad timing box grey
+        COLOR_WHITE=(255,255,255)   # Make the text of the labels and the title white
+
+        # Shade Counter Box, only its pixels are blended
+        blend_rect(img, overlay_box.ulc(sf=1.0), overlay_box.lrc(sf=1.0), AD_BOX_COLOR, 0.6)
+
+        ft = cv2.FONT_HERSHEY_SIMPLEX
+        sz = 0.7
+        # Draw Header ...
+        txt_y_off = 30
+
+        #Draw Counters
+        i=1
+        sz = 0.6
+
+        # text is drawn from cached layers (ivi_render.draw_text), only new values get rendered
+        draw_text(img, counter_title, overlay_box.ulc(sf=1.0,xoff=10,yoff=txt_y_off), ft, sz, COLOR_WHITE,2)
+
+        for (k,v ) in sorted_counter_dict:
+            col = color_dict[k] if k in color_dict else (255,255,255)
+            if(counter_mode in ["counts", "unique", "visible"]) :
+                txt1 = "{:<20s} ".format(k )
+                txt2 = ": {}".format(counter_dict[k])
+            elif(counter_mode in ["screen_time", "dwell"]):
+                stime = float(counter_dict[k]) / float(fps)
+                #txt = "{:<20s} : {:.2f} (s)".format(k, stime )
+                txt1 = "{:<20s} ".format(k )
+                txt2 = ": {:.2f} (s)".format(stime )
+            else :
+                nprint("Error, incorrect mode specified for counter box")
+                continue
+            draw_text(img, txt1, overlay_box.ulc(sf=1.0,xoff=10,yoff=txt_y_off+25*i), ft, sz, col,2)
+            draw_text(img, txt2, overlay_box.ulc(sf=1.0,xoff=170,yoff=txt_y_off+25*i), ft, sz, col,2)
+            i += 1
+
+    return img
+
+
+# This Function will parse a counter dictionary and draw a nice box in upper left hand corner
+def draw_text_box(img, box_title, box_text_list ) :
+    # This is the location on the screen where the ad times will go - if you want to move it to the right increase the AD_START_X
+    
+    # Start at (25,25) for ulc, and scale accordingly for counters ....
+    box_length = 400
+    # 25 pixels per text row ..
+    overlay_box = Box('none', 25,25,25+box_length, 100+len(box_text_list)*25,1.0)
+
+    AD_BOX_COLOR=(180,160,160)  # Make the ad timing box grey
+    COLOR_WHITE=(255,255,255)   # Make the text of the labels and the title white
+
+    # Shade Counter Box, only its pixels are blended
+    blend_rect(img, overlay_box.ulc(sf=1.0), overlay_box.lrc(sf=1.0), AD_BOX_COLOR, 0.7)
+
+    ft = cv2.FONT_HERSHEY_SIMPLEX
+    sz = 0.6
+    # Draw Header ...
+    txt_y_off = 30
+    draw_text(img, box_title, overlay_box.ulc(sf=1.0,xoff=10,yoff=txt_y_off), ft, sz, COLOR_WHITE,2)
+
+    #Draw Counters
+    i=1
+    sz = 0.6
+    
+    col = (255,255,255)
+    for i in range(len(box_text_list)) :
+        row = i + 1
+        box_text = box_text_list[i]
+        draw_text(img, box_text, overlay_box.ulc(sf=1.0,xoff=10,yoff=txt_y_off+25*row), ft, sz, col ,2)
+        
+
+    return img
+
+# This Function will parse a counter dictionary and draw a nice box in upper left hand corner
+def add_image_thumbnail(img, img_thumbnail, overlay_dimensions_xy=(400,200), ) :
+    # img_thumbnail is read and resized once (ivi_render.thumbnail) and copied into the lower left corner,
+    # with the 25 pixels under it blacked out
+    overlay1 = thumbnail(img_thumbnail, overlay_dimensions_xy)
+    (y,x,c) = img.shape
+    (yo,xo,co) =overlay1.shape
+
+    xpad = 25
+    ypad = 25
+    img[y-yo-ypad:,xpad:xo+xpad,:] = 0
+    img[y-yo-ypad:y-ypad,xpad:xo+xpad,:] = overlay1
+
+    return img
@@ -0,0 +1,343 @@
+# ivi_watch.py
+
+# Incremental scoring of a directory that keeps receiving images (e.g. a share field teams drop inspection
+# images into all day).  Each poll only lists the directory (names, sizes and mtimes, no image is opened) and
+# compares it with the (size, mtime) index of what was scored, so only new or changed images are decoded and
+# scored.  Results are appended to a json lines store, which rebuilds the index when the watcher restarts, and
+# the metrics are updated from the new results alone : running totals over every image plus a rolling window
+# of the latest ones, written to a report after each poll that scored something.
+import cv2
+import json
+import os
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from ivi_autotune import tuned_setting
+from ivi_common import nprint, _parse_paiv_xml, get_np_hash
+from ivi_scoring import get_json_from_paiv
+
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png"]
+
+
+def scan_directory(image_dir, extensions=IMAGE_EXTENSIONS + [".xml"]) :
+    '''
+    (size, mtime) of the files of a directory, from the directory entries only
+    returns : dict file name -> (size, mtime_ns)
+    '''
+    rv = {}
+    with os.scandir(image_dir) as it :
+        for entry in it :
+            if(os.path.splitext(entry.name)[1].lower() in extensions and entry.is_file()) :
+                st = entry.stat()
+                rv[entry.name] = (st.st_size, st.st_mtime_ns)
+    return rv
+
+
+class ResultsStore():
+    '''
+    Append only json lines file of scoring results, one record per scored (or removed) image :
+    {'file', 'size', 'mtime', 'md5', 'time', 'result'} or {'file', 'removed' : True}.
+    The latest record of a file wins, so the store can be replayed to rebuild the index
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def records(self) :
+        # latest record of each file, in the order they were written
+        rv = {}
+        if(os.path.isfile(self.path)) :
+            for line in open(self.path) :
+                line = line.strip()
+                if(len(line) == 0) :
+                    continue
+                try :
+                    record = json.loads(line)
+                except ValueError :
+                    # a line cut short by a crash
+                    continue
+                rv.pop(record['file'], None)
+                if(not record.get('removed', False)) :
+                    rv[record['file']] = record
+        return rv
+
+    def append(self, records) :
+        if(self.f == None) :
+            self.f = open(self.path, 'a')
+        for record in records :
+            self.f.write(json.dumps(record) + "\n")
+        self.f.flush()
+
+    def close(self) :
+        if(self.f != None) :
+            self.f.close()
+            self.f = None
+
+
+def image_summary(json_rv, truth=None, validate_mode="object") :
+    '''
+    What one result adds to the metrics
+    truth : ground truth labels of the image (list, object mode) or class (classification), None if unlabeled
+    returns : {'boxes' : {label : n}, 'confidence' : {label : sum}, 'match' : {class : [tp, fp, fn]} or None}
+    '''
+    if(validate_mode == "object") :
+        detections = [(b['label'], float(b['confidence'])) for b in json_rv['classified']]
+    else :
+        detections = [(label, float(conf)) for (label, conf) in list(json_rv['classified'].items())[:1]]
+    boxes = defaultdict(int)
+    confidence = defaultdict(float)
+    for (label, conf) in detections :
+        boxes[label] += 1
+        confidence[label] += conf
+    match = None
+    if(truth != None) :
+        from ivi_validate import return_ytrue_ypre_objdet
+        if(validate_mode == "object") :
+            (ytrue, ypred) = return_ytrue_ypre_objdet([{'label' : t} for t in truth], [{'label' : l} for (l, c) in detections])
+        else :
+            (ytrue, ypred) = ([truth], [detections[0][0] if len(detections) > 0 else "null"])
+        match = defaultdict(lambda : [0, 0, 0])
+        for (t, p) in zip(ytrue, ypred) :
+            if(t == p) :
+                match[t][0] += 1
+                continue
+            if(p != "null") :
+                match[p][1] += 1
+            if(t != "null") :
+                match[t][2] += 1
+        match = dict(match)
+    return {'boxes' : dict(boxes), 'confidence' : dict(confidence), 'match' : match}
+
+
+class _Totals():
+    # sums of image summaries, summaries can be added and taken back out
+    def __init__(self):
+        self.images = 0
+        self.labeled = 0
+        self.boxes = defaultdict(int)
+        self.confidence = defaultdict(float)
+        self.match = defaultdict(lambda : [0, 0, 0])
+
+    def add(self, summary, sign=1) :
+        self.images += sign
+        for (label, n) in summary['boxes'].items() :
+            self.boxes[label] += sign * n
+            self.confidence[label] += sign * summary['confidence'][label]
+        if(summary['match'] != None) :
+            self.labeled += sign
+            for (c, counts) in summary['match'].items() :
+                for i in range(3) :
+                    self.match[c][i] += sign * counts[i]
+
+    def report(self) :
+        per_label = {}
+        for label in sorted(self.boxes) :
+            if(self.boxes[label] > 0) :
+                per_label[label] = {'boxes' : self.boxes[label], 'mean_confidence' : self.confidence[label] / self.boxes[label]}
+        per_class = {}
+        for c in sorted(self.match) :
+            (tp, fp, fn) = self.match[c]
+            if(tp + fp + fn > 0) :
+                per_class[c] = {'tp' : tp, 'fp' : fp, 'fn' : fn,
+                                'precision' : tp / float(tp + fp) if tp + fp > 0 else 0.0,
+                                'recall' : tp / float(tp + fn) if tp + fn > 0 else 0.0}
+        return {'images' : self.images, 'labeled_images' : self.labeled, 'per_label' : per_label, 'per_class' : per_class}
+
+
+class RollingMetrics():
+    '''
+    Metrics kept up to date one image at a time : totals over the current result of every image (a re-scored
+    image replaces its old result, a removed one is taken out) and over the last window results scored
+    update(key, summary), remove(key), report() -> dict
+    '''
+    def __init__(self, window=500):
+        self.window = window
+        self.current = {}
+        self.totals = _Totals()
+        self.recent = deque()
+        self.recent_totals = _Totals()
+
+    def update(self, key, summary, recent=True) :
+        self.remove(key)
+        self.current[key] = summary
+        self.totals.add(summary)
+        if(recent) :
+            self.recent.append(summary)
+            self.recent_totals.add(summary)
+            if(len(self.recent) > self.window) :
+                self.recent_totals.add(self.recent.popleft(), -1)
+
+    def remove(self, key) :
+        if(key in self.current) :
+            self.totals.add(self.current.pop(key), -1)
+
+    def report(self) :
+        return {'totals' : self.totals.report(), 'window' : dict(self.recent_totals.report(), size=self.window)}
+
+
+class FolderWatcher():
+    '''
+    Score the images arriving in a directory, incrementally
+    paiv_url      : deployed model url
+    image_dir     : directory to watch (not recursive)
+    store_dir     : results.jsonl (ResultsStore) and report.json are kept here
+    validate_mode : "object" | "classification", how results are summarized.  Object mode images with a
+                    <name>.xml next to them (exported dataset layout) are matched against it, and an xml that
+                    shows up or changes later re-matches the stored result without scoring the image again
+    num_threads   : concurrent api requests, default the autotuned setting of paiv_url (ivi_autotune) or 2
+    settle_secs   : only pick up files not modified for this long, so files still being copied are left for the next poll
+    window        : rolling metrics over this many latest results
+    postprocess   : optional ivi_boxes.PostProcessor applied before the metrics (the store keeps the raw results)
+    poll() runs one cycle, run() polls until stopped
+    '''
+    def __init__(self, paiv_url, image_dir, store_dir, validate_mode="object", num_threads=None, settle_secs=2.0,
+                 window=500, postprocess=None):
+        self.paiv_url = paiv_url
+        self.image_dir = image_dir
+        self.store_dir = store_dir
+        self.validate_mode = validate_mode
+        self.num_threads = num_threads if num_threads != None else tuned_setting(paiv_url, 'num_threads', 2)
+        self.settle_secs = settle_secs
+        self.postprocess = postprocess
+        self.metrics = RollingMetrics(window)
+        self.cycles = 0
+        self.errors = 0
+
+        if(not os.path.exists(store_dir)) :
+            os.makedirs(store_dir)
+        self.store = ResultsStore(os.path.join(store_dir, "results.jsonl"))
+        self.report_fn = os.path.join(store_dir, "report.json")
+        self.results = self.store.records()
+        self.truth_index = scan_directory(image_dir, [".xml"]) if os.path.isdir(image_dir) else {}
+        self.index = {name : (r['size'], r['mtime']) for (name, r) in self.results.items()}
+        for (name, record) in self.results.items() :
+            self.metrics.update(name, self._summary(name, record['result']), recent=False)
+        nprint("Watching {} : {} results in {}".format(image_dir, len(self.results), self.store.path))
+
+    def _truth(self, name) :
+        # ground truth of an image, None if it is not labeled
+        if(self.validate_mode != "object") :
+            return None
+        xml_fn = os.path.join(self.image_dir, os.path.splitext(name)[0] + ".xml")
+        if(not os.path.isfile(xml_fn)) :
+            return None
+        try :
+            return [b['label'] for b in _parse_paiv_xml(xml_fn)]
+        except Exception as e :
+            nprint("Error : could not parse {} : {}".format(xml_fn, e))
+            return None
+
+    def _summary(self, name, json_rv) :
+        if(self.postprocess != None) :
+            json_rv = self.postprocess.apply_json(json_rv)
+        return image_summary(json_rv, self._truth(name), self.validate_mode)
+
+    def _score(self, name, stat, thr_id) :
+        # decode once, hash and score.  returns the store record, None if the image could not be read or scored
+        img = cv2.imread(os.path.join(self.image_dir, name))
+        if(img is None) :
+            nprint("Error : could not read {}".format(name))
+            return None
+        json_rv = get_json_from_paiv(self.paiv_url, img, name, thr_id)
+        if(json_rv == None or 'classified' not in json_rv) :
+            nprint("Error : no result for {} : {}".format(name, json_rv))
+            return None
+        return {'file' : name, 'size' : stat[0], 'mtime' : stat[1], 'md5' : get_np_hash(img), 'time' : time.time(), 'result' : json_rv}
+
+    def poll(self) :
+        '''
+        One cycle : score new and changed images, drop removed ones, update the metrics and the report
+        returns : dict with the number of new, changed, removed, scored and failed images
+        '''
+        entries = scan_directory(self.image_dir)
+        settled = time.time_ns() - int(self.settle_secs * 1e9)
+        todo = []
+        stats = {'new' : 0, 'changed' : 0, 'removed' : 0, 'scored' : 0, 'failed' : 0}
+        for (name, stat) in entries.items() :
+            if(name.endswith(".xml") or self.index.get(name) == stat or stat[1] > settled) :
+                continue
+            stats['changed' if name in self.index else 'new'] += 1
+            todo.append((name, stat))
+        removed = [name for name in self.index if name not in entries]
+
+        # labels that arrived or changed after their image was scored
+        xml_entries = {name : stat for (name, stat) in entries.items() if name.endswith(".xml")}
+        relabeled = []
+        for (name, stat) in xml_entries.items() :
+            if(self.truth_index.get(name) != stat) :
+                self.truth_index[name] = stat
+                relabeled.append(name)
+        for name in [n for n in self.truth_index if n not in xml_entries] :
+            del self.truth_index[name]
+            relabeled.append(name)
+
+        records = []
+        if(len(todo) > 0) :
+            with ThreadPoolExecutor(max_workers=self.num_threads) as pool :
+                futures = [pool.submit(self._score, name, stat, i % self.num_threads) for (i, (name, stat)) in enumerate(todo)]
+                records = [f.result() for f in futures]
+        scored = [r for r in records if r != None]
+        stats['scored'] = len(scored)
+        stats['failed'] = len(records) - len(scored)
+        stats['removed'] = len(removed)
+        self.errors += stats['failed']
+
+        # failed images stay out of the index, so they are retried next cycle
+        self.store.append(scored + [{'file' : name, 'removed' : True} for name in removed])
+        for record in scored :
+            self.results[record['file']] = record
+            self.index[record['file']] = (record['size'], record['mtime'])
+            self.metrics.update(record['file'], self._summary(record['file'], record['result']))
+        for name in removed :
+            del self.index[name]
+            del self.results[name]
+            self.metrics.remove(name)
+        done = set(r['file'] for r in scored)
+        for xml_name in relabeled :
+            base = os.path.splitext(xml_name)[0]
+            for ext in IMAGE_EXTENSIONS + [e.upper() for e in IMAGE_EXTENSIONS] :
+                name = base + ext
+                if(name in self.results and name not in done) :
+                    self.metrics.update(name, self._summary(name, self.results[name]['result']), recent=False)
+
+        self.cycles += 1
+        if(len(scored) + len(removed) > 0 or (self.cycles == 1) or len(relabeled) > 0) :
+            self.write_report(stats)
+        if(len(todo) + len(removed) > 0) :
+            nprint("Poll {} : {} new, {} changed, {} removed, scored {}, failed {}, {} images".format(self.cycles,
+                stats['new'], stats['changed'], stats['removed'], stats['scored'], stats['failed'], len(self.results)))
+        return stats
+
+    def write_report(self, stats=None) :
+        report = dict(self.metrics.report(), cycles=self.cycles, failed=self.errors, last_poll=stats, updated=time.time())
+        # written next to the report and moved over it, so a reader never sees half a report
+        tmp_fn = self.report_fn + ".tmp"
+        f = open(tmp_fn, 'w')
+        f.write(json.dumps(report, indent=2))
+        f.close()
+        os.replace(tmp_fn, self.report_fn)
+        return report
+
+    def write_fetch_scores(self, paiv_results_file="fetch_scores.json") :
+        # the stored results in the fetch_scores image mode format (keyed by pixel md5), for ivi_validate.validate_model
+        f = open(paiv_results_file, 'w')
+        f.write(json.dumps({r['md5'] : r['result'] for r in self.results.values()}))
+        f.close()
+
+    def run(self, poll_secs=10.0, max_polls=None) :
+        '''
+        Poll every poll_secs seconds (less the time the poll took) until interrupted or max_polls polls
+        returns : number of polls
+        '''
+        try :
+            while(max_polls == None or self.cycles < max_polls) :
+                start = time.time()
+                self.poll()
+                if(max_polls != None and self.cycles >= max_polls) :
+                    break
+                time.sleep(max(poll_secs - (time.time() - start), 0.0))
+        except KeyboardInterrupt :
+            nprint("Stopped after {} polls".format(self.cycles))
+        finally :
+            self.store.close()
+        return self.cycles
@@ -0,0 +1,90 @@
+# ivi_writer.py
+
+# Video writer backends for the annotated output.  Both take bgr frames (as read by cv2) in order :
+#   cv2    : cv2.VideoWriter, mp4v by default.  No extra dependency
+#   ffmpeg : raw frames piped into a local ffmpeg process, H.264 / H.265 with presets, CRF, threads
+#            and optionally the audio track copied from the source video
+# Use open_video_writer to pick one by name.
+import cv2
+import shutil
+import subprocess
+from ivi_common import nprint
+
+# codec name -> ffmpeg encoder
+FFMPEG_CODECS = {'h264' : 'libx264', 'h265' : 'libx265'}
+
+
+class Cv2Writer():
+    '''
+    cv2.VideoWriter backend
+    output_path : output file
+    fps, size   : frame rate and (width, height) of the frames
+    fourcc      : 4 character codec code
+    '''
+    def __init__(self, output_path, fps, size, fourcc="mp4v"):
+        self.output_path = output_path
+        self.writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*fourcc), fps, size, True)
+
+    def write(self, frame) :
+        self.writer.write(frame)
+
+    def release(self) :
+        self.writer.release()
+
+
+class FfmpegWriter():
+    '''
+    Pipes raw bgr frames into ffmpeg, which does the encoding (multi threaded) in its own process
+    output_path  : output file, the container follows the extension (.mp4, .mov, .mkv ...)
+    fps, size    : frame rate and (width, height) of the frames
+    codec        : 'h264' | 'h265' (or any ffmpeg encoder name)
+    preset       : encoder preset, ultrafast ... veryslow.  Faster presets give bigger files
+    crf          : constant rate factor, lower is better quality (h264 default 23, h265 default 28)
+    threads      : encoder threads, 0 lets ffmpeg pick
+    audio_source : copy the audio track of this file into the output (the frames should cover the whole source)
+    ffmpeg_bin   : ffmpeg executable
+    '''
+    def __init__(self, output_path, fps, size, codec="h264", preset="veryfast", crf=None, threads=0, audio_source=None, ffmpeg_bin="ffmpeg"):
+        if(shutil.which(ffmpeg_bin) == None) :
+            raise RuntimeError("ffmpeg writer : {} not found on the path".format(ffmpeg_bin))
+        self.output_path = output_path
+        encoder = FFMPEG_CODECS.get(codec, codec)
+
+        cmd = [ffmpeg_bin, "-y", "-loglevel", "error",
+               "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", "{}x{}".format(size[0], size[1]), "-r", str(fps), "-i", "-"]
+        if(audio_source != None) :
+            cmd += ["-i", audio_source, "-map", "0:v:0", "-map", "1:a?", "-c:a", "copy", "-shortest"]
+        cmd += ["-c:v", encoder, "-preset", preset, "-pix_fmt", "yuv420p", "-threads", str(threads)]
+        if(crf != None) :
+            cmd += ["-crf", str(crf)]
+        if(encoder == "libx265") :
+            # play in quicktime / browsers
+            cmd += ["-tag:v", "hvc1"]
+        cmd += [output_path]
+
+        nprint("Encoding with : {}".format(" ".join(cmd)))
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def write(self, frame) :
+        self.proc.stdin.write(frame.tobytes())
+
+    def release(self) :
+        self.proc.stdin.close()
+        rv = self.proc.wait()
+        if(rv != 0) :
+            raise RuntimeError("ffmpeg writer : ffmpeg exited with {} writing {}".format(rv, self.output_path))
+
+
+WRITER_BACKENDS = {'cv2' : Cv2Writer, 'ffmpeg' : FfmpegWriter}
+
+
+def open_video_writer(output_path, fps, size, backend="cv2", **writer_args) :
+    '''
+    Open a video writer
+    backend     : 'cv2' | 'ffmpeg'
+    writer_args : passed on to the backend (e.g. codec, preset, crf, threads, audio_source for ffmpeg)
+    returns : writer with write(frame) and release()
+    '''
+    if(backend not in WRITER_BACKENDS) :
+        raise ValueError("unknown video writer backend {}, use one of {}".format(backend, list(WRITER_BACKENDS.keys())))
+    return WRITER_BACKENDS[backend](output_path, fps, size, **writer_args)
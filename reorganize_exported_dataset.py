@@ -2,7 +2,6 @@
 # import paiv_utils as paiv
 import argparse as ap
 import json
-import pandas as pd
 import pathlib
 import shutil
 
@@ -39,7 +38,8 @@ def reformat_paiv_cls_export(directory_in:str, directory_out:str="/tmp/output")
     returns : 0 pass, 1 fail
     side effect : new subdirectories get written under directory_out using class name from prop.json
     '''
-     
+    import pandas as pd
+
     with open(directory_in + '/prop.json') as json_file:
         data = json.load(json_file)
         df = pd.read_json(data['file_prop_info'], orient='records').set_index("_id")
@@ -1,9 +1,7 @@
-import numpy as np 
-import cv2
 import os.path
 import sys
 import glob
-import paiv_utils as paiv
+import ivi_utils as paiv
 import hashlib
 import time
 import json
@@ -22,6 +20,7 @@ def nprint(mystring) :
 
 # Helpers ...
 def plot_image(img, pause=0):
+    import cv2
     cv2.imshow('frame', img)
     cv2.waitKey(pause) # if pause = 0, then hit escape ... else pause in ms
     cv2.destroyAllWindows()
@@ -55,15 +54,71 @@ def _parser():
              'Default: %(default)s')
 
     parser.add_argument(
-        '--model_url', action='store', nargs='?',
+        '--model_url', action='store', nargs='+',
         required=True,
-        help='S|--model_url=<deployed model endpoint>')
+        help='S|--model_url=<deployed model endpoint> [<second endpoint> ...]\n'
+             'With more than one url the models are scored side by side\n'
+             'and a comparison report is written to compare_report.json')
 
     parser.add_argument(
         '--data_directory', action='store', nargs='?',
         required=True,
         help='S|--data_directory=<location of exported PAIV dataset>')
 
+    parser.add_argument(
+        '--bootstrap_samples', type=int, default=1000, required=False,
+        help='S|Number of bootstrap resamples for confidence intervals.  0 disables.  '
+             'Default: %(default)s')
+
+    parser.add_argument(
+        '--num_procs', type=int, default=1, required=False,
+        help='S|Number of processes used to compute the bootstrap.  '
+             'Default: %(default)s')
+
+    parser.add_argument(
+        '--min_confidence', type=float, default=None, required=False,
+        help='S|Object mode, drop predicted boxes below this confidence.  Default: keep all')
+
+    parser.add_argument(
+        '--class_thresholds', type=str, default=None, required=False,
+        help='S|Object mode, per label confidence thresholds as json, e.g. \'{"cat" : 0.6, "dog" : 0.4}\'')
+
+    parser.add_argument(
+        '--nms_iou', type=float, default=None, required=False,
+        help='S|Object mode, merge overlapping predicted boxes of a label above this IoU (class wise NMS).  Default: no NMS')
+
+    parser.add_argument(
+        '--top_k', type=int, default=None, required=False,
+        help='S|Object mode, keep at most top_k predicted boxes per label.  Default: all')
+
+    parser.add_argument(
+        '--dedupe_distance', type=int, default=None, required=False,
+        help='S|Skip near duplicate images (perceptual hash within this Hamming distance, e.g. 4) before scoring,\n'
+             'so augmented copies are not scored and validated twice.  Default: score every image')
+
+    parser.add_argument(
+        '--watch', dest='watch', action='store_true',
+        help='S|--watch : keep polling --data_directory and only score the images that are new or changed since\n'
+             'the last poll.  Results are appended to --store_directory/results.jsonl and the rolling metrics to\n'
+             '--store_directory/report.json.  Runs until interrupted')
+    parser.set_defaults(watch=False)
+
+    parser.add_argument(
+        '--poll_secs', type=float, default=10.0, required=False,
+        help='S|Watch mode, seconds between polls.  Default: %(default)s')
+
+    parser.add_argument(
+        '--settle_secs', type=float, default=2.0, required=False,
+        help='S|Watch mode, only score files not modified for this many seconds (still being copied).  Default: %(default)s')
+
+    parser.add_argument(
+        '--store_directory', action='store', nargs='?', required=False, default="watch_store",
+        help='S|Watch mode, directory for the results store and report.  Default: %(default)s')
+
+    parser.add_argument(
+        '--plot_fn', action='store', nargs='?', required=False, default=None,
+        help='S|--plot_fn=<image file to save the confusion matrix plot to>.  No plot by default')
+
     #parser.add_argument(
     #    '--batch_size', type=int, default=64,
     #    help='S|Batch size. Default: %(default)s')
@@ -124,8 +179,26 @@ def main():
     #paiv.fetch_scores(paiv_url=TRAINED_MODEL_EP, validate_mode=args.validate_mode, media_mode="image", image_dir=DATASET_DIR, paiv_results_file="fetch_scores.json")
     #paiv_dict = paiv.validate_model(paiv_results_file="fetch_scores.json",  image_dir=DATASET_DIR, validate_mode=args.validate_mode)#
 
-    paiv.fetch_scores(paiv_url=args.model_url, validate_mode=args.validate_mode, media_mode="image", image_dir=args.data_directory , paiv_results_file="fetch_scores.json")
-    paiv_dict = paiv.validate_model(paiv_results_file="fetch_scores.json",  image_dir=args.data_directory, validate_mode=args.validate_mode)#
+    postprocess = None
+    if(args.min_confidence != None or args.class_thresholds != None or args.nms_iou != None or args.top_k != None) :
+        postprocess = paiv.PostProcessor(min_confidence=args.min_confidence, iou_threshold=args.nms_iou, top_k=args.top_k,
+                                         class_thresholds=None if args.class_thresholds == None else json.loads(args.class_thresholds))
+
+    if(args.watch) :
+        watcher = paiv.FolderWatcher(args.model_url[0], args.data_directory, args.store_directory, validate_mode=args.validate_mode,
+                                     settle_secs=args.settle_secs, postprocess=postprocess)
+        watcher.run(poll_secs=args.poll_secs)
+        return
+    if(len(args.model_url) > 1) :
+        paiv.fetch_scores_multi(paiv_urls=args.model_url, validate_mode=args.validate_mode, image_dir=args.data_directory, paiv_results_file="compare_scores.json")
+        paiv.compare_models(paiv_results_file="compare_scores.json", image_dir=args.data_directory, validate_mode=args.validate_mode, report_fn="compare_report.json",
+                            postprocess=postprocess)
+        return
+
+    paiv.fetch_scores(paiv_url=args.model_url[0], validate_mode=args.validate_mode, media_mode="image", image_dir=args.data_directory , paiv_results_file="fetch_scores.json",
+                      dedupe_distance=args.dedupe_distance)
+    paiv_dict = paiv.validate_model(paiv_results_file="fetch_scores.json",  image_dir=args.data_directory, validate_mode=args.validate_mode, num_resamples=args.bootstrap_samples, num_procs=args.num_procs, plot_fn=args.plot_fn,
+                                    postprocess=postprocess)
 
 
     # 2.  foreach file, hit api and score keep resutl
@@ -0,0 +1,134 @@
+import ivi_utils as paiv
+import argparse as ap
+
+class SmartFormatterMixin(ap.HelpFormatter):
+    # ref:
+    # http://stackoverflow.com/questions/3853722/python-argparse-how-to-insert-newline-in-the-help-text
+    # @IgnorePep8
+
+    def _split_lines(self, text, width):
+        # this is the RawTextHelpFormatter._split_lines
+        if text.startswith('S|'):
+            return text[2:].splitlines()
+        return ap.HelpFormatter._split_lines(self, text, width)
+
+
+class CustomFormatter(ap.RawDescriptionHelpFormatter, SmartFormatterMixin):
+    '''Convenience formatter_class for argparse help print out.'''
+
+
+def _parser():
+    parser = ap.ArgumentParser(description='Tool to run large scoring backfills through a durable work queue (a SQLite file) '
+                                           'shared by any number of worker processes, on one or several hosts '
+                                           '  python score_jobs.py --action=plan --queue=/shared/backfill.db --job=march --model_url=https://... --input_video /shared/videos/*.mp4 '
+                                           '  python score_jobs.py --action=work --queue=/shared/backfill.db --num_procs=4 '
+                                           '  python score_jobs.py --action=merge --queue=/shared/backfill.db --job=march --output_directory=/shared/out',
+                               formatter_class=CustomFormatter)
+
+    parser.add_argument(
+        '--action', action='store', nargs='?', type=str.lower, required=True,
+        choices=['plan', 'work', 'status', 'merge', 'retry'],
+        help='S|plan   : enqueue the work items of a job\n'
+             'work   : lease and score items until the queue is empty (--wait : keep polling)\n'
+             'status : item counts per state\n'
+             'merge  : build the results caches / fetch_scores json of a job\n'
+             'retry  : put the failed items of a job back in the queue')
+
+    parser.add_argument(
+        '--queue', action='store', nargs='?', required=True,
+        help='S|--queue=<SQLite queue file>, on a filesystem all the workers share')
+
+    parser.add_argument(
+        '--job', action='store', nargs='?', required=False, default=None,
+        help='S|--job=<job name>, required for plan and merge')
+
+    parser.add_argument(
+        '--model_url', action='store', nargs='?', required=False, default=None,
+        help='S|--model_url=<deployed model endpoint>, required for plan')
+
+    parser.add_argument(
+        '--input_video', action='store', nargs='+', required=False, default=[],
+        help='S|Videos to score (plan)')
+
+    parser.add_argument(
+        '--data_directory', action='store', nargs='?', required=False, default=None,
+        help='S|--data_directory=<exported dataset to score> (plan)')
+
+    parser.add_argument(
+        '--validate_mode', action='store', nargs='?', type=str.lower, required=False, default="object",
+        choices=['object', 'classification'],
+        help='S|Dataset layout of --data_directory.  Default: %(default)s')
+
+    parser.add_argument(
+        '--sample_rate', type=int, default=1, required=False,
+        help='S|Score every sample_rate\'th frame of the videos.  Default: %(default)s')
+
+    parser.add_argument(
+        '--chunk_frames', type=int, default=3000, required=False,
+        help='S|Frames of a video per work item.  Default: %(default)s')
+
+    parser.add_argument(
+        '--chunk_images', type=int, default=200, required=False,
+        help='S|Images per work item.  Default: %(default)s')
+
+    parser.add_argument(
+        '--num_procs', type=int, default=1, required=False,
+        help='S|Worker processes on this host (work).  Default: %(default)s')
+
+    parser.add_argument(
+        '--num_threads', type=int, default=4, required=False,
+        help='S|Concurrent api requests per worker process.  Default: %(default)s')
+
+    parser.add_argument(
+        '--lease_secs', type=float, default=300, required=False,
+        help='S|An item is handed to another worker if its worker stops renewing the lease for this long.  Default: %(default)s')
+
+    parser.add_argument(
+        '--wait', dest='wait', action='store_true',
+        help='S|--wait : workers keep polling for new items instead of exiting when the queue is empty')
+    parser.set_defaults(wait=False)
+
+    parser.add_argument(
+        '--output_directory', action='store', nargs='?', required=False, default=".",
+        help='S|--output_directory=<where merge writes the results>.  Default: %(default)s')
+
+    args = parser.parse_args()
+
+    return args
+
+
+def main():
+    # Parse command line argument
+    args = _parser()
+    for argk in vars(args) :
+        paiv.nprint("{} {}".format(argk,vars(args)[argk]))
+
+    if(args.action == "plan") :
+        if(args.job == None or args.model_url == None) :
+            paiv.nprint("Error : plan needs --job and --model_url")
+            return
+        queue = paiv.WorkQueue(args.queue)
+        if(len(args.input_video) > 0) :
+            paiv.plan_videos(queue, args.job, args.input_video, args.model_url, sample_rate=args.sample_rate, chunk_frames=args.chunk_frames)
+        if(args.data_directory != None) :
+            paiv.plan_images(queue, args.job, args.data_directory, args.model_url, validate_mode=args.validate_mode, chunk_size=args.chunk_images)
+        queue.close()
+    elif(args.action == "work") :
+        worker_args = {'num_threads' : args.num_threads, 'lease_secs' : args.lease_secs, 'wait' : args.wait}
+        if(args.num_procs > 1) :
+            paiv.run_workers(args.queue, num_procs=args.num_procs, **worker_args)
+        else :
+            paiv.run_worker(args.queue, **worker_args)
+    elif(args.action == "merge") :
+        paiv.merge_results(args.queue, args.job, args.output_directory)
+    elif(args.action == "retry") :
+        queue = paiv.WorkQueue(args.queue)
+        paiv.nprint("{} failed items back in the queue".format(queue.retry_failed(args.job)))
+        queue.close()
+
+    queue = paiv.WorkQueue(args.queue)
+    paiv.nprint("Queue {} : {}".format(args.queue, queue.stats(args.job)))
+    queue.close()
+
+if __name__== "__main__":
+  main()
@@ -1,4 +1,3 @@
-import matplotlib.pyplot as plt
 import numpy as np
 import itertools
 
@@ -6,11 +5,17 @@ import itertools
 def plot_confusion_matrix(cm, classes,
                           normalize=False,
                           title='Confusion matrix',
-                          cmap=plt.cm.Blues):
+                          cmap='Blues',
+                          output_fn=None):
     """
     This function prints and plots the confusion matrix.
     Normalization can be applied by setting `normalize=True`.
+    The figure is rendered headless (no pyplot / display needed) and saved to
+    output_fn if given.  Returns the matplotlib Figure.
     """
+    # matplotlib is only loaded when a plot is actually asked for
+    from matplotlib.figure import Figure
+
     if normalize:
         cm = cm.astype('float') / cm.sum(axis=1)[:, np.newaxis]
         print("Normalized confusion matrix")
@@ -19,20 +24,29 @@ def plot_confusion_matrix(cm, classes,
 
     print(cm)
 
-    plt.imshow(cm, interpolation='nearest', cmap=cmap)
-    plt.title(title)
-    plt.colorbar()
+    fig = Figure()
+    ax = fig.subplots()
+    im = ax.imshow(cm, interpolation='nearest', cmap=cmap)
+    ax.set_title(title)
+    fig.colorbar(im, ax=ax)
     tick_marks = np.arange(len(classes))
-    plt.xticks(tick_marks, classes, rotation=45)
-    plt.yticks(tick_marks, classes)
+    ax.set_xticks(tick_marks)
+    ax.set_xticklabels(classes, rotation=45)
+    ax.set_yticks(tick_marks)
+    ax.set_yticklabels(classes)
 
     fmt = '.2f' if normalize else 'd'
     thresh = cm.max() / 2.
     for i, j in itertools.product(range(cm.shape[0]), range(cm.shape[1])):
-        plt.text(j, i, format(cm[i, j], fmt),
-                 horizontalalignment="center",
-                 color="red" if cm[i, j] > thresh else "black")
+        ax.text(j, i, format(cm[i, j], fmt),
+                horizontalalignment="center",
+                color="red" if cm[i, j] > thresh else "black")
+
+    ax.set_ylabel('True label')
+    ax.set_xlabel('Predicted label')
+    fig.tight_layout()
+
+    if output_fn is not None:
+        fig.savefig(output_fn)
 
-    plt.ylabel('True label')
-    plt.xlabel('Predicted label')
-    plt.tight_layout()
\ No newline at end of file
+    return fig
@@ -1,46 +1,72 @@
-import numpy as np 
-import glob
-import shutil
-import os
-
-print("="*90)
-print("Warning : Works for classification only for now! ")
-print("="*90)
-
-INDIR = "/data/work/osa/2018-10-PSEG/datasets/ct_97_classification_augmented_dataset"
-OUTDIR_TEST = INDIR + "-test"
-OUTDIR_TRAIN = INDIR + "-train"
-if(os.path.exists(OUTDIR_TEST)) :
-    shutil.rmtree(OUTDIR_TEST)
-if(os.path.exists(OUTDIR_TRAIN)) :
-    shutil.rmtree(OUTDIR_TRAIN)
-
-os.mkdir(OUTDIR_TEST)
-os.mkdir(OUTDIR_TRAIN)
-
-TEST_SAMPLE_PCT = 0.20
-
-files = glob.glob(INDIR + "/*.JPG")
-files = files + glob.glob(INDIR + "/*.jpg")
-files = files + glob.glob(INDIR + "/*.PNG")
-files = files + glob.glob(INDIR + "/*.png")
-print(len(files))
-
-file_range = list(range(len(files)))
-
-file_test_idx = sorted(np.random.choice(file_range, int(TEST_SAMPLE_PCT*len(files)), replace=False))
-
-j = 0
-for i in range(len(files)) :
-    # This file goes into test bucket
-    print("i {} j {} file_test_idx[j] {} ".format(i,j,file_test_idx[j]))
-    if(i == file_test_idx[j]) :
-        #copy file to test bucket
-        shutil.copy(files[i], OUTDIR_TEST + "/")
-        j += 1
-    else :
-        # copy flie to train bucket
-        shutil.copy(files[i], OUTDIR_TRAIN + "/")
-
-shutil.copy(INDIR + "/prop.json", OUTDIR_TRAIN + "/" )
-shutil.copy(INDIR + "/prop.json", OUTDIR_TEST + "/")
+import ivi_utils as paiv
+import argparse as ap
+
+class SmartFormatterMixin(ap.HelpFormatter):
+    # ref:
+    # http://stackoverflow.com/questions/3853722/python-argparse-how-to-insert-newline-in-the-help-text
+    # @IgnorePep8
+
+    def _split_lines(self, text, width):
+        # this is the RawTextHelpFormatter._split_lines
+        if text.startswith('S|'):
+            return text[2:].splitlines()
+        return ap.HelpFormatter._split_lines(self, text, width)
+
+
+class CustomFormatter(ap.RawDescriptionHelpFormatter, SmartFormatterMixin):
+    '''Convenience formatter_class for argparse help print out.'''
+
+
+def _parser():
+    parser = ap.ArgumentParser(description='Tool to split an exported dataset into train and test directories, keeping an image, its '
+                                           'augmentations and its near duplicates in the same split (no train/test leakage) '
+                                           '  python split_data_files.py --data_directory=/data/datasets/ct_97_classification_augmented_dataset',
+                               formatter_class=CustomFormatter)
+
+    parser.add_argument(
+        '--data_directory', action='store', nargs='?', required=True,
+        help='S|--data_directory=<location of exported PAIV dataset>')
+
+    parser.add_argument(
+        '--train_directory', action='store', nargs='?', required=False, default=None,
+        help='S|--train_directory=<output directory>.  Default: <data_directory>-train')
+
+    parser.add_argument(
+        '--test_directory', action='store', nargs='?', required=False, default=None,
+        help='S|--test_directory=<output directory>.  Default: <data_directory>-test')
+
+    parser.add_argument(
+        '--test_fraction', type=float, default=0.20, required=False,
+        help='S|Fraction of the images in the test split.  Default: %(default)s')
+
+    parser.add_argument(
+        '--max_distance', type=int, default=4, required=False,
+        help='S|Images whose perceptual hashes are within this Hamming distance are kept together.  -1 to only use prop.json.  Default: %(default)s')
+
+    parser.add_argument(
+        '--num_procs', type=int, default=None, required=False,
+        help='S|Processes hashing the images.  Default: one per core')
+
+    parser.add_argument(
+        '--seed', type=int, default=None, required=False,
+        help='S|Random seed for the split')
+
+    args = parser.parse_args()
+
+    return args
+
+
+def main():
+    # Parse command line argument
+    args = _parser()
+    for argk in vars(args) :
+        paiv.nprint("{} {}".format(argk,vars(args)[argk]))
+
+    data_directory = args.data_directory.rstrip("/")
+    train_directory = args.train_directory if args.train_directory != None else data_directory + "-train"
+    test_directory = args.test_directory if args.test_directory != None else data_directory + "-test"
+    paiv.split_dataset(data_directory, train_directory, test_directory, test_fraction=args.test_fraction,
+                       max_distance=None if args.max_distance < 0 else args.max_distance, num_procs=args.num_procs, seed=args.seed)
+
+if __name__== "__main__":
+  main()
@@ -0,0 +1,49 @@
+import numpy as np
+import bootstrap_utils as bu
+
+
+def _matches(num_images, seed=0) :
+    rng = np.random.default_rng(seed)
+    classes = ["a", "b", "c"]
+    matches = []
+    for i in range(num_images) :
+        ytrue = list(rng.choice(classes, 3))
+        ypred = [y if rng.random() < 0.7 else str(rng.choice(classes + ["null"])) for y in ytrue]
+        detections = [(p, float(rng.random())) for p in ypred if p != "null"] + [(str(rng.choice(classes)), float(rng.random()))]
+        matches.append({'ytrue' : ytrue, 'ypred' : ypred, 'detections' : detections})
+    return matches
+
+
+def _reference_ap(table, weights) :
+    # AP of one weight row, walking the ranked detections of each class.  The copies of a detection drawn
+    # several times are tied, they all get the precision after the last copy
+    ap = np.full(len(table.classes), np.nan)
+    npos = weights @ (table.tp + table.fn)
+    for c in range(len(table.classes)) :
+        if(npos[c] == 0) :
+            continue
+        (ntp, nall, total) = (0.0, 0.0, 0.0)
+        for d in np.flatnonzero(table.det_cls == c) :
+            wd = weights[table.det_img[d]]
+            nall += wd
+            ntp += wd * table.det_tp[d]
+            if(wd > 0 and table.det_tp[d] > 0) :
+                total += wd * ntp / nall
+        ap[c] = total / npos[c]
+    return ap
+
+
+def test_weighted_metrics_match_drawn_images() :
+    # the counts of a weight row are those of a table holding each image as many times as it was drawn
+    matches = _matches(60)
+    table = bu.build_match_table(matches)
+    w = bu._resample_weights(np.random.default_rng(1), table.num_images(), 20)
+    rv = bu._weighted_metrics(table, w)
+    for b in range(w.shape[0]) :
+        drawn = [m for (m, count) in zip(matches, w[b].astype(int)) for k in range(count)]
+        expected = bu.point_metrics(bu.build_match_table(drawn, classes=table.classes))
+        for k in ['precision', 'recall', 'accuracy'] :
+            np.testing.assert_allclose(rv[k][b], expected[k], rtol=1e-5)
+        ap = _reference_ap(table, w[b])
+        np.testing.assert_allclose(rv['ap'][b], ap, rtol=1e-5, equal_nan=True)
+        np.testing.assert_allclose(rv['map'][b], np.nanmean(ap), rtol=1e-5)
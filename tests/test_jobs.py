@@ -0,0 +1,146 @@
+import json
+import os
+import time
+import cv2
+import numpy as np
+import pytest
+import ivi_jobs
+import ivi_video
+from ivi_cache import ResultsCache, STATUS_OK
+from ivi_jobs import WorkQueue, plan_videos, run_worker, merge_results
+
+
+def _write_video(fn, num_frames, size=(64, 48)) :
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    out = cv2.VideoWriter(fn, cv2.VideoWriter_fourcc(*"mp4v"), 30, size)
+    for i in range(num_frames) :
+        out.write(np.full((size[1], size[0], 3), i % 255, dtype=np.uint8))
+    out.release()
+
+
+def _fake_score_segment(input_video, model_url, start, stop, sample_rate, num_threads, reader="cv2", reader_args={}) :
+    # same frames as ivi_video._score_segment, each result holds its frame number (xmin) and source (label)
+    label = os.path.basename(os.path.dirname(input_video))
+    return [{'result' : 'success', 'classified' : [{'label' : label, 'confidence' : 0.9, 'xmin' : frame_idx, 'ymin' : 0, 'xmax' : frame_idx + 1, 'ymax' : 1}]}
+            for frame_idx in range(start, stop) if frame_idx > 0 and frame_idx % sample_rate == 0]
+
+
+@pytest.fixture
+def queue(tmp_path) :
+    q = WorkQueue(str(tmp_path / "queue.db"), lease_secs=0.2, max_attempts=2)
+    q.enqueue("job", "frames", "/videos/a.mp4", [{'start' : 0}])
+    yield q
+    q.close()
+
+
+def test_expired_lease_is_leased_again(queue) :
+    assert len(queue.lease("worker-a")) == 1
+    assert queue.lease("worker-b") == []
+    time.sleep(0.3)
+    items = queue.lease("worker-b")
+    assert [(item['id'], item['attempts']) for item in items] == [(1, 2)]
+    # worker-a lost the lease
+    assert not queue.renew(1, "worker-a")
+    assert queue.renew(1, "worker-b")
+
+
+def test_max_attempts_ends_failed(queue) :
+    for i in range(2) :
+        item = queue.lease("worker-a")[0]
+        queue.fail(item['id'], "worker-a", "boom")
+    assert queue.lease("worker-a") == []
+    assert queue.stats("job")['failed'] == 1
+
+
+def test_expired_leases_use_up_attempts(queue) :
+    for i in range(2) :
+        assert len(queue.lease("worker-a")) == 1
+        time.sleep(0.3)
+    assert queue.lease("worker-a") == []
+    assert queue.stats("job")['failed'] == 1
+
+
+def test_retry_failed(queue) :
+    for i in range(2) :
+        queue.fail(queue.lease("worker-a")[0]['id'], "worker-a", "boom")
+    assert queue.retry_failed("job") == 1
+    assert queue.stats("job")['pending'] == 1
+    assert [item['attempts'] for item in queue.lease("worker-a")] == [1]
+
+
+def test_complete_after_lost_lease(queue) :
+    queue.lease("worker-a")
+    time.sleep(0.3)
+    queue.lease("worker-b")
+    # the first worker still finishes the item, the second one's result is not needed
+    assert queue.complete(1, "worker-a", "a.json")
+    assert not queue.complete(1, "worker-b", "b.json")
+    assert queue.items("job")[0]['result_fn'] == "a.json"
+    assert queue.stats("job")['done'] == 1
+
+
+def test_failed_requests_fail_the_item(tmp_path, monkeypatch) :
+    video_fn = str(tmp_path / "cam" / "day.mp4")
+    _write_video(video_fn, 20)
+    db_path = str(tmp_path / "queue.db")
+    queue = WorkQueue(db_path)
+    plan_videos(queue, "job", [video_fn], "http://model", sample_rate=5, chunk_frames=10)
+    queue.close()
+    monkeypatch.setattr(ivi_video, "_score_segment", lambda *args, **kwargs : [None] + _fake_score_segment(*args)[1:])
+
+    assert run_worker(db_path, max_attempts=1) == 0
+    queue = WorkQueue(db_path)
+    assert queue.stats("job") == {'pending' : 0, 'leased' : 0, 'done' : 0, 'failed' : 2}
+    queue.close()
+
+
+def test_merge_slots_across_chunks(tmp_path, monkeypatch) :
+    # 47 frames, every 3rd : slots 0..14 are frames 3..45, chunks of 9 frames
+    video_fn = str(tmp_path / "cam" / "day.mp4")
+    _write_video(video_fn, 47)
+    db_path = str(tmp_path / "queue.db")
+    queue = WorkQueue(db_path)
+    assert plan_videos(queue, "job", [video_fn], "http://model", sample_rate=3, chunk_frames=10) == 6
+    queue.close()
+    monkeypatch.setattr(ivi_video, "_score_segment", _fake_score_segment)
+
+    assert run_worker(db_path) == 6
+    merge_results(db_path, "job", str(tmp_path / "out"))
+    cache = ResultsCache(str(tmp_path / "out" / "day" / "cache"))
+    assert len(cache) == 15
+    for k in range(15) :
+        assert cache.status(k) == STATUS_OK
+        assert cache.boxes(k).coords[0][0] == (k + 1) * 3
+
+
+def test_merge_same_name_sources(tmp_path, monkeypatch) :
+    video_fns = [str(tmp_path / "cam1" / "day.mp4"), str(tmp_path / "cam2" / "day.mp4"), str(tmp_path / "cam2" / "night.mp4")]
+    for fn in video_fns :
+        _write_video(fn, 10)
+    db_path = str(tmp_path / "queue.db")
+    queue = WorkQueue(db_path)
+    plan_videos(queue, "job", video_fns, "http://model", sample_rate=2)
+    for name in ["set1", "set2"] :
+        queue.enqueue("job", "images", str(tmp_path / name / "ds"), [{'files' : []}])
+    queue.close()
+    monkeypatch.setattr(ivi_video, "_score_segment", _fake_score_segment)
+    real_score_item = ivi_jobs._score_item
+    def score_item(item, num_threads) :
+        if(item['kind'] == "images") :
+            return {item['source'] : {'result' : 'success', 'classified' : []}}
+        return real_score_item(item, num_threads)
+    monkeypatch.setattr(ivi_jobs, "_score_item", score_item)
+
+    run_worker(db_path)
+    out_dir = str(tmp_path / "out")
+    merge_results(db_path, "job", out_dir)
+
+    outputs = sorted(os.listdir(out_dir))
+    day_dirs = [d for d in outputs if d.startswith("day_")]
+    assert len(day_dirs) == 2 and "night" in outputs
+    labels = sorted(ResultsCache(os.path.join(out_dir, d, "cache")).boxes(0).labels[0] for d in day_dirs)
+    assert labels == ["cam1", "cam2"]
+    image_outputs = [fn for fn in outputs if fn.endswith(".fetch_scores.json")]
+    assert len(image_outputs) == 2
+    assert sorted(list(json.loads(open(os.path.join(out_dir, fn)).read()).keys())[0] for fn in image_outputs) == \
+           sorted([str(tmp_path / "set1" / "ds"), str(tmp_path / "set2" / "ds")])
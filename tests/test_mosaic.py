@@ -0,0 +1,19 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import ivi_mosaic
+from ivi_mosaic import MosaicBatcher
+
+
+def test_counts_from_concurrent_threads(monkeypatch) :
+    monkeypatch.setattr(ivi_mosaic, "post_image_to_paiv", lambda url, img_bytes, fn, thr_id=0 : {'result' : 'success', 'classified' : []})
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try :
+        batcher = MosaicBatcher("http://model", grid=(2,2), tile_size=(16,16))
+        frames = [np.zeros((16, 16, 3), dtype=np.uint8)] * 3
+        with ThreadPoolExecutor(max_workers=8) as pool :
+            list(pool.map(lambda i : batcher.score(frames), range(400)))
+    finally :
+        sys.setswitchinterval(switch_interval)
+    assert (batcher.requests, batcher.frames) == (400, 1200)
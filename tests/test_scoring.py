@@ -0,0 +1,47 @@
+import os
+import threading
+import cv2
+import numpy as np
+from ivi_scoring import fetch_scores_multi
+
+XML = '''<annotation><object><name>logo</name><bndbox><xmin>10</xmin><ymin>10</ymin><xmax>40</xmax><ymax>40</ymax></bndbox></object></annotation>'''
+UNREACHABLE = ["http://127.0.0.1:1/model-a", "http://127.0.0.1:1/model-b"]
+
+
+def test_fetch_scores_multi_unreachable_models_return(tmp_path) :
+    # more work items than the bounded queue holds, every request fails
+    data_dir = str(tmp_path / "ds")
+    os.makedirs(data_dir)
+    for i in range(40) :
+        cv2.imwrite(os.path.join(data_dir, "img{}.png".format(i)), np.full((32, 32, 3), i, dtype=np.uint8))
+        open(os.path.join(data_dir, "img{}.xml".format(i)), 'w').write(XML)
+
+    rv = {}
+    def run() :
+        rv['scores'] = fetch_scores_multi(UNREACHABLE, "object", num_threads=1, image_dir=data_dir,
+                                          paiv_results_file=str(tmp_path / "compare_scores.json"))
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    t.join(60)
+    assert not t.is_alive()
+
+    results = rv['scores']['results']
+    assert len(results) == 40
+    assert all(s == {'empty_url' : 'fetch failed'} for entry in results.values() for s in entry['scores'])
+
+
+def test_fetch_scores_tiling_shuts_down_tile_threads(tmp_path, monkeypatch) :
+    import ivi_tiling
+    from ivi_scoring import fetch_scores
+    video_fn = str(tmp_path / "video.mp4")
+    out = cv2.VideoWriter(video_fn, cv2.VideoWriter_fourcc(*"mp4v"), 30, (128, 96))
+    for i in range(12) :
+        out.write(np.full((96, 128, 3), i, dtype=np.uint8))
+    out.release()
+    monkeypatch.setattr(ivi_tiling, "get_json_from_paiv", lambda url, img, fn, thr_id=0 : {'result' : 'success', 'classified' : []})
+
+    before = threading.active_count()
+    for i in range(3) :
+        fetch_scores("http://model", "object", media_mode="video", num_threads=2, frame_limit=12, sample_rate=2, video_fn=video_fn,
+                     paiv_results_file=None, tiling={'tile_size' : (64, 64), 'num_threads' : 4})
+    assert threading.active_count() == before
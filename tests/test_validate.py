@@ -0,0 +1,30 @@
+import json
+import os
+import cv2
+import numpy as np
+from ivi_common import get_np_hash
+from ivi_validate import validate_model
+
+XML = '''<annotation><object><name>logo</name><bndbox><xmin>{}</xmin><ymin>{}</ymin><xmax>{}</xmax><ymax>{}</ymax></bndbox></object></annotation>'''
+
+
+def _object_dataset(data_dir, count=3) :
+    # count images with one labeled box each, and fetch_scores style results that find the box
+    os.makedirs(data_dir)
+    results = {}
+    for i in range(count) :
+        img = np.full((64, 64, 3), 40 * i, dtype=np.uint8)
+        cv2.imwrite(os.path.join(data_dir, "img{}.png".format(i)), img)
+        open(os.path.join(data_dir, "img{}.xml".format(i)), 'w').write(XML.format(10, 10, 40, 40))
+        results[get_np_hash(img)] = {'classified' : [{'label' : 'logo', 'confidence' : 0.9, 'xmin' : 10, 'ymin' : 10, 'xmax' : 40, 'ymax' : 40}]}
+    return results
+
+
+def test_validate_model_relative_image_dir(tmp_path, monkeypatch) :
+    results = _object_dataset(str(tmp_path / "ds"))
+    (tmp_path / "fetch_scores.json").write_text(json.dumps(results))
+    monkeypatch.chdir(tmp_path)
+
+    validate_model("fetch_scores.json", "ds", "object", num_resamples=0)
+    # the working directory is left alone
+    assert os.getcwd() == str(tmp_path)